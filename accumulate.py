@@ -0,0 +1,216 @@
+import os
+import sys
+import numpy as np
+import kitti_calib
+import velo_scan
+
+# accumulate.py
+# 功能: 利用位姿把前后 ±N 帧点云叠加到当前帧, 得到更稠密的投影/深度图
+# 1.位姿来自 KITTI odometry 的 poses.txt (相机0位姿), 或 OXTS (IMU位姿, 经 Tr_imu_to_velo 转到雷达)
+# 2.点云转到世界坐标后按体素聚合: 体素坐标打包成 int64 键, 有序数组 + searchsorted 实现插入/删除
+# 3.滑动窗口: 每前进一帧只加入新进入窗口的一帧、删除移出窗口的一帧, 不重新聚合整个窗口
+# 4.输出为体素内点的质心 (反射率取平均), 再变换到当前帧的雷达坐标系
+# 5.只用于连续序列 (KITTI odometry 序列或 raw drive, 见 frame_source.KittiSequenceSource);
+#   object split 的帧号不是时间上相邻的帧
+# 注意: 运动物体会在叠加后拖出轨迹
+
+VOXEL_SIZE = 0.1
+WINDOW_RADIUS = 5
+# 逐块变换和体素化的点数, 不为整帧生成 float64 副本
+CHUNK_POINTS = 1 << 16
+# 每个坐标轴的体素编号占21位 (有符号范围 ±2^20)
+_KEY_BITS = 21
+_KEY_OFFSET = 1 << (_KEY_BITS - 1)
+_KEY_MASK = (1 << _KEY_BITS) - 1
+EARTH_RADIUS = 6378137.0
+
+
+def voxel_keys(xyz, voxel_size):
+    """int64 key of the voxel containing each point."""
+    idx = np.floor(xyz / voxel_size).astype(np.int64) + _KEY_OFFSET
+    if idx.size and (idx.min() < 0 or idx.max() > _KEY_MASK):
+        raise ValueError('points are too far from the origin for the voxel key range')
+    return (idx[:, 0] << (2 * _KEY_BITS)) | (idx[:, 1] << _KEY_BITS) | idx[:, 2]
+
+
+def voxelize(points, voxel_size):
+    """Per-voxel (sorted unique keys, sums of [x, y, z, intensity] as float64, point counts)."""
+    keys = voxel_keys(points[:, :3], voxel_size)
+    uniq, inverse = np.unique(keys, return_inverse=True)
+    inverse = inverse.ravel()
+    sums = np.empty((len(uniq), 4))
+    for col in range(min(points.shape[1], 4)):
+        sums[:, col] = np.bincount(inverse, weights=points[:, col], minlength=len(uniq))
+    if points.shape[1] < 4:
+        sums[:, 3] = 0
+    counts = np.bincount(inverse, minlength=len(uniq)).astype(np.int64)
+    return uniq, sums, counts
+
+
+class VoxelGrid:
+    """Voxel sums and counts under sorted int64 keys, updated in place by insert/remove."""
+
+    def __init__(self, voxel_size=VOXEL_SIZE):
+        self.voxel_size = voxel_size
+        self.keys = np.empty(0, dtype=np.int64)
+        self.sums = np.empty((0, 4))
+        self.counts = np.empty(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _find(self, keys):
+        pos = np.searchsorted(self.keys, keys)
+        found = pos < len(self.keys)
+        found[found] = self.keys[pos[found]] == keys[found]
+        return pos, found
+
+    def insert(self, keys, sums, counts):
+        """Add the voxelized contribution of one scan (keys unique and sorted)."""
+        pos, found = self._find(keys)
+        hit = pos[found]
+        self.sums[hit] += sums[found]
+        self.counts[hit] += counts[found]
+        new = ~found
+        if np.any(new):
+            at = pos[new]
+            self.keys = np.insert(self.keys, at, keys[new])
+            self.sums = np.insert(self.sums, at, sums[new], axis=0)
+            self.counts = np.insert(self.counts, at, counts[new])
+
+    def remove(self, keys, sums, counts):
+        """Subtract a contribution added earlier; voxels left without points are dropped."""
+        pos, found = self._find(keys)
+        if not np.all(found):
+            raise KeyError('removing voxels that were never inserted')
+        self.sums[pos] -= sums
+        self.counts[pos] -= counts
+        keep = self.counts > 0
+        if not np.all(keep):
+            self.keys = self.keys[keep]
+            self.sums = self.sums[keep]
+            self.counts = self.counts[keep]
+
+    def centroids(self):
+        """(M, 4) float64 [x, y, z, mean intensity] of every voxel."""
+        return self.sums / self.counts[:, None]
+
+
+def transform(points, mat):
+    """Apply a 4x4 transform to the xyz of (N, 3+) points (float64 result, extra columns kept)."""
+    res = np.array(points, dtype=np.float64)
+    res[:, :3] = points[:, :3].dot(mat[:3, :3].T) + mat[:3, 3]
+    return res
+
+
+def read_poses_file(path):
+    """KITTI odometry poses.txt: one row-major 3x4 camera-0 pose per line -> (F, 4, 4)."""
+    data = np.loadtxt(path, dtype=np.float64).reshape(-1, 3, 4)
+    poses = np.tile(np.eye(4), (len(data), 1, 1))
+    poses[:, :3, :] = data
+    return poses
+
+
+def oxts_pose(packet, scale):
+    """IMU pose (4x4) of one OXTS packet (lat, lon, alt, roll, pitch, yaw, ...), as in the KITTI devkit."""
+    lat, lon, alt, roll, pitch, yaw = packet[:6]
+    # 墨卡托投影
+    tx = scale * lon * np.pi * EARTH_RADIUS / 180
+    ty = scale * EARTH_RADIUS * np.log(np.tan((90 + lat) * np.pi / 360))
+    Rx = np.array([[1, 0, 0], [0, np.cos(roll), -np.sin(roll)], [0, np.sin(roll), np.cos(roll)]])
+    Ry = np.array([[np.cos(pitch), 0, np.sin(pitch)], [0, 1, 0], [-np.sin(pitch), 0, np.cos(pitch)]])
+    Rz = np.array([[np.cos(yaw), -np.sin(yaw), 0], [np.sin(yaw), np.cos(yaw), 0], [0, 0, 1]])
+    pose = np.eye(4)
+    pose[:3, :3] = Rz.dot(Ry.dot(Rx))
+    pose[:3, 3] = (tx, ty, alt)
+    return pose
+
+
+def read_oxts(oxts_dir, names):
+    """IMU poses (F, 4, 4) from <oxts_dir>/<name>.txt, relative to the first frame."""
+    packets = [np.loadtxt(os.path.join(oxts_dir, f'{name}.txt'), dtype=np.float64).ravel() for name in names]
+    scale = np.cos(packets[0][0] * np.pi / 180)
+    poses = np.stack([oxts_pose(p, scale) for p in packets])
+    return np.matmul(np.linalg.inv(poses[0]), poses)
+
+
+def velo_poses(calib, poses_file=None, oxts_dir=None, names=None):
+    """Lidar poses (F, 4, 4) in a common world frame, from a poses file or OXTS packets.
+
+    poses.txt holds camera-0 poses: T_world_velo = pose * Tr_velo_to_cam.
+    OXTS gives IMU poses: T_world_velo = T_world_imu * inv(Tr_imu_to_velo).
+    """
+    if poses_file is not None:
+        return np.matmul(read_poses_file(poses_file), kitti_calib.to_homogeneous(calib.Tr_velo_to_cam))
+    if oxts_dir is not None:
+        if calib.Tr_imu_to_velo is None:
+            raise ValueError('calib has no Tr_imu_to_velo')
+        return np.matmul(read_oxts(oxts_dir, names), np.linalg.inv(kitti_calib.to_homogeneous(calib.Tr_imu_to_velo)))
+    raise ValueError('either poses_file or oxts_dir is required')
+
+
+class SlidingWindow:
+    """Scans i-radius .. i+radius merged into a VoxelGrid, maintained incrementally.
+
+    load_fn(j) returns scan j as (N, 4) in its own lidar frame; poses[j] maps it to the world.
+    Moving the window by one frame inserts one scan and removes one.
+    """
+
+    def __init__(self, load_fn, poses, radius=WINDOW_RADIUS, voxel_size=VOXEL_SIZE):
+        self.load_fn = load_fn
+        self.poses = np.asarray(poses, dtype=np.float64)
+        self.radius = radius
+        self.grid = VoxelGrid(voxel_size)
+        # 窗口内每一帧的体素贡献, 移出窗口时从网格中减去
+        self._contrib = {}
+
+    def _add(self, j):
+        part = VoxelGrid(self.grid.voxel_size)
+        for chunk in velo_scan.iter_chunks(np.asarray(self.load_fn(j)), CHUNK_POINTS):
+            part.insert(*voxelize(transform(chunk, self.poses[j]), self.grid.voxel_size))
+        contrib = (part.keys, part.sums, part.counts)
+        self.grid.insert(*contrib)
+        self._contrib[j] = contrib
+
+    def _remove(self, j):
+        self.grid.remove(*self._contrib.pop(j))
+
+    def move_to(self, i):
+        window = range(max(0, i - self.radius), min(len(self.poses), i + self.radius + 1))
+        for j in [j for j in self._contrib if j not in window]:
+            self._remove(j)
+        for j in window:
+            if j not in self._contrib:
+                self._add(j)
+
+    def cloud(self, i):
+        """Merged (M, 4) float32 cloud of the window around frame i, in frame i's lidar coordinates."""
+        self.move_to(i)
+        return transform(self.grid.centroids(), np.linalg.inv(self.poses[i])).astype(np.float32)
+
+
+def accumulate_source(source, poses, radius=WINDOW_RADIUS, voxel_size=VOXEL_SIZE, start=0, stop=None):
+    """Yield frames of source whose points are replaced by the accumulated window cloud.
+
+    source must be sequential (e.g. frame_source.KittiSequenceSource): neighbouring indices
+    are neighbouring scans in time.
+    """
+    if not source.sequential:
+        raise ValueError(f'{type(source).__name__} is not a time sequence; use a KittiSequenceSource')
+    if len(poses) != len(source):
+        raise ValueError(f'{len(poses)} poses for {len(source)} frames')
+    window = SlidingWindow(lambda j: source[j].points, poses, radius, voxel_size)
+    for i in range(*slice(start, stop).indices(len(source))):
+        frame = source[i]
+        frame.points = window.cloud(i)
+        yield frame
+
+
+def main():
+    # 序列目录、位姿来源、输出模式等由命令行给出: python3 cli.py accumulate ... (见 cli.py)
+    import cli
+    cli.main(['accumulate'] + sys.argv[1:])
+
+
+if __name__ == '__main__':
+    main()
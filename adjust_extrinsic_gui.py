@@ -1,42 +1,60 @@
+import sys
 import tkinter as tk
 from tkinter import ttk
 import cv2
 from PIL import Image, ImageTk
 import numpy as np
-import yaml
 import datetime
+from concurrent.futures import ThreadPoolExecutor
 import proj_pcd2cam
-import glob
-import os
-from tqdm import tqdm
+import projection
+import frame_source
+import frame_cache
+import distortion
+import prefilter
+import pixel_index
+
+# 显示缩放比例, 点的半径 (原图像素)
+DISPLAY_SCALE = 0.5
+POINT_RADIUS = 10
+DISPLAY_SCALE_MAT = np.diag([DISPLAY_SCALE, DISPLAY_SCALE, 1.0])
+# 滑块事件合并的渲染间隔 (ms)
+RENDER_INTERVAL_MS = 15
+# 预读前后帧数, 帧缓存上限 (字节), 后台读取结果的轮询间隔 (ms)
+PREFETCH_RADIUS = 8
+PREFETCH_BYTES = 1 << 30
+LOADER_POLL_MS = 20
+# 自动优化外参使用的帧数; 优化的进程池用 spawn 启动: fork 会在Tk主循环和读取线程运行时复制进程
+REFINE_FRAMES = 10
+REFINE_MP_CONTEXT = 'spawn'
+# 投影前的视锥剔除, 视野四周各放宽一半, 滑块调整外参后移入画面的点不会被剔除
+POINT_FILTER = prefilter.PointFilter(margin=0.5)
+# 鼠标悬停时查找最近投影点的最大距离 (显示像素)
+HOVER_RADIUS = 15
 
 class ExtrinsicAdjuster:
-    def __init__(self, window, img_dir, pointcloud_dir, calib_path):
+    def __init__(self, window, source, calib_path, convention=None):
         self.window = window
         self.window.title("Lidar2Image Extrinsic Mat Adjuster")
+        # 外参约定 'autoware' / 'standard' (见 proj_pcd2cam.py)
+        self.convention = convention
 
-        self.img_ext = '.jpg'
-        self.pt_ext = '.pcd'
-        self.images_file = []
-        self.img_dir = img_dir
-        self.pointcloud_dir = pointcloud_dir
-        for file_path in glob.glob(os.path.join(img_dir, f'*{self.img_ext}')):
-            self.images_file.append(os.path.splitext(os.path.basename(file_path))[0])
-
-        self.pointcloud_file = []
-        for file_path in glob.glob(os.path.join(pointcloud_dir, f'*{self.pt_ext}')):
-            self.pointcloud_file.append(os.path.splitext(os.path.basename(file_path))[0])
-
-        self.images_file.sort(key=lambda x: int(x))
-        self.pointcloud_file.sort(key=lambda x: int(x))
+        # 任意数据源 (frame_source.FrameSource): 图像目录+点云目录, 或时间同步清单; 帧索引只建立一次
+        # 不做投影前过滤, 加载时按 POINT_FILTER 过滤
+        self.source = source
+        self.images_file = self.source.names
 
         self.file_num = 0
-        image_path = os.path.join(img_dir, self.images_file[self.file_num] + self.img_ext)
-        pointcloud_path = os.path.join(pointcloud_dir, self.pointcloud_file[self.file_num] + self.pt_ext)
 
-        # Load the image using OpenCV
-        self.original_image = cv2.imread(image_path)
-        self.image = self.original_image.copy()
+        # 滑块事件合并: 拖动时只渲染最新的参数
+        self._render_job = None
+        self.tk_image = None
+        self._proj_buffer = projection.ProjectionBuffer()
+
+        # 后台线程预读前后若干帧, 读取结果在主线程中通过 after() 取回
+        self.loader = frame_cache.FramePrefetcher(self.load_frame, len(self.images_file),
+                                                  max_bytes=PREFETCH_BYTES, radius=PREFETCH_RADIUS)
+        self.set_frame(self.loader.load_now(self.file_num))
 
         def create_slider(label_text, from_, to_, command):
             frame = ttk.Frame(window)
@@ -78,6 +96,12 @@ class ExtrinsicAdjuster:
         # Create a label to display the image
         self.image_label = ttk.Label(window)
         self.image_label.pack()
+        # 鼠标悬停: 显示最近的投影点 (投影点上的网格索引, 见 pixel_index.py)
+        self.proj = None
+        self.pixel_grid = None
+        self.hover_label = ttk.Label(window, text="")
+        self.hover_label.pack()
+        self.image_label.bind("<Motion>", self.on_hover)
 
         # Create a save button
         self.save_button = ttk.Button(window, text="Save Extrinsic", command=self.save_extrinsic)
@@ -88,12 +112,60 @@ class ExtrinsicAdjuster:
         self.save_button.pack()
         self.save_button = ttk.Button(window, text="Prev Image", command=self.prev_img)
         self.save_button.pack()
+        self.save_button = ttk.Button(window, text="Auto Refine", command=self.auto_refine)
+        self.save_button.pack()
+        # 自动优化在单独的后台线程中运行 (不占用预读线程), 进度和得分显示在这里
+        self._refine_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='refine')
+        self._refine_future = None
+        self._refine_status = None
+        self.refine_label = ttk.Label(window, text="")
+        self.refine_label.pack()
 
         # Initialize the image on the label
+        self.calib_path = calib_path
         self.intrisic, self.extrinsic= proj_pcd2cam.get_calib_param(calib_path)
+        # 镜头畸变 (plumb_bob), 投影后的点按显示分辨率的内参加畸变
+        self.dist_coeffs = proj_pcd2cam.get_distortion_param(calib_path)
+        if not distortion.has_distortion(self.dist_coeffs):
+            self.dist_coeffs = None
+        self.display_camera_mat = DISPLAY_SCALE_MAT.dot(self.intrisic[:3, :3])
         self.new_extrinsic = self.extrinsic.copy()
-        self.pointcloud = proj_pcd2cam.load_pcd_data(pointcloud_path)
         self.update_extrinsic()
+        self.loader.prefetch(self.file_num)
+        self.window.after(LOADER_POLL_MS, self.poll_loader)
+
+    def load_frame(self, index):
+        # 在后台线程中执行, 不能访问Tk控件
+        frame = self.source[index].load()
+        # 每帧只过滤一次: 剔除相机视野 (见 POINT_FILTER) 以外的点, 之后每次拖动滑块只投影剩下的点
+        h, w = frame.image_size
+        pointcloud = POINT_FILTER(frame.points, frame.proj_mat(), w, h)
+        return {
+            'image': frame.image,
+            'display_image': to_display_image(frame.image),
+            'pointcloud': pointcloud,
+            # 与滑块无关的部分只算一次: 连续的 float32 xyz
+            'points_xyz': np.ascontiguousarray(pointcloud[:, :3], dtype=np.float32),
+        }
+
+    def set_frame(self, frame):
+        self.original_image = frame['image']
+        self.image = self.original_image
+        self.display_image = frame['display_image']
+        self.pointcloud = frame['pointcloud']
+        self.points_xyz = frame['points_xyz']
+        # 新帧投影之前, 旧的索引不再对应当前的点
+        self.pixel_grid = None
+
+    def poll_loader(self):
+        # 取回后台读取完成的帧, 只显示当前选中的那一帧
+        for index, frame, error in self.loader.poll():
+            if error is not None:
+                print(f"failed to load frame {index}: {error}")
+            elif index == self.file_num:
+                self.set_frame(frame)
+                self.update_extrinsic()
+        self.window.after(LOADER_POLL_MS, self.poll_loader)
     
     def next_img(self):
         if(self.file_num+1<len(self.images_file)):
@@ -112,12 +184,11 @@ class ExtrinsicAdjuster:
         self.refresh_image()
 
     def refresh_image(self):
-        image_path = os.path.join(self.img_dir, self.images_file[self.file_num] + self.img_ext)
-        pointcloud_path = os.path.join(self.pointcloud_dir, self.pointcloud_file[self.file_num] + self.pt_ext)
-        self.pointcloud = proj_pcd2cam.load_pcd_data(pointcloud_path)
-        self.original_image = cv2.imread(image_path)
-        self.image = self.original_image.copy()
-        self.update_extrinsic()
+        # 命中缓存立即显示, 否则等待后台读取完成后由 poll_loader 显示
+        frame = self.loader.request(self.file_num)
+        if frame is not None:
+            self.set_frame(frame)
+            self.update_extrinsic()
 
     def refresh_extrinsic(self):
         self.alpha_scale.set(0)
@@ -129,21 +200,61 @@ class ExtrinsicAdjuster:
         self.update_extrinsic()
     
     def save_extrinsic(self):
-        data_to_save = {
-            "CameraMat": {
-                "rows": 3,
-                "cols": 3,
-                "dt": "d",  # 数据类型, 这里假设是 'd' (double)
-                "data": self.new_extrinsic.tolist()  # 将 NumPy 数组转换为列表
-            }
-        }
         current_time = datetime.datetime.now()
-        # 将数组写入 YAML 文件
-        with open(f'{current_time}extrinsic.yaml', 'w') as file:
-            yaml.dump(data_to_save, file)
+        # 按Autoware标定文件格式保存, 外参写入 CameraExtrinsicMat, 内参和畸变参数沿用原标定文件
+        proj_pcd2cam.save_calib_param(f'{current_time}extrinsic.yaml', self.new_extrinsic, self.calib_path)
         print("Extrinsic save successfully!")
 
+    def auto_refine(self):
+        # 以当前滑块调整后的外参为初值, 用当前帧前后若干帧自动优化 (见 extrinsic_refine.py)
+        # 读取和搜索都交给后台线程, 界面不卡住; 结果由 poll_refine 在主线程中取回
+        if self._refine_future is not None:
+            return
+        start = max(0, self.file_num - REFINE_FRAMES // 2)
+        self._refine_status = "refining: loading frames ..."
+        self.refine_label.configure(text=self._refine_status)
+        self._refine_future = self._refine_executor.submit(self.run_refine, start, self.new_extrinsic.copy())
+        self.window.after(LOADER_POLL_MS, self.poll_refine)
+
+    def run_refine(self, start, extrinsic):
+        # 在后台线程中执行, 不能访问Tk控件
+        import extrinsic_refine
+        frames = list(self.source.stream(start, start + REFINE_FRAMES))
+        problem = extrinsic_refine.RefineProblem(frames, self.intrisic, extrinsic, self.dist_coeffs,
+                                                 convention=self.convention)
+        self._refine_status = f"refining: {problem.num_frames} frames, {len(problem.xyz)} edge points, searching ..."
+        return extrinsic_refine.refine(problem, verbose=False, mp_context=REFINE_MP_CONTEXT,
+                                       progress=self.set_refine_progress)
+
+    def set_refine_progress(self, rot_step, trans_step, score):
+        # 在后台线程中执行: 只记录最新进度, 由 poll_refine 显示
+        self._refine_status = f"refining: score {score:.4f} at step rot {rot_step:.4f} rad, trans {trans_step:.3f} m"
+
+    def poll_refine(self):
+        future = self._refine_future
+        if not future.done():
+            self.refine_label.configure(text=self._refine_status)
+            self.window.after(LOADER_POLL_MS, self.poll_refine)
+            return
+        self._refine_future = None
+        try:
+            extrinsic, report = future.result()
+        except Exception as e:
+            self.refine_label.configure(text=f"refine failed: {e}")
+            return
+        self.refine_label.configure(text=f"refine score {report['initial_score']:.4f} -> {report['final_score']:.4f} "
+                                         f"({report['frames']} frames)")
+        self.extrinsic = extrinsic
+        self.new_extrinsic = self.extrinsic.copy()
+        self.refresh_extrinsic()
+
     def update_extrinsic(self, _=None):
+        # 滑块事件只登记一次渲染任务, 之后的事件在渲染前都被合并 (latest wins)
+        if self._render_job is None:
+            self._render_job = self.window.after(RENDER_INTERVAL_MS, self.render)
+
+    def render(self):
+        self._render_job = None
         # Adjust the rotation parameters
         alpha, beta, gamma = self.alpha_scale.get(), self.beta_scale.get(), self.gamma_scale.get()
         x, y, z = self.x_scale.get(), self.y_scale.get(), self.z_scale.get()
@@ -174,43 +285,98 @@ class ExtrinsicAdjuster:
         self.new_extrinsic[1, 3] = self.extrinsic[1, 3] + y
         self.new_extrinsic[2, 3] = self.extrinsic[2, 3] + z
 
-        point_on_img, reflectance = proj_pcd2cam.get_pointcloud_on_image(self.intrisic, self.new_extrinsic, self.pointcloud)
-        
-        u, v, z = point_on_img
-        
-        # adjusted_image = cv2.merge([self.image[:,:,0] * b, self.image[:,:,1] * g, self.image[:,:,2] * r])
+        # 直接按显示分辨率投影: 缩放矩阵乘到投影矩阵上, 不再先画全分辨率图像再缩小
+        proj_mat = DISPLAY_SCALE_MAT.dot(proj_pcd2cam.get_projection_matrix(self.intrisic, self.new_extrinsic,
+                                                                           self.convention))
+        disp_h, disp_w = self.display_image.shape[:2]
+        if self.dist_coeffs is None:
+            proj = projection.project_points(proj_mat, self.points_xyz, disp_w, disp_h, out=self._proj_buffer)
+        else:
+            proj = projection.project_points(proj_mat, self.points_xyz, out=self._proj_buffer)
+            proj = distortion.distort_projection(proj, self.display_camera_mat, self.dist_coeffs, disp_w, disp_h)
 
-        adjusted_image = draw_circle(self.image, u, v, z)
-        # Convert to PIL format and update the label
-        pil_image = Image.fromarray(cv2.cvtColor(adjusted_image.astype('uint8'), cv2.COLOR_BGR2RGB))
-        resize_pil_image = pil_image.resize((pil_image.size[0]//2, pil_image.size[1]//2))
-        tk_image = ImageTk.PhotoImage(resize_pil_image)
-        self.image_label.configure(image=tk_image)
-        self.image_label.image = tk_image
+        # 每次重新投影后重建网格索引 (O(N)), 悬停查询不再扫描所有点
+        self.proj = proj
+        if self.pixel_grid is not None and (self.pixel_grid.img_w, self.pixel_grid.img_h) == (disp_w, disp_h):
+            self.pixel_grid.rebuild(proj.u, proj.v)
+        else:
+            self.pixel_grid = pixel_index.PixelGrid(proj.u, proj.v, disp_w, disp_h)
 
-def draw_circle(image, u, v, z):
+        # display_image 为RGB, 点的颜色对应原来BGR中的蓝色通道
+        adjusted_image = draw_circle(self.display_image, proj.u, proj.v, proj.z,
+                                     radius=int(POINT_RADIUS * DISPLAY_SCALE), channel=2)
+        pil_image = Image.fromarray(adjusted_image)
+        if self.tk_image is not None and (self.tk_image.width(), self.tk_image.height()) == pil_image.size:
+            # 复用同一个PhotoImage, 避免每次新建Tk图像
+            self.tk_image.paste(pil_image)
+        else:
+            self.tk_image = ImageTk.PhotoImage(pil_image)
+            self.image_label.configure(image=self.tk_image)
+            self.image_label.image = self.tk_image
+
+    def on_hover(self, event):
+        if self.pixel_grid is None:
+            return
+        found = self.pixel_grid.nearest(event.x, event.y, HOVER_RADIUS)
+        if found is None:
+            self.hover_label.configure(text="")
+            return
+        i, _ = found
+        x, y, z, intensity = self.pointcloud[self.proj.index[i], :4]
+        self.hover_label.configure(text=f"point ({x:.2f}, {y:.2f}, {z:.2f})  intensity {intensity:.2f}  "
+                                        f"depth {self.proj.z[i]:.2f} m  pixel ({self.proj.u[i] / DISPLAY_SCALE:.0f}, "
+                                        f"{self.proj.v[i] / DISPLAY_SCALE:.0f})")
+
+def to_display_image(rgb):
+    # RGB原图 -> 显示分辨率, 每帧只做一次
+    h, w = rgb.shape[:2]
+    return cv2.resize(rgb, (int(w * DISPLAY_SCALE), int(h * DISPLAY_SCALE)), interpolation=cv2.INTER_AREA)
+
+def draw_circle(image, u, v, z, radius=10, channel=0):
+    # 向量化绘制半径为radius的实心圆, 不再逐点调用 cv2.circle:
+    # 1.每个像素只保留最近的点, 编码为 255 - 深度等级 (越近值越大)
+    # 2.用圆形核做灰度膨胀 (最大值滤波), 每个像素得到半径内最近点的编码
     adjusted_image = image.copy()
+    if len(u) == 0:
+        return adjusted_image
+    h, w = image.shape[:2]
+    ui = u.astype(np.intp)
+    vi = v.astype(np.intp)
+    inside = (ui >= 0) & (ui < w) & (vi >= 0) & (vi < h)
     max_in_z = np.max(z)
-    z = z/max_in_z
-    for i in range(len(u)):
-        color = (255 * z[i], 0, 0)
-        cv2.circle(adjusted_image, (int(u[i]), int(v[i])), radius=10, color=color, thickness=-1)
+    level = (z[inside] / max_in_z * 254).astype(np.uint8)
+    code = np.zeros(h * w, dtype=np.uint8)
+    np.maximum.at(code, vi[inside] * w + ui[inside], 255 - level)
+    code = code.reshape(h, w)
+    if radius > 0:
+        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * radius + 1, 2 * radius + 1))
+        code = cv2.dilate(code, kernel)
+    mask = code > 0
+    color = np.zeros((np.count_nonzero(mask), adjusted_image.shape[2]), dtype=np.uint8)
+    color[:, channel] = 255 - code[mask]
+    adjusted_image[mask] = color
     return adjusted_image
 
-# Main function to create the GUI
-def main():
-
-    # img_dir = 'ros_data/image'
-    # pointcloud_dir = 'ros_data/pointcloud/'
+# 默认使用 create_data.py 时间同步后的数据
+IMG_DIR = 'correspond_data/image'
+POINTCLOUD_DIR = 'correspond_data/pointcloud'
+CALIB_FILE = 'ros_data/20231218_132035_autoware_lidar_camera_calibration.yaml'
 
-    img_dir = 'correspond_data/image'
-    pointcloud_dir = 'correspond_data/pointcloud'
-    calib_data_path = 'ros_data/20231218_132035_autoware_lidar_camera_calibration.yaml'
-    
+def run(source=None, calib_path=CALIB_FILE, convention=None):
+    # source: 任意 frame_source.FrameSource (例如 ManifestSource), 默认为 IMG_DIR / POINTCLOUD_DIR 按顺序配对
+    if source is None:
+        source = frame_source.PcdSource(IMG_DIR, POINTCLOUD_DIR, calib_path, extrinsic_convention=convention)
     root = tk.Tk()
-    
-    app = ExtrinsicAdjuster(root, img_dir, pointcloud_dir, calib_data_path)
+    app = ExtrinsicAdjuster(root, source, calib_path, convention)
     root.mainloop()
+    app.loader.shutdown()
+    app._refine_executor.shutdown(wait=False, cancel_futures=True)
+
+# Main function to create the GUI
+def main():
+    # 路径和外参约定由命令行给出: python3 cli.py calibrate --gui ... (见 cli.py)
+    import cli
+    cli.main(['calibrate', '--gui'] + sys.argv[1:])
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,182 @@
+import os
+import sys
+import json
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tqdm import tqdm
+import kitti_calib
+import proj_velo2cam
+import depth_export
+import prefilter
+import metrics
+
+# batch_project.py
+# 功能: 多进程批量投影整个KITTI split
+# 1.标定文件在主进程中按内容去重, 每个worker启动时只接收一次 (initializer), 任务中只传帧号和标定摘要
+# 2.任务按帧划分、可重复执行, 输出已存在的帧直接跳过, 中断后可以继续
+# 3.单帧失败只记录到报告中, 不影响其他帧
+# 4.mode='depth' 时导出稠密深度图/反射率图而不是绘制投影图, mode='boxes' 时导出每个标注框内点云的统计 (JSON)
+# 5.投影前先做视锥剔除, 可选距离/ROI裁剪和降采样 (见 prefilter.py); 可选点云紧凑缓存 (见 velo_scan.py)
+# 6.可选的逐帧统计 (见 metrics.py): 每个chunk结束时worker把统计数据传回主进程合并
+
+# main() 的 --mode 对应的 cli.py 子命令
+MODE_COMMANDS = {'render': 'project-kitti', 'depth': 'export-depth', 'boxes': 'box-stats'}
+
+# worker进程中的标定 {digest: KittiCalib}
+_worker_calibs = {}
+_worker_options = {}
+
+
+def _init_worker(calibs, options):
+    _worker_calibs.update(calibs)
+    _worker_options.update(options)
+    if options.get('metrics') is not None:
+        metrics.enable(**options['metrics'])
+
+
+def _process_chunk(tasks):
+    options = _worker_options
+    writer = None
+    if options['mode'] == 'depth' and options['fmt'] == 'shard':
+        # 每个chunk写一个shard
+        writer = depth_export.ShardWriter(options['out_dir'], shard_size=len(tasks))
+    results = []
+    for number, digest in tasks:
+        calib = _worker_calibs[digest]
+        try:
+            if options['mode'] == 'depth':
+                proj_velo2cam.export_depth_one_frame(number, options['out_dir'], options['fmt'], calib, writer,
+                                                     options['point_filter'], options['root'],
+                                                     options['scan_cache'], options['split'])
+            elif options['mode'] == 'boxes':
+                proj_velo2cam.export_box_stats_one_frame(number, options['out_dir'], calib, options['point_filter'],
+                                                         options['label_dir'], options['root'], options['scan_cache'],
+                                                         options['split'])
+            else:
+                proj_velo2cam.process_one_frame(number, options['backend'], options['radius'], calib,
+                                                options['point_filter'], options['root'], options['scan_cache'],
+                                                options['split'], options['fmt'])
+            results.append((number, None))
+        except Exception:
+            results.append((number, traceback.format_exc()))
+    if writer is not None:
+        writer.flush()
+    # 只传回这个chunk的统计 (取出后清空)
+    snapshot = metrics.get_recorder().snapshot(reset=True) if options.get('metrics') is not None else None
+    return results, snapshot
+
+
+def output_path(number, options):
+    if options['mode'] == 'boxes':
+        return proj_velo2cam.box_stats_path(number, options['out_dir'])
+    if options['mode'] == 'depth':
+        if options['fmt'] == 'shard':
+            # shard 没有逐帧的输出文件, 不能跳过已完成的帧
+            return None
+        return depth_export.output_path(options['out_dir'], number, options['fmt'])
+    return proj_velo2cam.projection_path(number, options['root'], options['split'], options['fmt'])
+
+
+def run_batch(numbers, workers=None, chunksize=16, ordered=False, skip_existing=True,
+              backend='numpy', radius=1, report_file=None, mode='render', fmt='png', out_dir=None,
+              point_filter=None, metrics_file=None, profile_top=0, profile_dir=None, label_dir=None, root='.',
+              scan_cache=None, split='testing'):
+    """Project every frame in numbers with a process pool.
+
+    mode 'render' writes projection images in fmt ('png' or 'jpg'), mode 'depth' exports dense depth/intensity
+    maps in fmt ('png', 'npz' or 'shard', see depth_export.py; shard runs cannot skip finished
+    frames and always re-export everything), mode 'boxes' writes the point
+    statistics of every KITTI label box in label_dir to out_dir/<frame>.json.
+    Returns a report dict with the processed, skipped and failed frames
+    (failed maps frame number to the traceback).
+    point_filter (prefilter.PointFilter) defaults to exact frustum culling only.
+    metrics_file (.json or .prom) / profile_top turn on per-frame instrumentation (see metrics.py);
+    the cProfile stats of the profile_top slowest frames are written to profile_dir.
+    Inputs and the default output directories are under the KITTI root and split (label_dir
+    defaults to the split's label_2, which only 'training' has); other paths are used as given
+    (relative to the current directory).
+    scan_cache: directory of compact velodyne caches (float16 xyz, see velo_scan.py), None reads the .bin files.
+    """
+    instrument = bool(metrics_file or profile_top)
+    options = {'mode': mode, 'backend': backend, 'radius': radius, 'fmt': fmt,
+               'out_dir': out_dir or (proj_velo2cam.default_box_stats_dir(root, split) if mode == 'boxes'
+                                      else proj_velo2cam.default_depth_dir(root, split)),
+               'label_dir': label_dir or proj_velo2cam.default_label_dir(root, split),
+               'root': root,
+               'split': split,
+               'scan_cache': scan_cache,
+               'point_filter': point_filter if point_filter is not None else prefilter.PointFilter(),
+               'metrics': {'profile_top': profile_top} if instrument else None}
+    if instrument:
+        # 主进程的 Recorder 汇总所有worker的统计
+        recorder = metrics.enable(profile_top=profile_top)
+    report = {'processed': [], 'skipped': [], 'failed': {}}
+    todo = []
+    for number in numbers:
+        path = output_path(number, options)
+        if skip_existing and path is not None and os.path.exists(path):
+            report['skipped'].append(number)
+        else:
+            todo.append(number)
+
+    # 主进程读取标定并按内容去重, 一个drive通常只有一份
+    calibs = {}
+    tasks = []
+    for number in todo:
+        try:
+            calib = kitti_calib.load_calib(proj_velo2cam.calib_path(number, root, split))
+        except Exception:
+            report['failed'][number] = traceback.format_exc()
+            continue
+        calibs[calib.digest] = calib
+        tasks.append((number, calib.digest))
+
+    chunks = [tasks[i:i + chunksize] for i in range(0, len(tasks), chunksize)]
+    workers = workers or os.cpu_count()
+
+    def collect(chunk_result, pbar):
+        results, snapshot = chunk_result
+        if snapshot is not None:
+            recorder.merge(snapshot)
+        for number, error in results:
+            if error is None:
+                report['processed'].append(number)
+            else:
+                report['failed'][number] = error
+        pbar.update(len(results))
+
+    with tqdm(total=len(tasks)) as pbar:
+        if workers <= 1:
+            _init_worker(calibs, options)
+            for chunk in chunks:
+                collect(_process_chunk(chunk), pbar)
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(calibs, options)) as executor:
+                futures = [executor.submit(_process_chunk, chunk) for chunk in chunks]
+                for future in (futures if ordered else as_completed(futures)):
+                    collect(future.result(), pbar)
+
+    if report['failed']:
+        print(f"{len(report['failed'])} frames failed: {sorted(report['failed'])[:10]}")
+    if instrument:
+        metrics.dump(metrics_file, profile_dir)
+        metrics.disable()
+    if report_file is not None:
+        with open(report_file, 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def main():
+    # --mode 选择子命令: render -> project-kitti, depth -> export-depth, boxes -> box-stats (见 cli.py)
+    import cli
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--mode', default='render', choices=sorted(MODE_COMMANDS))
+    args, rest = parser.parse_known_args(sys.argv[1:])
+    cli.main([MODE_COMMANDS[args.mode]] + rest)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,429 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import itertools
+import contextlib
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import kitti_calib
+import pcd_io
+import render
+import frame_source
+import prefilter
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# benchmark.py
+# 功能: 投影流水线的基准测试, 结果写成JSON, 用于比较不同版本的性能
+# 1.生成合成数据: KITTI (.bin 点云 / calib .txt / png) 和 ROS (ascii或binary的 .pcd / Autoware YAML / jpg),
+#   点数 (3万 ~ 200万) 和图像尺寸可配置; 相同参数的数据只生成一次
+# 2.分阶段计时: 读取点云、读取图像、解析标定、视锥过滤、投影、绘制、编码
+# 3.端到端帧率: proj_velo2cam / proj_pcd2cam 逐帧处理, 以及 pipeline.py 的流水线
+# 4.每个配置在单独的子进程中运行, 记录该配置的峰值内存 (RSS)
+# 5.--compare 与之前的结果比较, 变慢超过阈值的阶段记为回退, 退出码为1
+
+STAGES = ('load_points', 'load_image', 'calib', 'filter', 'project', 'render', 'encode')
+DATASETS = ('kitti', 'ros')
+PCD_FORMATS = ('ascii', 'binary')
+DEFAULT_POINTS = (30000, 120000)
+DEFAULT_IMAGE_SIZE = {'kitti': (1242, 375), 'ros': (1920, 1200)}
+DEFAULT_FRAMES = 5
+DEFAULT_REPEAT = 3
+# 比较结果时, 变慢超过该比例记为回退
+REGRESSION_TOLERANCE = 0.2
+# 变慢的绝对值小于该值 (ms) 时不算回退, 亚毫秒级阶段的计时噪声较大
+REGRESSION_MIN_MS = 0.5
+
+# 合成KITTI标定: 内参按图像宽度缩放 KITTI P2 的焦距, 主点在图像中心
+KITTI_FOCAL = 721.5377
+KITTI_WIDTH = 1242
+VELO_TO_CAM = np.array([[0.0, -1.0, 0.0, 0.0],
+                        [0.0, 0.0, -1.0, -0.08],
+                        [1.0, 0.0, 0.0, -0.27]])
+# 合成Autoware外参 (相机到雷达: 相机z轴朝雷达x轴) 和 plumb_bob 畸变
+AUTOWARE_EXTRINSIC = np.array([[0.0, 0.0, 1.0, 0.1],
+                               [-1.0, 0.0, 0.0, 0.0],
+                               [0.0, -1.0, 0.0, -0.1],
+                               [0.0, 0.0, 0.0, 1.0]])
+SYNTHETIC_DIST = (-0.12, 0.06, 0.0005, -0.0003, -0.01)
+ROS_FOCAL_RATIO = 0.73
+
+
+def synthetic_scan(n, rings=64, seed=0, max_range=80.0, sensor_height=1.73):
+    """(n, 4) float32 [x, y, z, intensity] spinning-lidar-like scan, stored ring by ring.
+
+    Downward beams hit a flat ground plane unless a random obstacle is closer.
+    """
+    rng = np.random.default_rng(seed)
+    ring = np.sort(rng.integers(0, rings, n))
+    elev = np.radians(np.linspace(-24.8, 2.0, rings))[ring]
+    azim = rng.uniform(-np.pi, np.pi, n)
+    obstacle = rng.uniform(2.0, max_range, n)
+    ground = sensor_height / np.maximum(np.sin(-elev), 1e-3)
+    r = np.where(elev < 0, np.minimum(ground, obstacle), obstacle) + rng.normal(0, 0.02, n)
+    scan = np.empty((n, 4), dtype=np.float32)
+    scan[:, 0] = r * np.cos(elev) * np.cos(azim)
+    scan[:, 1] = r * np.cos(elev) * np.sin(azim)
+    scan[:, 2] = r * np.sin(elev)
+    scan[:, 3] = rng.uniform(0, 1, n)
+    # 同一条扫描线内按方位角排序, 与真实雷达的存储顺序相近
+    order = np.lexsort((azim, ring))
+    return scan[order]
+
+
+def synthetic_image(img_w, img_h, seed=0):
+    """RGB uint8 image: smooth gradients plus mild noise (PNG/JPEG cost close to a real photo)."""
+    rng = np.random.default_rng(seed)
+    v, u = np.mgrid[0:img_h, 0:img_w].astype(np.float32)
+    img = np.empty((img_h, img_w, 3), dtype=np.float32)
+    img[:, :, 0] = 255 * u / img_w
+    img[:, :, 1] = 255 * v / img_h
+    img[:, :, 2] = 128 + 100 * np.sin(u / 37.0) * np.cos(v / 23.0)
+    img += rng.normal(0, 8, img.shape).astype(np.float32)
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+
+def kitti_calib_text(img_w, img_h):
+    """Contents of a KITTI calib file for a synthetic camera of the given image size."""
+    f = KITTI_FOCAL * img_w / KITTI_WIDTH
+    P = np.array([[f, 0, img_w / 2, 0], [0, f, img_h / 2, 0], [0, 0, 1, 0]])
+    mats = {
+        'P0': P,
+        'P1': P - [[0, 0, 0, 0.54 * f], [0, 0, 0, 0], [0, 0, 0, 0]],
+        'P2': P + [[0, 0, 0, 0.06 * f], [0, 0, 0, 0], [0, 0, 0, 0]],
+        'P3': P - [[0, 0, 0, 0.47 * f], [0, 0, 0, 0], [0, 0, 0, 0]],
+        'R0_rect': np.eye(3),
+        'Tr_velo_to_cam': VELO_TO_CAM,
+        'Tr_imu_to_velo': np.hstack([np.eye(3), [[-0.81], [0.32], [-0.80]]]),
+    }
+    return ''.join(f'{key}: ' + ' '.join(f'{x:.12e}' for x in np.ravel(mat)) + '\n' for key, mat in mats.items())
+
+
+def write_kitti_fixture(root, n_points, img_size, frames=DEFAULT_FRAMES, split='testing', seed=0):
+    """Synthetic KITTI object split under root (same layout as frame_source.KittiSource)."""
+    img_w, img_h = img_size
+    velo_dir = os.path.join(root, 'data_object_velodyne', split, 'velodyne')
+    img_dir = os.path.join(root, 'data_object_image_2', split, 'image_2')
+    calib_dir = os.path.join(root, split, 'calib')
+    for d in (velo_dir, img_dir, calib_dir):
+        os.makedirs(d, exist_ok=True)
+    calib_text = kitti_calib_text(img_w, img_h)
+    for i in range(frames):
+        number = f'{i:06d}'
+        synthetic_scan(n_points, seed=seed + i).tofile(os.path.join(velo_dir, number + '.bin'))
+        render.save_image(os.path.join(img_dir, number + '.png'), synthetic_image(img_w, img_h, seed + i))
+        with open(os.path.join(calib_dir, number + '.txt'), 'w') as f:
+            f.write(calib_text)
+    return root
+
+
+def write_ros_fixture(root, n_points, img_size, frames=DEFAULT_FRAMES, pcd_format='binary', dist_coeffs=SYNTHETIC_DIST,
+                      seed=0):
+    """Synthetic ROS extraction under root: image/*.jpg, pointcloud/*.pcd, calib.yaml (Autoware format)."""
+    import proj_pcd2cam
+    img_w, img_h = img_size
+    img_dir = os.path.join(root, 'image')
+    pc_dir = os.path.join(root, 'pointcloud')
+    os.makedirs(img_dir, exist_ok=True)
+    os.makedirs(pc_dir, exist_ok=True)
+    f = ROS_FOCAL_RATIO * img_w
+    intrinsic = np.array([[f, 0, img_w / 2, 0], [0, f, img_h / 2, 0], [0, 0, 1, 0]])
+    proj_pcd2cam.save_calib_param(os.path.join(root, 'calib.yaml'), AUTOWARE_EXTRINSIC, intrinsic=intrinsic,
+                                  dist_coeffs=dist_coeffs, image_size=(img_w, img_h))
+    # 文件名为微秒时间戳, 点云比图像早约15ms
+    stamp = 1702895061262535
+    for i in range(frames):
+        scan = synthetic_scan(n_points, rings=16, seed=seed + i)
+        # PCD中反射率为 0~255 (pcd_to_xyzi 读取时除以255)
+        scan[:, 3] *= 255
+        pcd_io.write_pcd(os.path.join(pc_dir, f'{stamp - 15000}.pcd'), scan, pcd_format)
+        render.save_image(os.path.join(img_dir, f'{stamp}.jpg'), synthetic_image(img_w, img_h, seed + i))
+        stamp += 100000
+    return root
+
+
+def make_cases(datasets=DATASETS, points=DEFAULT_POINTS, image_sizes=None, pcd_formats=PCD_FORMATS,
+               frames=DEFAULT_FRAMES, repeat=DEFAULT_REPEAT, pipeline=True, matplotlib=False):
+    """One case dict per (dataset, pcd format, point count, image size) combination."""
+    cases = []
+    for dataset in datasets:
+        sizes = image_sizes or [DEFAULT_IMAGE_SIZE[dataset]]
+        formats = pcd_formats if dataset == 'ros' else [None]
+        for fmt, n, size in itertools.product(formats, points, sizes):
+            name = '-'.join([dataset] + ([fmt] if fmt else []) + [str(n), f'{size[0]}x{size[1]}'])
+            cases.append({'name': name, 'dataset': dataset, 'pcd_format': fmt, 'points': n,
+                          'image_size': list(size), 'frames': frames, 'repeat': repeat,
+                          'pipeline': pipeline, 'matplotlib': matplotlib})
+    return cases
+
+
+def prepare_case(case, data_dir):
+    """Generate the case's fixture under data_dir (reused when it already exists); returns its root."""
+    root = os.path.join(data_dir, f'{case["name"]}-f{case["frames"]}')
+    done = os.path.join(root, '.complete')
+    if os.path.exists(done):
+        return root
+    if os.path.exists(root):
+        shutil.rmtree(root)
+    if case['dataset'] == 'kitti':
+        write_kitti_fixture(root, case['points'], case['image_size'], case['frames'])
+    else:
+        write_ros_fixture(root, case['points'], case['image_size'], case['frames'], case['pcd_format'])
+    open(done, 'w').close()
+    return root
+
+
+@contextlib.contextmanager
+def _timed(times, name):
+    t0 = time.perf_counter()
+    yield
+    times.setdefault(name, []).append(time.perf_counter() - t0)
+
+
+def _summary(seconds):
+    ms = np.asarray(seconds) * 1000
+    return {'median_ms': round(float(np.median(ms)), 3), 'mean_ms': round(float(ms.mean()), 3),
+            'min_ms': round(float(ms.min()), 3), 'runs': len(ms)}
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process (MB), None where the resource module is missing."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以KB为单位, macOS 以字节为单位
+    return round(peak / (1 << 20 if sys.platform == 'darwin' else 1 << 10), 1)
+
+
+def _parse_calib(case, source, frame):
+    # 不经过缓存, 每次都重新读取和解析
+    if case['dataset'] == 'kitti':
+        with open(source.calib_file(frame.name)) as f:
+            calib = kitti_calib.KittiCalib(kitti_calib.parse_calib(f.read()))
+    else:
+        calib = frame_source.read_camera_lidar_calib(source.calib_file)
+    calib.velo_to_img(frame.cam)
+    return calib
+
+
+def _source(case, root, point_filter=None):
+    if case['dataset'] == 'kitti':
+        return frame_source.KittiSource(root, point_filter=point_filter)
+    return frame_source.PcdSource(os.path.join(root, 'image'), os.path.join(root, 'pointcloud'),
+                                  os.path.join(root, 'calib.yaml'), point_filter=point_filter)
+
+
+def time_stages(case, root, out_dir):
+    """{stage: [seconds, ...]} over every frame, repeat times, plus point counts."""
+    source = _source(case, root)
+    point_filter = prefilter.PointFilter()
+    vertical = case['dataset'] == 'kitti'
+    radius = 1 if vertical else 2
+    times = {}
+    counts = {'filtered': [], 'projected': []}
+    for _ in range(case['repeat']):
+        for frame in source:
+            with _timed(times, 'load_points'):
+                points = frame_source.load_points(frame.points_file)
+                if isinstance(points, np.memmap):
+                    # memmap 只映射文件, 拷贝一次才真正读取
+                    points = np.array(points)
+            with _timed(times, 'load_image'):
+                img = render.load_image(frame.image_file)
+            with _timed(times, 'calib'):
+                frame.calib = _parse_calib(case, source, frame)
+            img_h, img_w = frame.image_size
+            with _timed(times, 'filter'):
+                # 与 Frame.project 相同: 加畸变时只剔除相机后方的点
+                bounds = (None, None) if frame._dist_coeffs() is not None else (img_w, img_h)
+                select = point_filter.select(points, frame.proj_mat(), *bounds)
+            with _timed(times, 'project'):
+                proj = frame.project(points=points[select])
+            with _timed(times, 'render'):
+                panels = render.render_projection(img, proj.u, proj.v, proj.z, proj.intensity,
+                                                  vertical=vertical, radius=radius)
+            with _timed(times, 'encode'):
+                render.save_image(os.path.join(out_dir, frame.name + '.png'), panels)
+            counts['filtered'].append(len(select))
+            counts['projected'].append(len(proj.u))
+    return times, {name: int(np.mean(c)) for name, c in counts.items()}
+
+
+def time_end_to_end(case, root, out_dir, backend='numpy'):
+    """Frames per second of the entry point's own per-frame function, serially over all frames."""
+    source = _source(case, root, prefilter.PointFilter())
+    n = 0
+    t0 = time.perf_counter()
+    for _ in range(case['repeat']):
+        for frame in source:
+            if case['dataset'] == 'kitti':
+                import proj_velo2cam
+                # 投影图写到数据根目录下的固定相对路径 (见 proj_velo2cam.projection_path)
+                proj_velo2cam.process_frame(frame, backend, root=root)
+            else:
+                import proj_pcd2cam
+                proj_pcd2cam.process_frame(frame, backend, projection_save_dir=out_dir)
+            n += 1
+    return round(n / (time.perf_counter() - t0), 3)
+
+
+def time_pipeline(case, root, out_dir):
+    """Frames per second through pipeline.run_projection with its default worker counts."""
+    import pipeline
+    source = _source(case, root, prefilter.PointFilter())
+    vertical = case['dataset'] == 'kitti'
+    pipe = pipeline.run_projection(source, out_dir, vertical=vertical, radius=1 if vertical else 2, verbose=False)
+    return round(len(source) / pipe.elapsed, 3) if pipe.elapsed > 0 else 0.0
+
+
+def run_case(case, root):
+    """Run one benchmark case on its fixture; returns the case dict extended with the results."""
+    out_dir = tempfile.mkdtemp(prefix='bench_out_')
+    try:
+        times, counts = time_stages(case, root, out_dir)
+        fps = {'serial': time_end_to_end(case, root, out_dir)}
+        if case.get('matplotlib'):
+            fps['serial_matplotlib'] = time_end_to_end(case, root, out_dir, backend='matplotlib')
+        if case.get('pipeline'):
+            fps['pipeline'] = time_pipeline(case, root, out_dir)
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+    stages = {name: _summary(times[name]) for name in STAGES}
+    total_ms = sum(s['median_ms'] for s in stages.values())
+    return dict(case, stages=stages, stage_total_ms=round(total_ms, 3), fps=fps, points_filtered=counts['filtered'],
+                points_projected=counts['projected'], peak_rss_mb=peak_rss_mb())
+
+
+def git_revision():
+    try:
+        res = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=10,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return res.stdout.strip() or None
+
+
+def environment():
+    try:
+        import cv2
+        cv2_version = cv2.__version__
+    except ImportError:
+        cv2_version = None
+    return {'revision': git_revision(), 'python': platform.python_version(), 'numpy': np.__version__,
+            'opencv': cv2_version, 'platform': platform.platform(), 'cpus': os.cpu_count(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def run_benchmark(cases, data_dir=None, isolate=True, verbose=True):
+    """Run every case (each in a fresh process when isolate); returns the JSON-ready result dict.
+
+    Fixtures are generated in data_dir (a temporary directory, removed afterwards, when None).
+    """
+    tmp_dir = None
+    if data_dir is None:
+        data_dir = tmp_dir = tempfile.mkdtemp(prefix='bench_data_')
+    results = []
+    try:
+        for case in cases:
+            root = prepare_case(case, data_dir)
+            if isolate:
+                # 每个配置一个新进程, 峰值内存只包含该配置
+                with ProcessPoolExecutor(max_workers=1) as pool:
+                    result = pool.submit(run_case, case, root).result()
+            else:
+                result = run_case(case, root)
+            results.append(result)
+            if verbose:
+                print(format_case(result), flush=True)
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    return {'environment': environment(), 'cases': results}
+
+
+def format_case(result):
+    stages = ' '.join(f'{name}={s["median_ms"]:.1f}' for name, s in result['stages'].items())
+    fps = ' '.join(f'{name}={v:.2f}' for name, v in result['fps'].items())
+    return (f'{result["name"]:<28} {stages} | total={result["stage_total_ms"]:.1f} ms | fps {fps} | '
+            f'peak {result["peak_rss_mb"]} MB')
+
+
+def compare(baseline, current, tolerance=REGRESSION_TOLERANCE):
+    """Regressions of current against baseline (result dicts of run_benchmark), as readable lines.
+
+    A stage regresses when its median time grows by more than tolerance, an end-to-end
+    rate when its fps drops by more than tolerance, memory when peak RSS grows by more.
+    Stage slowdowns below REGRESSION_MIN_MS are ignored as timer noise.
+    """
+    base_cases = {c['name']: c for c in baseline['cases']}
+    regressions = []
+    for case in current['cases']:
+        base = base_cases.get(case['name'])
+        if base is None:
+            continue
+        for name, s in case['stages'].items():
+            old = base['stages'].get(name, {}).get('median_ms')
+            if old and s['median_ms'] > max(old * (1 + tolerance), old + REGRESSION_MIN_MS):
+                regressions.append(f'{case["name"]} {name}: {old:.2f} -> {s["median_ms"]:.2f} ms')
+        for name, fps in case['fps'].items():
+            old = base['fps'].get(name)
+            if old and fps < old / (1 + tolerance):
+                regressions.append(f'{case["name"]} fps {name}: {old:.2f} -> {fps:.2f}')
+        old = base.get('peak_rss_mb')
+        if old and case['peak_rss_mb'] and case['peak_rss_mb'] > old * (1 + tolerance):
+            regressions.append(f'{case["name"]} peak rss: {old} -> {case["peak_rss_mb"]} MB')
+    return regressions
+
+
+def _image_size(text):
+    w, h = text.lower().split('x')
+    return int(w), int(h)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the projection pipeline on synthetic data')
+    parser.add_argument('--datasets', nargs='+', default=list(DATASETS), choices=DATASETS)
+    parser.add_argument('--points', nargs='+', type=int, default=list(DEFAULT_POINTS), help='points per scan')
+    parser.add_argument('--image-size', nargs='+', type=_image_size, default=None,
+                        help='WxH, e.g. 1242x375 (default depends on the dataset)')
+    parser.add_argument('--pcd-formats', nargs='+', default=list(PCD_FORMATS), choices=PCD_FORMATS)
+    parser.add_argument('--frames', type=int, default=DEFAULT_FRAMES, help='frames per fixture')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='passes over the frames')
+    parser.add_argument('--no-pipeline', action='store_true', help='skip the pipeline.py throughput run')
+    parser.add_argument('--matplotlib', action='store_true', help='also time the matplotlib backend')
+    parser.add_argument('--data-dir', default=None, help='keep and reuse generated fixtures here')
+    parser.add_argument('--no-isolate', action='store_true', help='run cases in this process')
+    parser.add_argument('--out', default='benchmark.json', help='JSON result file')
+    parser.add_argument('--compare', default=None, help='earlier JSON result to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    cases = make_cases(args.datasets, args.points, args.image_size, args.pcd_formats, args.frames, args.repeat,
+                       pipeline=not args.no_pipeline, matplotlib=args.matplotlib)
+    results = run_benchmark(cases, args.data_dir, isolate=not args.no_isolate)
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'results written to {args.out}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, results, args.tolerance)
+        for line in regressions:
+            print(f'REGRESSION {line}')
+        if regressions:
+            sys.exit(1)
+        print(f'no regressions against {args.compare} (tolerance {args.tolerance:.0%})')
+
+
+if __name__ == '__main__':
+    main()
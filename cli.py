@@ -0,0 +1,507 @@
+import os
+import sys
+import argparse
+
+# cli.py
+# 功能: 统一的命令行入口, 取代各脚本 main() 中写死的路径和开关
+#   python3 cli.py project-kitti | project-ros | sync | export-depth | box-stats | calibrate | video |
+#                  accumulate | store-convert | store-info | bench [选项]
+#   各脚本的 main() 只是转到这里的子命令 (batch_project.py, extrinsic_refine.py, video_export.py, frame_store.py ...)
+# 1.所有选项都可以写在 YAML 配置文件中 (--config): 顶层的键对所有子命令生效, 与子命令同名的一节只对该子命令生效,
+#   命令行上给出的选项优先
+# 2.--frames 选择帧: 'start:stop:step' (按排序后的帧序号切片) 或逗号分隔的帧名
+# 3.--extrinsic-convention 选择标定文件中外参的约定 (autoware / standard, 见 proj_pcd2cam.py), 不再需要注释代码
+# 4.只导入标准库, 各子命令用到的模块在执行时才导入; matplotlib / tkinter 只在 --backend matplotlib / --gui 时导入,
+#   集群节点上无界面的批处理启动更快
+
+# 与 proj_pcd2cam.EXTRINSIC_CONVENTIONS / depth_export.FORMATS 相同, 写在这里使 --help 和参数检查不导入 numpy / cv2
+EXTRINSIC_CONVENTIONS = ('autoware', 'standard')
+DEPTH_FORMATS = ('png', 'npz', 'shard')
+LINK_MODES = ('hardlink', 'symlink', 'copy', 'none')
+KITTI_SPLITS = ('training', 'testing')
+# render.save_image 支持的投影图格式
+IMAGE_FORMATS = ('png', 'jpg')
+
+
+class UsageError(ValueError):
+    """Invalid combination of options; main() reports it as a usage error."""
+
+
+class FrameSpecError(UsageError):
+    """Invalid --frames spec."""
+
+
+def select_frames(names, spec):
+    """Indices into names chosen by a --frames spec: None (all), 'start:stop:step', 'a,b,c' or a list of names."""
+    if spec is None:
+        return list(range(len(names)))
+    if isinstance(spec, (list, tuple)):
+        wanted = [str(name) for name in spec]
+    else:
+        spec = str(spec)
+        if ':' in spec:
+            parts = spec.split(':')
+            try:
+                if len(parts) > 3:
+                    raise ValueError
+                return list(range(len(names)))[slice(*(int(p) if p.strip() else None for p in parts))]
+            except ValueError:
+                # 非整数或 step 为 0
+                raise FrameSpecError(f'invalid frame range: {spec}') from None
+        wanted = [name.strip() for name in spec.split(',') if name.strip()]
+    index = {name: i for i, name in enumerate(names)}
+    missing = [name for name in wanted if name not in index]
+    if missing:
+        raise FrameSpecError(f'unknown frames: {missing[:10]}')
+    return [index[name] for name in wanted]
+
+
+def load_config(path):
+    import yaml
+    with open(path) as f:
+        config = yaml.safe_load(f) or {}
+    if not isinstance(config, dict):
+        raise ValueError(f'{path}: expected a mapping of option names to values')
+    return config
+
+
+def config_defaults(config, command, parser):
+    """{dest: value} for parser from the top level of config and its `command` section."""
+    dests = {action.dest for action in parser._actions}
+    section = config.get(command) or {}
+    if not isinstance(section, dict):
+        raise ValueError(f'config section {command} must be a mapping')
+    defaults = {}
+    # 顶层的键可能属于其他子命令, 不认识的忽略; 子命令一节中的键必须是这个子命令的选项
+    for key, value in config.items():
+        if not isinstance(value, dict) and key.replace('-', '_') in dests:
+            defaults[key.replace('-', '_')] = value
+    for key, value in section.items():
+        dest = key.replace('-', '_')
+        if dest not in dests:
+            raise ValueError(f'config section {command}: unknown option {key}')
+        defaults[dest] = value
+    if isinstance(defaults.get('frames'), int):
+        # YAML 会把 0:10:2 读成六十进制整数
+        raise ValueError("config: frames must be a quoted range ('0:100:2') or a list of frame names")
+    return defaults
+
+
+def check_choices(args, parser):
+    """Message for the first option value outside its choices, else None.
+
+    argparse only checks values given on the command line; config values enter as defaults.
+    """
+    for action in parser._actions:
+        if not action.choices:
+            continue
+        value = getattr(args, action.dest, None)
+        values = value if isinstance(value, (list, tuple)) else [value]
+        for v in values:
+            if v is not None and v not in action.choices:
+                choices = ', '.join(map(repr, action.choices))
+                return f'argument {"/".join(action.option_strings) or action.dest}: invalid choice: {v!r} ' \
+                       f'(choose from {choices})'
+    return None
+
+
+def metrics_options(args):
+    """(metrics file, profile_top, profile dir) from the options, else from the PROJ_METRICS* environment."""
+    import metrics
+    env_file, env_top, env_dir = metrics.env_config()
+    return args.metrics or env_file, args.profile or env_top, args.profile_dir or env_dir
+
+
+def point_filter(args):
+    import prefilter
+    roi = (tuple(args.roi[:3]), tuple(args.roi[3:])) if args.roi else None
+    return prefilter.PointFilter(max_range=args.max_range, roi=roi, voxel_size=args.voxel, max_points=args.max_points)
+
+
+def ros_source(args, filtered=True):
+    """PcdSource (or ManifestSource with --manifest) of the ROS options."""
+    import frame_source
+    import proj_pcd2cam
+    calib = args.calib or proj_pcd2cam.CALIB_FILE
+    filt = point_filter(args) if filtered else None
+    if args.manifest:
+        return frame_source.ManifestSource(args.manifest, calib, point_filter=filt,
+                                           extrinsic_convention=args.extrinsic_convention)
+    return frame_source.PcdSource(args.img_dir or proj_pcd2cam.IMG_DIR,
+                                  args.pointcloud_dir or proj_pcd2cam.POINTCLOUD_DIR, calib,
+                                  point_filter=filt, extrinsic_convention=args.extrinsic_convention)
+
+
+def kitti_source(args, default_split='testing'):
+    import frame_source
+    # 子命令共用同一个 --split 选项对象, 各自的默认值在这里给出
+    args.split = args.split or default_split
+    return frame_source.KittiSource(args.root, args.split, point_filter=point_filter(args),
+                                    scan_cache=args.scan_cache)
+
+
+def kitti_frames(args, default_split='testing'):
+    names = kitti_source(args, default_split).names
+    return [names[i] for i in select_frames(names, args.frames)]
+
+
+def print_report(report):
+    print(f"processed: {len(report['processed'])}, skipped: {len(report['skipped'])}, failed: {len(report['failed'])}")
+
+
+def project_kitti(args):
+    import batch_project
+    numbers = kitti_frames(args)
+    report = batch_project.run_batch(numbers, args.workers, args.chunksize, args.ordered, not args.overwrite,
+                                     args.backend, args.radius, args.report, 'render', args.format, None,
+                                     point_filter(args), *metrics_options(args), root=args.root, split=args.split,
+                                     scan_cache=args.scan_cache)
+    print_report(report)
+
+
+def project_ros(args):
+    import metrics
+    import proj_pcd2cam
+    source = ros_source(args)
+    frames = [source[i] for i in select_frames(source.names, args.frames)]
+    out_dir = args.out_dir or proj_pcd2cam.PROJECTION_DIR
+    metrics_file, profile_top, profile_dir = metrics_options(args)
+    with metrics.session(metrics_file, profile_top, profile_dir):
+        if args.backend == 'matplotlib' or profile_top:
+            # matplotlib 不是线程安全的; cProfile 只记录当前线程, 逐帧处理才能得到每帧完整的 profile
+            from tqdm import tqdm
+            for frame in tqdm(frames):
+                proj_pcd2cam.process_frame(frame, args.backend, args.radius, out_dir, args.format)
+        else:
+            # 读取、投影、绘制、编码分阶段流水线处理 (见 pipeline.py), --workers 为绘制和编码的线程数
+            import pipeline
+            workers = {'render': args.workers, 'encode': args.workers} if args.workers else None
+            pipeline.run_projection(frames, out_dir, vertical=False, radius=args.radius, workers=workers,
+                                    fmt=args.format)
+
+
+def export_depth(args):
+    if args.dataset == 'kitti':
+        import batch_project
+        numbers = kitti_frames(args)
+        report = batch_project.run_batch(numbers, args.workers, args.chunksize, args.ordered, not args.overwrite,
+                                         'numpy', 1, args.report, 'depth', args.format, args.out_dir,
+                                         point_filter(args), *metrics_options(args), root=args.root, split=args.split,
+                                         scan_cache=args.scan_cache)
+        print_report(report)
+        return
+    import metrics
+    import depth_export
+    import proj_pcd2cam
+    from tqdm import tqdm
+    source = ros_source(args)
+    indices = select_frames(source.names, args.frames)
+    out_dir = args.out_dir or proj_pcd2cam.DEPTH_DIR
+    writer = depth_export.ShardWriter(out_dir) if args.format == 'shard' else None
+    metrics_file, profile_top, profile_dir = metrics_options(args)
+
+    def export(i):
+        proj_pcd2cam.export_depth_frame(source[i], out_dir, args.format, writer)
+
+    with metrics.session(metrics_file, profile_top, profile_dir):
+        if args.workers and args.workers > 1 and not profile_top:
+            # 读取、投影和编码大多在 numpy / cv2 中释放 GIL, 用线程池; cProfile 只记录当前线程, 统计 profile 时逐帧处理
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=args.workers) as executor:
+                for _ in tqdm(executor.map(export, indices), total=len(indices)):
+                    pass
+        else:
+            for i in tqdm(indices):
+                export(i)
+    if writer is not None:
+        writer.flush()
+
+
+def box_stats(args):
+    import batch_project
+    # 只有 training split 有标注
+    numbers = kitti_frames(args, 'training')
+    report = batch_project.run_batch(numbers, args.workers, args.chunksize, args.ordered, not args.overwrite,
+                                     'numpy', 1, args.report, 'boxes', 'png', args.out_dir,
+                                     point_filter(args), *metrics_options(args), label_dir=args.label_dir,
+                                     root=args.root, split=args.split, scan_cache=args.scan_cache)
+    print_report(report)
+
+
+def sync(args):
+    import create_data
+    images_dir = args.images_dir or create_data.IMAGES_DIR
+    if args.rename:
+        create_data.rename_images(images_dir)
+    create_data.produce_one_to_one_data(images_dir, args.pointclouds_dir or create_data.POINTCLOUDS_DIR,
+                                        args.dst_dir, args.max_skew_ms, args.one_to_one,
+                                        None if args.link == 'none' else args.link, args.manifest)
+
+
+def calibrate(args):
+    if args.gui:
+        import adjust_extrinsic_gui
+        import frame_source
+        # 默认使用时间同步后的目录; --manifest 时按清单配对, --frames 只浏览选中的帧
+        args.img_dir = args.img_dir or adjust_extrinsic_gui.IMG_DIR
+        args.pointcloud_dir = args.pointcloud_dir or adjust_extrinsic_gui.POINTCLOUD_DIR
+        args.calib = args.calib or adjust_extrinsic_gui.CALIB_FILE
+        source = ros_source(args, filtered=False)
+        if args.frames is not None:
+            source = frame_source.SubsetSource(source, select_frames(source.names, args.frames))
+            if not len(source):
+                raise FrameSpecError(f'no frames selected by {args.frames}')
+        adjust_extrinsic_gui.run(source, args.calib, args.extrinsic_convention)
+        return
+    import extrinsic_refine
+    import proj_pcd2cam
+    # 边缘点由同一扫描线上的相邻点得到, 不做投影前过滤
+    source = ros_source(args, filtered=False)
+    frames = [source[i] for i in select_frames(source.names, args.frames)]
+    calib = args.calib or proj_pcd2cam.CALIB_FILE
+    steps = {'rot_step': args.rot_step or extrinsic_refine.ROT_STEP,
+             'trans_step': args.trans_step or extrinsic_refine.TRANS_STEP}
+    extrinsic, report = extrinsic_refine.refine_source(frames, calib, args.num_frames,
+                                                       convention=args.extrinsic_convention, workers=args.workers,
+                                                       **steps)
+    out = args.out or os.path.splitext(calib)[0] + '_refined.yaml'
+    proj_pcd2cam.save_calib_param(out, extrinsic, calib)
+    print(f"score {report['initial_score']:.4f} -> {report['final_score']:.4f} "
+          f"({report['frames']} frames, {report['edge_points']} edge points, {report['evaluations']} evaluations)")
+    print(f'saved to {out}')
+
+
+def video(args):
+    import frame_source
+    import video_export
+    # 与逐帧投影相同: KITTI 三幅图竖直排列, ROS 水平排列
+    if args.dataset == 'kitti':
+        source = kitti_source(args)
+        vertical, radius = True, 1
+    else:
+        source = ros_source(args)
+        vertical, radius = False, 2
+    if args.layout is not None:
+        vertical = args.layout == 'vertical'
+    if args.radius is not None:
+        radius = args.radius
+    frames = frame_source.SubsetSource(source, select_frames(source.names, args.frames))
+    writer = video_export.make_writer(args.out, args.fps, args.scale,
+                                      video_export.FFMPEG_CMD if args.pipe is True else args.pipe, args.fourcc)
+    workers = {'render': args.workers} if args.workers else None
+    video_export.export_video(frames.stream(), writer, vertical, radius, workers, args.window, len(frames))
+    print(f'wrote {writer.count} frames to {args.out}')
+
+
+def accumulate_sequence(args):
+    import accumulate
+    import depth_export
+    import frame_source
+    import proj_velo2cam
+    from tqdm import tqdm
+    formats = DEPTH_FORMATS if args.mode == 'depth' else IMAGE_FORMATS
+    fmt = args.format or 'png'
+    if fmt not in formats:
+        raise UsageError(f'--format {fmt} cannot be used with --mode {args.mode} (choose from {", ".join(formats)})')
+    source = frame_source.KittiSequenceSource(args.sequence, scan_cache=args.scan_cache)
+    oxts_dir = args.oxts or (source.oxts_dir if args.poses is None else None)
+    poses = accumulate.velo_poses(source.calib, args.poses, oxts_dir, source.names)
+    # 输出在序列目录下, 与单帧的投影/深度图分开
+    out_dir = args.out_dir or os.path.join(args.sequence, 'depth_accumulated' if args.mode == 'depth'
+                                           else 'projection_accumulated')
+    writer = depth_export.ShardWriter(out_dir) if fmt == 'shard' else None
+    for frame in tqdm(accumulate.accumulate_source(source, poses, args.radius, args.voxel), total=len(source)):
+        if args.mode == 'depth':
+            proj_velo2cam.export_depth_frame(frame, out_dir, fmt, writer)
+        else:
+            proj_velo2cam.process_frame(frame, out_dir=out_dir, fmt=fmt)
+    if writer is not None:
+        writer.flush()
+
+
+def store_convert(args):
+    import frame_store
+    path = frame_store.convert_dir(args.points_dir, args.out, args.ext, args.compress, args.fields)
+    print(f'wrote {path} ({os.path.getsize(path) / 1e6:.1f} MB)')
+
+
+def store_info(args):
+    import frame_store
+    with frame_store.FrameStore(args.store) as store:
+        print(f'{args.store}: {len(store)} frames, {int(store.counts.sum())} points, '
+              f'compression: {store.compression}')
+        for name, (dtype, shape) in store.fields.items():
+            print(f'  {name}: {dtype}{list(shape) if shape else ""}')
+        if len(store):
+            print(f'  frames: {store.names[0]} .. {store.names[-1]}')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Lidar to camera projection tools')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--config', default=None, help='YAML file with option values (flags take precedence)')
+
+    frames = argparse.ArgumentParser(add_help=False)
+    frames.add_argument('--frames', default=None, help="'start:stop:step' or comma-separated frame names")
+    frames.add_argument('--workers', type=int, default=None)
+    frames.add_argument('--max-range', type=float, default=None, help='drop points farther than this (m)')
+    frames.add_argument('--roi', type=float, nargs=6, default=None,
+                        metavar=('XMIN', 'YMIN', 'ZMIN', 'XMAX', 'YMAX', 'ZMAX'),
+                        help='keep points inside this lidar box (m)')
+    frames.add_argument('--voxel', type=float, default=None, help='keep one point per voxel of this size (m)')
+    frames.add_argument('--max-points', type=int, default=None, help='random subsample to this many points')
+
+    instrument = argparse.ArgumentParser(add_help=False)
+    instrument.add_argument('--metrics', default=None, help='write per-stage timing histograms (.json or .prom)')
+    instrument.add_argument('--profile', type=int, default=0, help='cProfile the N slowest frames')
+    instrument.add_argument('--profile-dir', default=None, help='directory for the .prof files (default profiles)')
+
+    kitti = argparse.ArgumentParser(add_help=False)
+    kitti.add_argument('--root', default='.', help='KITTI root; other paths are relative to the current directory')
+    kitti.add_argument('--split', default=None, choices=KITTI_SPLITS,
+                       help='KITTI object split (default testing, box-stats: training)')
+    kitti.add_argument('--scan-cache', default=None,
+                       help='read scans through a float16 cache in this directory (built on first use, '
+                       'about half the I/O; with --roi only the box is read)')
+
+    # KITTI 的多进程批处理 (batch_project.py)
+    batch = argparse.ArgumentParser(add_help=False)
+    batch.add_argument('--chunksize', type=int, default=16)
+    batch.add_argument('--ordered', action='store_true', help='collect results in frame order')
+    batch.add_argument('--overwrite', action='store_true', help='re-process frames whose output already exists')
+    batch.add_argument('--report', default=None, help='write the run report as JSON')
+
+    ros = argparse.ArgumentParser(add_help=False)
+    ros.add_argument('--img-dir', default=None, help='image directory (default ros_data/image)')
+    ros.add_argument('--pointcloud-dir', default=None, help='.pcd directory (default ros_data/pointcloud)')
+    ros.add_argument('--manifest', default=None, help='sync manifest (create_data.py) instead of the two directories')
+    ros.add_argument('--calib', default=None, help='Autoware calibration YAML')
+    ros.add_argument('--extrinsic-convention', default=None, choices=EXTRINSIC_CONVENTIONS,
+                     help='CameraExtrinsicMat convention (default autoware)')
+
+    p = sub.add_parser('project-kitti', parents=[common, frames, instrument, kitti, batch],
+                       help='render projections of a KITTI split')
+    p.add_argument('--backend', default='numpy', choices=['numpy', 'matplotlib'])
+    p.add_argument('--radius', type=int, default=1)
+    p.add_argument('--format', default='png', choices=IMAGE_FORMATS, help='projection image format')
+    p.set_defaults(func=project_kitti)
+
+    p = sub.add_parser('project-ros', parents=[common, frames, instrument, ros], help='render projections of ROS data')
+    p.add_argument('--out-dir', default=None, help='projection directory (default ros_data/projection)')
+    p.add_argument('--backend', default='numpy', choices=['numpy', 'matplotlib'])
+    p.add_argument('--radius', type=int, default=2)
+    p.add_argument('--format', default='png', choices=IMAGE_FORMATS, help='projection image format')
+    p.set_defaults(func=project_ros)
+
+    p = sub.add_parser('export-depth', parents=[common, frames, instrument, kitti, batch, ros], help='export sparse depth / intensity maps')
+    p.add_argument('--dataset', default='kitti', choices=['kitti', 'ros'])
+    p.add_argument('--format', default='png', choices=DEPTH_FORMATS,
+                   help='shard cannot resume: every run re-exports all frames')
+    p.add_argument('--out-dir', default=None, help='depth export directory')
+    p.set_defaults(func=export_depth)
+
+    p = sub.add_parser('box-stats', parents=[common, frames, instrument, kitti, batch], help='point statistics of KITTI label boxes')
+    p.add_argument('--label-dir', default=None,
+                   help='label_2 directory of the same split (default data_object_label_2/<split>/label_2)')
+    p.add_argument('--out-dir', default=None, help='JSON directory (default data_object_image_2/<split>/box_stats)')
+    p.set_defaults(func=box_stats)
+
+    p = sub.add_parser('sync', parents=[common], help='pair point clouds with the nearest images by timestamp')
+    p.add_argument('--images-dir', default=None, help='images named by timestamp (default self_data/avpslam/image)')
+    p.add_argument('--pointclouds-dir', default=None, help='.pcd files named by timestamp')
+    p.add_argument('--dst-dir', default='correspond_data')
+    p.add_argument('--max-skew-ms', type=float, default=None, help='drop pairs further apart than this')
+    p.add_argument('--one-to-one', action='store_true', help='use every image at most once')
+    p.add_argument('--link', default='hardlink', choices=LINK_MODES, help="'none' only writes the manifest")
+    p.add_argument('--manifest', default='manifest.csv', help='manifest file name in dst-dir (empty: none)')
+    p.add_argument('--rename', action='store_true', help='first rename <seconds>.jpg images to microseconds')
+    p.set_defaults(func=sync)
+
+    p = sub.add_parser('calibrate', parents=[common, ros], help='refine the lidar-camera extrinsic')
+    p.add_argument('--gui', action='store_true', help='open the interactive adjuster instead')
+    p.add_argument('--frames', default=None, help="candidate frames (with --gui: the frames shown): 'start:stop:step' or comma-separated names")
+    p.add_argument('--num-frames', type=int, default=20, help='frames used, evenly spread over the candidates')
+    p.add_argument('--workers', type=int, default=None)
+    p.add_argument('--out', default=None, help='refined YAML (default: <calib>_refined.yaml)')
+    p.add_argument('--rot-step', type=float, default=None, help='initial rotation step (rad)')
+    p.add_argument('--trans-step', type=float, default=None, help='initial translation step (m)')
+    p.set_defaults(func=calibrate)
+
+    p = sub.add_parser('video', parents=[common, frames, kitti, ros],
+                       help='encode the projections of a sequence into one video')
+    p.add_argument('--dataset', default='kitti', choices=['kitti', 'ros'])
+    p.add_argument('--out', required=True, help='video file (.mp4 / .avi)')
+    p.add_argument('--fps', type=float, default=10)
+    p.add_argument('--scale', type=float, default=1.0, help='resize the rendered frames')
+    p.add_argument('--fourcc', default=None, help='VideoWriter codec (default by extension)')
+    p.add_argument('--pipe', nargs='?', const=True, default=None,
+                   help='stream raw frames to this command instead of VideoWriter (no value: ffmpeg/libx264)')
+    p.add_argument('--layout', default=None, choices=['vertical', 'horizontal'],
+                   help='panel layout (default: vertical for KITTI, horizontal for ROS)')
+    p.add_argument('--radius', type=int, default=None)
+    p.add_argument('--window', type=int, default=16, help='max frames in flight')
+    p.set_defaults(func=video)
+
+    p = sub.add_parser('accumulate', parents=[common],
+                       help='project / export depth with the neighbouring scans of a KITTI sequence merged in')
+    p.add_argument('sequence', help='KITTI odometry sequence (sequences/NN) or raw drive (<date>/<drive>_sync)')
+    p.add_argument('--poses', default=None, help='KITTI odometry poses.txt (camera 0 poses)')
+    p.add_argument('--oxts', default=None, help="directory of OXTS packets <frame>.txt (default: the raw drive's)")
+    p.add_argument('--radius', type=int, default=5, help='frames before and after')
+    p.add_argument('--voxel', type=float, default=0.1, help='voxel size (m)')
+    p.add_argument('--mode', default='depth', choices=['render', 'depth'])
+    p.add_argument('--format', default=None, choices=sorted(set(IMAGE_FORMATS + DEPTH_FORMATS)),
+                   help='png (default), npz or shard with --mode depth; png or jpg with --mode render')
+    p.add_argument('--out-dir', default=None,
+                   help='output directory (default <sequence>/depth_accumulated or projection_accumulated)')
+    p.add_argument('--scan-cache', default=None, help='read scans through a float16 cache in this directory')
+    p.set_defaults(func=accumulate_sequence)
+
+    p = sub.add_parser('store-convert', parents=[common],
+                       help='convert a directory of .pcd / .bin files into a memory-mappable frame store')
+    p.add_argument('points_dir')
+    p.add_argument('--out', default=None, help='store file (default <points_dir>.pcs)')
+    p.add_argument('--ext', default=None, choices=['.pcd', '.bin'])
+    p.add_argument('--compress', default=None, choices=['zlib'])
+    p.add_argument('--fields', nargs='*', default=[], help='extra PCD fields to keep, e.g. ring time')
+    p.set_defaults(func=store_convert)
+
+    p = sub.add_parser('store-info', help='describe a frame store file')
+    p.add_argument('store')
+    p.set_defaults(func=store_info)
+
+    # 只用于 --help 中的列表, 参数原样交给 benchmark.py (见 main)
+    sub.add_parser('bench', add_help=False, help='run benchmark.py (all arguments are passed through)')
+    return parser, sub.choices
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if argv[:1] == ['bench']:
+        import benchmark
+        return benchmark.main(argv[1:])
+    parser, subparsers = build_parser()
+    args = parser.parse_args(argv)
+    if getattr(args, 'config', None):
+        # 配置文件中的值作为子命令的默认值, 再解析一次命令行
+        subparser = subparsers[args.command]
+        try:
+            subparser.set_defaults(**config_defaults(load_config(args.config), args.command, subparser))
+        except ValueError as e:
+            parser.error(str(e))
+        args = parser.parse_args(argv)
+        error = check_choices(args, subparser)
+        if error is not None:
+            subparser.error(f'config {args.config}: {error}')
+    try:
+        args.func(args)
+    except FrameSpecError as e:
+        subparsers[args.command].error(f'--frames: {e}')
+    except UsageError as e:
+        subparsers[args.command].error(str(e))
+
+
+if __name__ == '__main__':
+    main()
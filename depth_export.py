@@ -0,0 +1,144 @@
+import os
+import threading
+import numpy as np
+import render
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+# depth_export.py
+# 功能: 把投影得到的 u, v, z 和反射率栅格化为稠密的 HxW 深度图/反射率图 (KITTI depth completion格式)
+# 同一像素有多个点时保留深度最近的点 (见 render.zbuffer)
+# 输出格式:
+#   png   : depth/{name}.png 为 uint16, 深度(m) * 256, 0 表示无数据; intensity/{name}.png 为 uint16, 反射率 * 65535
+#   npz   : {name}.npz, 包含 float32 的 depth 和 intensity
+#   shard : 多帧合并为一个 .npz, key 为 {name}/depth 和 {name}/intensity
+#           (没有逐帧的输出文件, 批处理不能断点续跑, 每次都重新导出所有帧)
+# 每个文件先写 <path>.tmp 再替换, 中断时不会留下不完整的文件
+
+DEPTH_SCALE = 256.0
+INTENSITY_SCALE = 65535.0
+FORMATS = ('png', 'npz', 'shard')
+
+
+def rasterize(u, v, z, intensity, img_h, img_w):
+    """Dense float32 (depth, intensity) maps of shape (img_h, img_w); empty pixels are 0."""
+    depth = np.zeros((img_h, img_w), dtype=np.float32)
+    inten = np.zeros((img_h, img_w), dtype=np.float32)
+    pix, point = render.zbuffer((img_h, img_w), u, v, z, radius=0)
+    depth.ravel()[pix] = z[point]
+    inten.ravel()[pix] = intensity[point]
+    return depth, inten
+
+
+def to_uint16(values, scale):
+    return np.clip(np.round(values * scale), 0, 65535).astype(np.uint16)
+
+
+def save_png16(path, img):
+    # 先写 <path>.tmp 再替换, 中断时不会留下不完整的文件
+    tmp_path = path + '.tmp'
+    if cv2 is not None:
+        ok, data = cv2.imencode('.png', img)
+        if not ok:
+            raise IOError(f'failed to write {path}')
+        with open(tmp_path, 'wb') as f:
+            f.write(data.tobytes())
+    else:
+        from PIL import Image
+        Image.fromarray(img).save(tmp_path, format='PNG')
+    os.replace(tmp_path, path)
+
+
+def save_npz(path, **arrays):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_depth_png(path):
+    """Read a KITTI-format depth PNG back to float32 meters (0 = no data)."""
+    if cv2 is not None:
+        img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    else:
+        from PIL import Image
+        img = np.array(Image.open(path))
+    return img.astype(np.float32) / DEPTH_SCALE
+
+
+def output_path(out_dir, name, fmt):
+    """File whose existence marks the frame as exported (written last); shard output has none."""
+    if fmt == 'png':
+        return os.path.join(out_dir, 'depth', f'{name}.png')
+    return os.path.join(out_dir, f'{name}.npz')
+
+
+def save_maps(out_dir, name, depth, intensity, fmt='png'):
+    """Write the maps of one frame in png or npz format, each file atomically."""
+    if fmt == 'png':
+        os.makedirs(os.path.join(out_dir, 'depth'), exist_ok=True)
+        os.makedirs(os.path.join(out_dir, 'intensity'), exist_ok=True)
+        # 断点续跑只检查深度图 (output_path), 所以先写反射率图, 深度图最后写
+        save_png16(os.path.join(out_dir, 'intensity', f'{name}.png'), to_uint16(intensity, INTENSITY_SCALE))
+        save_png16(os.path.join(out_dir, 'depth', f'{name}.png'), to_uint16(depth, DEPTH_SCALE))
+    elif fmt == 'npz':
+        os.makedirs(out_dir, exist_ok=True)
+        save_npz(os.path.join(out_dir, f'{name}.npz'), depth=depth, intensity=intensity)
+    else:
+        raise ValueError(f'unsupported depth export format: {fmt}')
+
+
+class ShardWriter:
+    """Collect maps of many frames and write them as .npz shards of shard_size frames.
+
+    Shards have no per-frame output file, so batch runs cannot resume them: every run
+    re-exports all frames into new shard files. add() may be called from several threads;
+    frames are stored in the order they are added.
+    """
+
+    def __init__(self, out_dir, shard_size=256, prefix='shard'):
+        self.out_dir = out_dir
+        self.shard_size = shard_size
+        self.prefix = prefix
+        self.arrays = {}
+        self.names = []
+        self.shards = []
+        self._lock = threading.Lock()
+
+    def add(self, name, depth, intensity):
+        with self._lock:
+            self.arrays[f'{name}/depth'] = depth
+            self.arrays[f'{name}/intensity'] = intensity
+            self.names.append(name)
+            if len(self.names) >= self.shard_size:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            return self._flush()
+
+    def _flush(self):
+        if not self.names:
+            return None
+        os.makedirs(self.out_dir, exist_ok=True)
+        path = os.path.join(self.out_dir, f'{self.prefix}_{self.names[0]}_{self.names[-1]}.npz')
+        save_npz(path, names=np.array(self.names), **self.arrays)
+        self.shards.append(path)
+        self.arrays = {}
+        self.names = []
+        return path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+
+def load_shard(path):
+    """Return {name: (depth, intensity)} from a shard written by ShardWriter."""
+    with np.load(path) as data:
+        return {str(n): (data[f'{n}/depth'], data[f'{n}/intensity']) for n in data['names']}
@@ -0,0 +1,152 @@
+import hashlib
+from collections import OrderedDict
+import numpy as np
+from projection import ProjectedPoints
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+# distortion.py
+# 功能: plumb_bob (k1, k2, p1, p2, k3) 镜头畸变, 与 OpenCV / ROS camera_info 的模型相同
+# 1.投影后的点加畸变: 对 (u, v) 向量化计算, 得到点在原始 (有畸变) 图像上的位置
+# 2.或者去畸变图像: remap表每个标定只算一次, 按标定内容的哈希缓存, 之后每帧只做一次 remap
+#
+#   x = (u - cx) / fx,  y = (v - cy) / fy,  r^2 = x^2 + y^2
+#   x' = x * (1 + k1 r^2 + k2 r^4 + k3 r^6) + 2 p1 x y + p2 (r^2 + 2 x^2)
+#   y' = y * (1 + k1 r^2 + k2 r^4 + k3 r^6) + p1 (r^2 + 2 y^2) + 2 p2 x y
+#   u' = fx * x' + cx,  v' = fy * y' + cy
+
+DIST_MODELS = ('plumb_bob',)
+# 图像角点的半径之外再放宽的比例, 超出的点不加畸变直接删除 (多项式在视场外可能折返到图像内)
+RADIUS_MARGIN = 1.2
+
+# {calib digest: (map1, map2)}
+_map_cache = OrderedDict()
+_MAP_CACHE_SIZE = 8
+
+
+def as_coeffs(dist):
+    """plumb_bob coefficients padded to (k1, k2, p1, p2, k3) float64."""
+    coeffs = np.zeros(5)
+    if dist is not None:
+        dist = np.asarray(dist, dtype=np.float64).ravel()[:5]
+        coeffs[:len(dist)] = dist
+    return coeffs
+
+
+def has_distortion(dist):
+    return dist is not None and bool(np.any(as_coeffs(dist)))
+
+
+def distort_normalized(x, y, dist):
+    """Apply plumb_bob to normalized image coordinates (arrays of the same shape)."""
+    k1, k2, p1, p2, k3 = (np.float32(c) for c in as_coeffs(dist))
+    x2 = x * x
+    y2 = y * y
+    xy = x * y
+    r2 = x2 + y2
+    radial = 1 + r2 * (k1 + r2 * (k2 + r2 * k3))
+    xd = x * radial + 2 * p1 * xy + p2 * (r2 + 2 * x2)
+    yd = y * radial + p1 * (r2 + 2 * y2) + 2 * p2 * xy
+    return xd, yd
+
+
+def undistort_normalized(xd, yd, dist, iterations=20):
+    """Invert distort_normalized by fixed-point iteration (as cv2.undistortPoints does)."""
+    k1, k2, p1, p2, k3 = as_coeffs(dist)
+    xd = np.asarray(xd, dtype=np.float64)
+    yd = np.asarray(yd, dtype=np.float64)
+    x, y = xd.copy(), yd.copy()
+    for _ in range(iterations):
+        r2 = x * x + y * y
+        radial = 1 + r2 * (k1 + r2 * (k2 + r2 * k3))
+        dx = 2 * p1 * x * y + p2 * (r2 + 2 * x * x)
+        dy = p1 * (r2 + 2 * y * y) + 2 * p2 * x * y
+        x = (xd - dx) / radial
+        y = (yd - dy) / radial
+    return x, y
+
+
+def max_radius2(K, dist, img_w, img_h):
+    """Squared normalized radius of the farthest image corner, before distortion."""
+    fx, fy, cx, cy = K[0, 0], K[1, 1], K[0, 2], K[1, 2]
+    corners_u = np.array([0, img_w, 0, img_w], dtype=np.float64)
+    corners_v = np.array([0, 0, img_h, img_h], dtype=np.float64)
+    x, y = undistort_normalized((corners_u - cx) / fx, (corners_v - cy) / fy, dist)
+    return float(np.max(x * x + y * y))
+
+
+def distort_pixels(u, v, K, dist):
+    """Move pinhole pixel coordinates (u, v) to where the distorted camera images them."""
+    fx, fy, cx, cy = (np.float32(K[0, 0]), np.float32(K[1, 1]), np.float32(K[0, 2]), np.float32(K[1, 2]))
+    xd, yd = distort_normalized((u - cx) / fx, (v - cy) / fy, dist)
+    return xd * fx + cx, yd * fy + cy
+
+
+def distort_projection(proj, K, dist, img_w, img_h):
+    """Apply lens distortion to ProjectedPoints from an unbounded pinhole projection.
+
+    K: 3x3 camera matrix used for the projection. Points outside the image after
+    distortion, or too far outside the field of view for the model, are dropped.
+    """
+    K = np.asarray(K, dtype=np.float64)
+    fx, fy, cx, cy = (np.float32(K[0, 0]), np.float32(K[1, 1]), np.float32(K[0, 2]), np.float32(K[1, 2]))
+    x = (proj.u - cx) / fx
+    y = (proj.v - cy) / fy
+    # 先删除视场外的点再加畸变 (z 接近0的点 x, y 很大, 多项式在 float32 下会溢出)
+    keep = np.flatnonzero(x * x + y * y <= np.float32(max_radius2(K, dist, img_w, img_h) * RADIUS_MARGIN ** 2))
+    xd, yd = distort_normalized(x[keep], y[keep], dist)
+    u = xd * fx + cx
+    v = yd * fy + cy
+    mask = (u >= 0) & (u <= img_w) & (v >= 0) & (v <= img_h)
+    keep = keep[mask]
+    return ProjectedPoints(u[mask], v[mask], proj.z[keep], proj.intensity[keep], proj.index[keep])
+
+
+def calib_digest(K, dist, size):
+    h = hashlib.sha1()
+    h.update(np.asarray(K, dtype=np.float64).tobytes())
+    h.update(as_coeffs(dist).tobytes())
+    h.update(np.asarray(size, dtype=np.int64).tobytes())
+    return h.hexdigest()
+
+
+def undistort_maps(K, dist, size):
+    """remap tables (map1, map2) producing an undistorted image with the same camera matrix K.
+
+    size is (width, height). Tables are cached per calibration, so repeated calls are free.
+    """
+    key = calib_digest(K, dist, size)
+    maps = _map_cache.get(key)
+    if maps is not None:
+        _map_cache.move_to_end(key)
+        return maps
+    w, h = size
+    K = np.asarray(K, dtype=np.float64)
+    # 去畸变图像的每个像素在原图中的位置
+    v, u = np.mgrid[0:h, 0:w].astype(np.float32)
+    map_u, map_v = distort_pixels(u, v, K, dist)
+    if cv2 is not None:
+        # 定点格式的remap表, remap更快
+        maps = cv2.convertMaps(map_u, map_v, cv2.CV_16SC2)
+    else:
+        maps = (np.clip(np.rint(map_u), 0, w - 1).astype(np.intp), np.clip(np.rint(map_v), 0, h - 1).astype(np.intp))
+    _map_cache[key] = maps
+    while len(_map_cache) > _MAP_CACHE_SIZE:
+        _map_cache.popitem(last=False)
+    return maps
+
+
+def undistort_image(img, K, dist):
+    """Undistorted copy of img; pinhole projection with K then lines up with it."""
+    h, w = img.shape[:2]
+    map1, map2 = undistort_maps(K, dist, (w, h))
+    if cv2 is not None:
+        return cv2.remap(img, map1, map2, cv2.INTER_LINEAR)
+    return img[map2, map1]
+
+
+def clear_cache():
+    _map_cache.clear()
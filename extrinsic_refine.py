@@ -0,0 +1,291 @@
+import os
+import sys
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+import proj_pcd2cam
+import distortion
+
+# extrinsic_refine.py
+# 功能: 自动微调雷达-相机外参 (6自由度), 使投影后的点云深度/反射率突变处与图像边缘对齐
+# 1.每帧图像: Canny边缘 -> 距离变换 -> 得分图 exp(-d / sigma), 离边缘越近得分越高
+# 2.每帧点云: 与同一扫描线上水平相邻的点比较, 距离突变 (前景边缘) 或反射率突变的点作为边缘点, 突变越大权重越大
+# 3.得分 = 所有帧所有边缘点投影位置的得分图取值之和 (加权), 多帧、多组外参一次向量化计算
+# 4.由粗到细的网格搜索: 在当前外参周围 3^6 个组合中取最优, 中心最优时步长减半; 组合分块交给进程池计算
+#
+# 外参扰动与 adjust_extrinsic_gui.py 的滑块相同: R' = Rx(alpha) Ry(beta) Rz(gamma) R, t' = t + (x, y, z),
+# 作用在YAML中的 CameraExtrinsicMat (Autoware格式) 上, 结果可以直接写回YAML
+
+# 得分图的衰减距离 (像素), Canny阈值
+EDGE_SIGMA = 8.0
+CANNY_THRESHOLDS = (50, 150)
+# 点云边缘: 最小距离突变 (m), 最小反射率突变 (反射率为[0, 1]), 反射率项的权重
+MIN_DEPTH_JUMP = 0.3
+MIN_INTENSITY_JUMP = 0.2
+INTENSITY_WEIGHT = 1.0
+# 俯仰角相差超过该值 (度) 的点属于不同的扫描线
+RING_GAP_DEG = 0.2
+# 同一扫描线上相邻点的最大方位角差 (度)
+NEIGHBOUR_AZIMUTH_DEG = 1.0
+# 初始步长和最小步长: 旋转 (rad), 平移 (m)
+ROT_STEP = 0.02
+TRANS_STEP = 0.1
+MIN_ROT_STEP = 0.0005
+MIN_TRANS_STEP = 0.005
+# 每个步长下最多移动的次数
+MAX_MOVES = 10
+
+# 3^6 个相对当前外参的偏移方向
+GRID = np.array(list(itertools.product((-1, 0, 1), repeat=6)), dtype=np.float64)
+CENTER = int(np.flatnonzero(~GRID.any(axis=1))[0])
+
+# worker进程中的优化问题 (initializer传入一次)
+_worker_problem = None
+
+
+def edge_score_map(image, sigma=EDGE_SIGMA, thresholds=CANNY_THRESHOLDS):
+    """uint8 map, 255 on image edges and decaying as exp(-distance / sigma)."""
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY) if image.ndim == 3 else image
+    edges = cv2.Canny(gray, *thresholds)
+    # 到最近边缘像素的距离
+    dist = cv2.distanceTransform(np.where(edges > 0, 0, 255).astype(np.uint8), cv2.DIST_L2, 5)
+    return np.round(255 * np.exp(-dist / sigma)).astype(np.uint8)
+
+
+def scan_rings(points, min_gap=RING_GAP_DEG):
+    """Ring (laser) id of every point, from gaps in the sorted elevation angles (degrees)."""
+    xyz = points[:, :3]
+    elevation = np.degrees(np.arctan2(xyz[:, 2], np.hypot(xyz[:, 0], xyz[:, 1])))
+    order = np.argsort(elevation)
+    ring = np.empty(len(points), dtype=np.int64)
+    ring[order] = np.concatenate([[0], np.cumsum(np.diff(elevation[order]) > min_gap)])
+    return ring
+
+
+def scan_order(points, max_step=NEIGHBOUR_AZIMUTH_DEG):
+    """(order, same_prev): points reordered along the scan lines, and whether each point
+    is the horizontal neighbour of the one before it.
+
+    Scans stored ring by ring (e.g. KITTI .bin) keep their order; scans stored firing by
+    firing (e.g. VLP-16 driver output) are regrouped into rings by elevation first.
+    """
+    azimuth = np.degrees(np.arctan2(points[:, 1], points[:, 0]))
+    if np.median(np.abs(np.diff(azimuth))) < max_step:
+        order = np.arange(len(points))
+        ring_change = np.zeros(len(points) - 1, dtype=bool)
+    else:
+        ring = scan_rings(points)
+        order = np.lexsort((azimuth, ring))
+        ring_change = np.diff(ring[order]) != 0
+    same_prev = np.zeros(len(points), dtype=bool)
+    # 换线或方位角不连续 (缺失回波) 处不比较
+    same_prev[1:] = (np.abs(np.diff(azimuth[order])) < max_step) & ~ring_change
+    return order, same_prev
+
+
+def edge_points(points, min_depth_jump=MIN_DEPTH_JUMP, min_intensity_jump=MIN_INTENSITY_JUMP,
+                intensity_weight=INTENSITY_WEIGHT):
+    """(xyz, weight) of the lidar points on depth or intensity discontinuities.
+
+    Points are compared with their horizontal neighbours on the same scan line (see scan_order).
+    Only the nearer side of a depth jump is kept, since its silhouette is what the camera sees.
+    """
+    points = np.asarray(points, dtype=np.float32)
+    if len(points) < 3:
+        return np.empty((0, 3), dtype=np.float32), np.empty(0, dtype=np.float32)
+    order, same_prev = scan_order(points)
+    points = points[order]
+    same_next = np.zeros(len(points), dtype=bool)
+    same_next[:-1] = same_prev[1:]
+
+    def neighbour_diff(values, sign):
+        # 与前后相邻点的差, 取较大者
+        prev = np.zeros(len(values), dtype=np.float32)
+        nxt = np.zeros(len(values), dtype=np.float32)
+        prev[1:] = sign(values[:-1] - values[1:])
+        nxt[:-1] = sign(values[1:] - values[:-1])
+        return np.maximum(np.where(same_prev, prev, 0), np.where(same_next, nxt, 0))
+
+    rng = np.linalg.norm(points[:, :3], axis=1)
+    # 相邻点比当前点远得越多, 当前点越可能是前景物体的轮廓
+    depth_jump = neighbour_diff(rng, lambda d: np.maximum(d, 0))
+    weight = np.where(depth_jump >= min_depth_jump, np.sqrt(depth_jump), 0).astype(np.float32)
+    if points.shape[1] > 3 and intensity_weight > 0:
+        intensity_jump = neighbour_diff(points[:, 3], np.abs)
+        weight += np.where(intensity_jump >= min_intensity_jump, intensity_weight * intensity_jump, 0)
+    keep = weight > 0
+    return np.ascontiguousarray(points[keep, :3]), weight[keep]
+
+
+def perturb(extrinsic, params):
+    """Apply (alpha, beta, gamma, x, y, z) to an Autoware extrinsic like the GUI sliders do."""
+    alpha, beta, gamma, x, y, z = params
+    Rx = np.array([[1, 0, 0], [0, np.cos(alpha), -np.sin(alpha)], [0, np.sin(alpha), np.cos(alpha)]])
+    Ry = np.array([[np.cos(beta), 0, np.sin(beta)], [0, 1, 0], [-np.sin(beta), 0, np.cos(beta)]])
+    Rz = np.array([[np.cos(gamma), -np.sin(gamma), 0], [np.sin(gamma), np.cos(gamma), 0], [0, 0, 1]])
+    res = extrinsic.copy()
+    res[:3, :3] = Rx.dot(Ry.dot(Rz.dot(extrinsic[:3, :3])))
+    res[:3, 3] = extrinsic[:3, 3] + (x, y, z)
+    return res
+
+
+class RefineProblem:
+    """Edge points and edge score maps of a batch of frames sharing one calibration."""
+
+    def __init__(self, frames, intrinsic, extrinsic, dist_coeffs=None, sigma=EDGE_SIGMA, convention=None):
+        self.intrinsic = intrinsic
+        self.extrinsic = extrinsic
+        # 外参约定 ('autoware' / 'standard', 见 proj_pcd2cam.py), 子进程中也按同一约定投影
+        self.convention = convention or proj_pcd2cam.EXTRINSIC_CONVENTION
+        self.dist_coeffs = dist_coeffs if distortion.has_distortion(dist_coeffs) else None
+        xyz, weights, offsets, maps = [], [], [], []
+        self.img_h = self.img_w = None
+        for frame in frames:
+            image = frame.image
+            h, w = image.shape[:2]
+            if self.img_h is None:
+                self.img_h, self.img_w = h, w
+            elif (h, w) != (self.img_h, self.img_w):
+                raise ValueError(f'frame {frame.name}: image size {w}x{h} differs from the first frame')
+            pts, weight = edge_points(frame.points)
+            xyz.append(pts)
+            weights.append(weight)
+            offsets.append(np.full(len(pts), len(maps) * h * w, dtype=np.int64))
+            maps.append(edge_score_map(image, sigma).ravel())
+        if not maps:
+            raise ValueError('no frames to refine on')
+        self.num_frames = len(maps)
+        self.xyz = np.concatenate(xyz)
+        self.weights = np.concatenate(weights)
+        self.offsets = np.concatenate(offsets)
+        # 所有帧的得分图拼成一维数组, 按 帧偏移 + v * W + u 取值
+        self.scores = np.concatenate(maps)
+        if self.dist_coeffs is not None:
+            self.r2_max = distortion.max_radius2(intrinsic[:3, :3], self.dist_coeffs, self.img_w, self.img_h) \
+                * distortion.RADIUS_MARGIN ** 2
+        # 只保留初始外参下落在图像内的边缘点: 否则把更多点移进视野 (例如相机沿光轴后退) 也能提高得分
+        _, inside = self.project(np.zeros((1, 6)))
+        keep = inside[0]
+        self.xyz = self.xyz[keep]
+        self.weights = self.weights[keep]
+        self.offsets = self.offsets[keep]
+
+    def projection_matrices(self, params):
+        extrinsics = np.stack([perturb(self.extrinsic, p) for p in params])
+        return proj_pcd2cam.get_projection_matrix(self.intrinsic, extrinsics, self.convention).astype(np.float32)
+
+    def project(self, params):
+        """(flat score index, inside mask), both (C, N), of the edge points for each row of params."""
+        mats = self.projection_matrices(np.atleast_2d(params))
+        # 每个坐标一个 (C, N) 数组: 所有外参、所有帧的边缘点一次投影 (同 projection.project_batch)
+        xyz_t = self.xyz.T
+        cu, cv, z = (mats[:, row, :3].dot(xyz_t) + mats[:, row, 3:] for row in range(3))
+        inside = z > 0
+        z = np.where(inside, z, 1)
+        u = cu / z
+        v = cv / z
+        # 相机后方或视场外很远的点坐标可能溢出, 这些点最后都会被mask掉
+        with np.errstate(over='ignore', invalid='ignore'):
+            if self.dist_coeffs is not None:
+                K = self.intrinsic[:3, :3]
+                x = (u - np.float32(K[0, 2])) / np.float32(K[0, 0])
+                y = (v - np.float32(K[1, 2])) / np.float32(K[1, 1])
+                inside &= x * x + y * y <= self.r2_max
+                u = np.where(inside, u, 0)
+                v = np.where(inside, v, 0)
+                u, v = distortion.distort_pixels(u, v, K, self.dist_coeffs)
+            inside &= (u >= 0) & (u < self.img_w) & (v >= 0) & (v < self.img_h)
+            pix = np.where(inside, self.offsets + v.astype(np.int64) * self.img_w + u.astype(np.int64), 0)
+        return pix, inside
+
+    def cost(self, params):
+        """Alignment score for each row of params (C, 6); higher is better."""
+        pix, inside = self.project(params)
+        gathered = np.where(inside, self.scores[pix], 0).astype(np.float32)
+        return gathered.dot(self.weights) / (255.0 * self.num_frames)
+
+
+def _init_worker(problem):
+    global _worker_problem
+    _worker_problem = problem
+
+
+def _worker_cost(params):
+    return _worker_problem.cost(params)
+
+
+def refine(problem, rot_step=ROT_STEP, trans_step=TRANS_STEP, min_rot_step=MIN_ROT_STEP,
+           min_trans_step=MIN_TRANS_STEP, workers=None, chunk=27, verbose=True, mp_context=None, progress=None):
+    """Coarse-to-fine grid search around problem.extrinsic.
+
+    Returns (refined extrinsic, report) where the report has the initial/final score and
+    the accumulated offset (alpha, beta, gamma, x, y, z).
+    mp_context is passed to the process pool (use 'spawn' when calling from a threaded program).
+    progress(rot_step, trans_step, score) is called after every step size.
+    """
+    workers = workers or os.cpu_count()
+    executor = None
+    if workers > 1:
+        if isinstance(mp_context, str):
+            mp_context = multiprocessing.get_context(mp_context)
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=mp_context, initializer=_init_worker,
+                                       initargs=(problem,))
+
+    def evaluate(candidates):
+        chunks = [candidates[i:i + chunk] for i in range(0, len(candidates), chunk)]
+        if executor is None:
+            return np.concatenate([problem.cost(c) for c in chunks])
+        return np.concatenate(list(executor.map(_worker_cost, chunks)))
+
+    current = np.zeros(6)
+    step = np.array([rot_step] * 3 + [trans_step] * 3)
+    min_step = np.array([min_rot_step] * 3 + [min_trans_step] * 3)
+    initial = best = float(problem.cost(current)[0])
+    evaluations = 1
+    try:
+        while True:
+            for _ in range(MAX_MOVES):
+                scores = evaluate(current + GRID * step)
+                evaluations += len(GRID)
+                i = int(np.argmax(scores))
+                if i == CENTER or scores[i] <= best:
+                    break
+                current = current + GRID[i] * step
+                best = float(scores[i])
+            if verbose:
+                print(f'step rot {step[0]:.4f} rad, trans {step[3]:.4f} m: score {best:.4f}')
+            if progress is not None:
+                progress(step[0], step[3], best)
+            if np.all(step <= min_step):
+                break
+            step = np.maximum(step / 2, min_step)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    report = {'initial_score': initial, 'final_score': best, 'offset': current.tolist(),
+              'evaluations': evaluations, 'frames': problem.num_frames, 'edge_points': len(problem.xyz)}
+    return perturb(problem.extrinsic, current), report
+
+
+def refine_source(source, calib_file, num_frames=20, extrinsic=None, convention=None, **kwargs):
+    """Refine the extrinsic of calib_file on num_frames frames evenly spread over source (or a list of Frames)."""
+    intrinsic, calib_extrinsic = proj_pcd2cam.get_calib_param(calib_file)
+    dist_coeffs = proj_pcd2cam.get_distortion_param(calib_file)
+    step = max(1, len(source) // max(1, num_frames))
+    frames = [source[i] for i in range(0, len(source), step)][:num_frames]
+    problem = RefineProblem(frames, intrinsic, calib_extrinsic if extrinsic is None else extrinsic, dist_coeffs,
+                            convention=convention)
+    return refine(problem, **kwargs)
+
+
+def main():
+    # 路径、候选帧、外参约定等由命令行给出: python3 cli.py calibrate ... (见 cli.py)
+    import cli
+    cli.main(['calibrate'] + sys.argv[1:])
+
+
+if __name__ == '__main__':
+    main()
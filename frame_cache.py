@@ -0,0 +1,138 @@
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# frame_cache.py
+# 功能: 后台线程池预读帧数据, 按字节数限制的LRU缓存
+# 1.request(i) 命中缓存直接返回, 否则提交后台读取
+# 2.prefetch(center) 预读 center±radius 的帧, 离开窗口的未开始任务会被取消
+# 3.读取完成的结果放入队列, 由调用方在主线程 poll() 取出 (GUI中用 after() 定时调用), 工作线程不接触Tk
+
+
+def nbytes_of(value):
+    """Approximate memory size of a loaded frame (arrays, or tuples/dicts of arrays)."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(nbytes_of(v) for v in value.values())
+    if isinstance(value, (tuple, list)):
+        return sum(nbytes_of(v) for v in value)
+    return 0
+
+
+class FrameCache:
+    """LRU cache bounded by the total size in bytes of its values."""
+
+    def __init__(self, max_bytes=1 << 30):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            self._items.move_to_end(key)
+            return item[0]
+
+    def put(self, key, value):
+        size = nbytes_of(value)
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[1]
+            self._items[key] = (value, size)
+            self.nbytes += size
+            # 超出容量时淘汰最久未使用的帧, 至少保留刚放入的这一帧
+            while self.nbytes > self.max_bytes and len(self._items) > 1:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self.nbytes -= evicted
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.nbytes = 0
+
+
+class FramePrefetcher:
+    """Load frames with load_fn(index) on a thread pool, caching results in a FrameCache."""
+
+    def __init__(self, load_fn, num_frames, max_bytes=1 << 30, radius=5, workers=2):
+        self.load_fn = load_fn
+        self.num_frames = num_frames
+        self.radius = radius
+        self.cache = FrameCache(max_bytes)
+        self.results = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='frame-loader')
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def _load(self, index):
+        try:
+            value = self.load_fn(index)
+        except Exception as e:
+            self.results.put((index, None, e))
+        else:
+            self.cache.put(index, value)
+            self.results.put((index, value, None))
+        finally:
+            with self._lock:
+                self._inflight.pop(index, None)
+
+    def _submit(self, index):
+        with self._lock:
+            if index in self._inflight or index in self.cache:
+                return
+            self._inflight[index] = self._executor.submit(self._load, index)
+
+    def request(self, index):
+        """Return the frame if cached, else schedule it (delivered through poll()) and return None."""
+        value = self.cache.get(index)
+        if value is None:
+            self._submit(index)
+        self.prefetch(index)
+        return value
+
+    def prefetch(self, center):
+        """Load frames around center (nearest first) and cancel queued loads outside the window."""
+        lo = max(0, center - self.radius)
+        hi = min(self.num_frames - 1, center + self.radius)
+        with self._lock:
+            for index, future in list(self._inflight.items()):
+                if (index < lo or index > hi) and future.cancel():
+                    del self._inflight[index]
+        for offset in range(1, self.radius + 1):
+            for index in (center + offset, center - offset):
+                if lo <= index <= hi:
+                    self._submit(index)
+
+    def poll(self):
+        """Completed (index, value, error) tuples since the last call; call from the main thread."""
+        done = []
+        while True:
+            try:
+                done.append(self.results.get_nowait())
+            except queue.Empty:
+                return done
+
+    def load_now(self, index):
+        """Load synchronously (bypassing the pool), e.g. for the first frame."""
+        value = self.cache.get(index)
+        if value is None:
+            value = self.load_fn(index)
+            self.cache.put(index, value)
+        return value
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,455 @@
+import os
+import glob
+import functools
+import warnings
+import kitti_calib
+import velo_scan
+import pcd_io
+import render
+import projection
+import sync_index
+import distortion
+import metrics
+import frame_store
+
+# frame_source.py
+# 功能: 统一的数据帧读取接口, KITTI / ROS (PCD + YAML) / 时间同步清单 三种数据源
+# 1.帧索引在构造时建立一次
+# 2.source[i] 返回 Frame, 点云/图像/标定在第一次访问时才读取
+# 3.所有数据源都可以迭代或用 stream() 得到帧的生成器, 供批处理、GUI、导出共用
+# 4.读取、过滤、投影的耗时和点数记录到 metrics (默认关闭, 见 metrics.py)
+# 5.点云目录旁有与源文件一致的 <目录>.pcs 存储文件时 (见 frame_store.py), 点云从中零拷贝读取
+# 6.KITTI 连续序列 (odometry / raw) 按时间顺序的帧, 用于多帧叠加 (见 accumulate.py)
+# 7.KITTI 可选 scan_cache: 点云经紧凑缓存 (float16 xyz + uint8 反射率, 见 velo_scan.py) 读取,
+#   过滤器带 ROI 时读取时就裁剪, 包围盒与 ROI 不相交的帧不读点数据
+
+
+class CameraLidarCalib:
+    """Autoware camera/lidar calibration (intrinsic 3x4, extrinsic 4x4) with the KittiCalib projection API.
+
+    dist_coeffs are the plumb_bob coefficients (None for an undistorted camera).
+    convention is the extrinsic convention, 'autoware' or 'standard' (None: the current
+    proj_pcd2cam.EXTRINSIC_CONVENTION, read on every call and not cached).
+    """
+
+    def __init__(self, intrinsic, extrinsic, dist_coeffs=None, convention=None):
+        self.intrinsic = intrinsic
+        self.extrinsic = extrinsic
+        self.dist_coeffs = dist_coeffs
+        self.convention = convention
+        self._velo_to_img = None
+
+    @property
+    def camera_mat(self):
+        return self.intrinsic[:3, :3]
+
+    def velo_to_img(self, cam=None):
+        import proj_pcd2cam
+        if self.convention is None:
+            # 全局约定可能在之后被 set_extrinsic_convention() 修改, 不缓存
+            return proj_pcd2cam.get_projection_matrix(self.intrinsic, self.extrinsic)
+        if self._velo_to_img is None:
+            self._velo_to_img = proj_pcd2cam.get_projection_matrix(self.intrinsic, self.extrinsic, self.convention)
+        return self._velo_to_img
+
+
+def read_camera_lidar_calib(calib_file, convention=None):
+    """CameraLidarCalib of an Autoware calibration YAML, parsed on every call."""
+    import proj_pcd2cam
+    intrinsic, extrinsic = proj_pcd2cam.get_calib_param(calib_file)
+    return CameraLidarCalib(intrinsic, extrinsic, proj_pcd2cam.get_distortion_param(calib_file), convention)
+
+
+@functools.lru_cache(maxsize=16)
+def _cached_camera_lidar_calib(calib_file, convention):
+    return read_camera_lidar_calib(calib_file, convention)
+
+
+def load_camera_lidar_calib(calib_file, convention=None):
+    """Cached read_camera_lidar_calib.
+
+    convention None is resolved to proj_pcd2cam.EXTRINSIC_CONVENTION before the lookup,
+    so a later set_extrinsic_convention() does not return a matrix composed for the old one.
+    """
+    import proj_pcd2cam
+    return _cached_camera_lidar_calib(calib_file, convention or proj_pcd2cam.EXTRINSIC_CONVENTION)
+
+
+def load_points(points_file):
+    """(N, 4) float32 [x, y, z, intensity] from a KITTI .bin or a .pcd file."""
+    if points_file.endswith('.pcd'):
+        cloud = pcd_io.read_pcd(points_file)
+        points = pcd_io.pcd_to_xyzi(cloud)
+        metrics.count('points_origin', len(cloud))
+    else:
+        points = velo_scan.open_scan(points_file)
+        metrics.count('points_origin', len(points))
+    metrics.count('points_valid', len(points))
+    return points
+
+
+def load_store_points(store, name):
+    """Points of frame name from a frame_store.FrameStore (a read-only view of its mmap)."""
+    points = store.points(name)
+    metrics.count('points_valid', len(points))
+    return points
+
+
+def load_cached_scan(points_file, cache_dir, roi=None):
+    """Points of a KITTI scan through the velo_scan compact cache in cache_dir, cropped to roi while reading."""
+    points = velo_scan.load_scan(points_file, cache_dir, roi)
+    metrics.count('points_valid', len(points))
+    return points
+
+
+def _store_loader(store, name):
+    return functools.partial(load_store_points, store, name) if store is not None else None
+
+
+def _resolve_store(store, points_dir, files, names):
+    # store: None 时自动使用 <点云目录>.pcs (必须与源文件一致), False 不使用, 或存储文件路径
+    if store is False or (store is None and points_dir is None):
+        return None
+    if store is None:
+        return frame_store.find_store(points_dir, files, names)
+    return frame_store.open_store(store)
+
+
+class Frame:
+    """One lidar/camera frame; points, image and calib are loaded lazily and kept.
+
+    distortion (for calibrations with dist_coeffs): 'points' distorts the projected points
+    onto the raw image, 'image' undistorts the image instead (cached remap tables),
+    'none' ignores the lens distortion.
+    point_filter: optional prefilter.PointFilter applied before projection.
+    points_loader: optional callable returning the points instead of reading points_file.
+    """
+
+    def __init__(self, name, points_file, image_file, calib_loader, front_only=False, cam=2, distortion='points',
+                 point_filter=None, points_loader=None):
+        self.name = name
+        self.points_file = points_file
+        self.image_file = image_file
+        self.front_only = front_only
+        self.cam = cam
+        self.distortion = distortion
+        self.point_filter = point_filter
+        self._calib_loader = calib_loader
+        self._points_loader = points_loader
+        self._points = None
+        self._image = None
+        self._image_size = None
+        self._calib = None
+
+    @property
+    def points(self):
+        if self._points is None:
+            with metrics.stage('load_points'):
+                if self._points_loader is not None:
+                    self._points = self._points_loader()
+                else:
+                    self._points = load_points(self.points_file)
+        return self._points
+
+    @points.setter
+    def points(self, points):
+        # 例如用多帧叠加后的点云代替单帧点云 (见 accumulate.py)
+        self._points = points
+
+    @property
+    def image(self):
+        """RGB uint8 image."""
+        if self._image is None:
+            dist = self._dist_coeffs()
+            with metrics.stage('load_image'):
+                image = render.load_image(self.image_file)
+            if self.distortion == 'image' and dist is not None:
+                with metrics.stage('undistort_image'):
+                    image = distortion.undistort_image(image, self.calib.camera_mat, dist)
+            self._image = image
+            self._image_size = image.shape[:2]
+        return self._image
+
+    @property
+    def image_size(self):
+        """(height, width), read from the image header when the image is not loaded."""
+        if self._image_size is None:
+            self._image_size = render.image_size(self.image_file)
+        return self._image_size
+
+    @property
+    def calib(self):
+        if self._calib is None:
+            with metrics.stage('calib'):
+                self._calib = self._calib_loader()
+        return self._calib
+
+    @calib.setter
+    def calib(self, calib):
+        self._calib = calib
+
+    def _dist_coeffs(self):
+        dist = getattr(self.calib, 'dist_coeffs', None)
+        return dist if distortion.has_distortion(dist) else None
+
+    def proj_mat(self):
+        return self.calib.velo_to_img(self.cam)
+
+    def project(self, out=None, points=None):
+        """projection.project_points of this frame's points onto its image."""
+        # 先读取点云和标定 (各自计时), 下面的 filter / project 只包含计算
+        h, w = self.image_size
+        points = self.points if points is None else points
+        dist = self._dist_coeffs()
+        proj_mat = self.proj_mat()
+        distort = self.distortion == 'points' and dist is not None
+        select = None
+        if self.point_filter is not None:
+            with metrics.stage('filter'):
+                # 加畸变时针孔模型的视锥不准确, 只剔除相机后方的点
+                bounds = (None, None) if distort else (w, h)
+                select = self.point_filter.select(points, proj_mat, *bounds)
+                points = points[select]
+            metrics.count('points_filtered', len(points))
+        with metrics.stage('project'):
+            if not distort:
+                proj = projection.project_points(proj_mat, points, w, h, front_only=self.front_only, out=out)
+            else:
+                # 先做不限制图像范围的针孔投影, 加畸变后再按图像范围过滤
+                proj = projection.project_points(proj_mat, points, front_only=self.front_only, out=out)
+                proj = distortion.distort_projection(proj, self.calib.camera_mat, dist, w, h)
+            if select is not None:
+                # index 对应过滤前的点
+                proj = proj._replace(index=select[proj.index])
+        metrics.count('points_visible', len(proj.u))
+        return proj
+
+    def load(self):
+        """Load everything now (e.g. in a prefetch thread) and return self."""
+        _ = self.points
+        _ = self.image
+        _ = self.calib
+        return self
+
+
+class FrameSource:
+    """Base class: subclasses fill self.names and implement frame(i).
+
+    sequential: the frames are consecutive in time (required for multi-frame accumulation).
+    """
+
+    names = []
+    sequential = False
+
+    def __len__(self):
+        return len(self.names)
+
+    def index_of(self, name):
+        if not hasattr(self, '_index'):
+            self._index = {n: i for i, n in enumerate(self.names)}
+        return self._index[name]
+
+    def __getitem__(self, i):
+        if isinstance(i, str):
+            i = self.index_of(i)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.frame(i)
+
+    def __iter__(self):
+        return self.stream()
+
+    def stream(self, start=0, stop=None, step=1):
+        """Generator of frames in [start, stop) with the given stride."""
+        for i in range(*slice(start, stop, step).indices(len(self))):
+            yield self.frame(i)
+
+
+def _scan_loader(points_file, scan_cache, split, point_filter):
+    if scan_cache is None:
+        return None
+    # 每个 split 一个子目录: 不同 split 的帧号相同
+    roi = point_filter.roi if point_filter is not None else None
+    return functools.partial(load_cached_scan, points_file, os.path.join(scan_cache, split), roi)
+
+
+def kitti_frame(number, root='.', split='testing', cam=2, calib=None, point_filter=None, store=None,
+                scan_cache=None):
+    """Frame of a KITTI object split without building an index.
+
+    store: an open FrameStore holding its scan. scan_cache: directory of compact scan caches
+    (see velo_scan.py), used when the scan is not read from a store.
+    """
+    calib_file = os.path.join(root, split, 'calib', f'{number}.txt')
+    points_file = os.path.join(root, 'data_object_velodyne', split, 'velodyne', f'{number}.bin')
+    frame = Frame(number, points_file,
+                  os.path.join(root, f'data_object_image_{cam}', split, f'image_{cam}', f'{number}.png'),
+                  functools.partial(kitti_calib.load_calib, calib_file), front_only=True, cam=cam,
+                  point_filter=point_filter,
+                  points_loader=(_store_loader(store, number)
+                                 or _scan_loader(points_file, scan_cache, split, point_filter)))
+    if calib is not None:
+        frame.calib = calib
+    return frame
+
+
+class KittiSource(FrameSource):
+    """KITTI object split: data_object_image_2/<split>/image_2, data_object_velodyne/<split>/velodyne, <split>/calib.
+
+    store: None uses velodyne.pcs next to the scan directory when it is up to date,
+    False never uses a store, or the path of a frame_store file.
+    scan_cache: directory of compact scan caches, built on first use (see velo_scan.py).
+    """
+
+    def __init__(self, root='.', split='testing', cam=2, point_filter=None, store=None, scan_cache=None):
+        self.root = root
+        self.split = split
+        self.cam = cam
+        self.point_filter = point_filter
+        self.scan_cache = scan_cache
+        img_dir = os.path.join(root, f'data_object_image_{cam}', split, f'image_{cam}')
+        velo_dir = os.path.join(root, 'data_object_velodyne', split, 'velodyne')
+        images = {os.path.splitext(f)[0] for f in os.listdir(img_dir) if f.endswith('.png')}
+        scans = {os.path.splitext(f)[0] for f in os.listdir(velo_dir) if f.endswith('.bin')}
+        self.names = sorted(images & scans)
+        self.store = _resolve_store(store, velo_dir, [os.path.join(velo_dir, f'{name}.bin') for name in self.names],
+                                    self.names)
+
+    def frame(self, i):
+        return kitti_frame(self.names[i], self.root, self.split, self.cam, point_filter=self.point_filter,
+                           store=self.store, scan_cache=self.scan_cache)
+
+    def calib_file(self, name):
+        return os.path.join(self.root, self.split, 'calib', f'{name}.txt')
+
+
+class KittiSequenceSource(FrameSource):
+    """Consecutive frames of one KITTI sequence, in time order (object splits are not sequences).
+
+    odometry: <seq_dir>/image_<cam>, <seq_dir>/velodyne, <seq_dir>/calib.txt.
+    raw: <seq_dir>/image_0<cam>/data, <seq_dir>/velodyne_points/data, <seq_dir>/oxts/data and the
+    calib_*.txt files in its parent (date) directory.
+    scan_cache: directory of compact scan caches (see velo_scan.py).
+    """
+
+    sequential = True
+
+    def __init__(self, seq_dir, cam=2, point_filter=None, scan_cache=None):
+        self.seq_dir = seq_dir
+        self.cam = cam
+        self.point_filter = point_filter
+        if os.path.isdir(os.path.join(seq_dir, f'image_0{cam}')):
+            img_dir = os.path.join(seq_dir, f'image_0{cam}', 'data')
+            velo_dir = os.path.join(seq_dir, 'velodyne_points', 'data')
+            self.oxts_dir = os.path.join(seq_dir, 'oxts', 'data')
+            self.calib = kitti_calib.load_raw_calib(os.path.dirname(os.path.abspath(seq_dir)))
+        elif os.path.isdir(os.path.join(seq_dir, f'image_{cam}')):
+            img_dir = os.path.join(seq_dir, f'image_{cam}')
+            velo_dir = os.path.join(seq_dir, 'velodyne')
+            self.oxts_dir = None
+            self.calib = kitti_calib.load_odometry_calib(os.path.join(seq_dir, 'calib.txt'))
+        else:
+            raise ValueError(f'{seq_dir} is not a KITTI odometry sequence or raw drive directory')
+        self.img_dir = img_dir
+        # 帧号即时间顺序; 点云经 ScanSource 读取 (可选紧凑缓存, 每个序列一个子目录; 读取时按ROI裁剪)
+        if scan_cache is not None:
+            scan_cache = os.path.join(scan_cache, os.path.basename(os.path.normpath(seq_dir)))
+        self.scans = velo_scan.ScanSource(velo_dir, scan_cache)
+        self._roi = point_filter.roi if point_filter is not None else None
+        images = {os.path.splitext(f)[0] for f in os.listdir(img_dir) if f.endswith('.png')}
+        self.names = [name for name in self.scans.names if name in images]
+
+    def frame(self, i):
+        name = self.names[i]
+        return Frame(name, self.scans.paths[self.scans.index_of(name)], os.path.join(self.img_dir, f'{name}.png'),
+                     lambda: self.calib, front_only=True, cam=self.cam, point_filter=self.point_filter,
+                     points_loader=functools.partial(self.scans.load, name, self._roi))
+
+
+def _sort_key(name):
+    try:
+        return (0, sync_index.parse_timestamp(name), name)
+    except ValueError:
+        return (1, 0, name)
+
+
+class PcdSource(FrameSource):
+    """ROS extraction: images and .pcd files paired by sorted order, one Autoware calibration YAML.
+
+    store: None uses <pointcloud_dir>.pcs when it is up to date with the .pcd files
+    (see frame_store.py), False never uses a store, or the path of a frame_store file.
+    extrinsic_convention: 'autoware' or 'standard' extrinsic in calib_file (see proj_pcd2cam.py).
+    Different numbers of images and clouds raise ValueError (pairing by order would be wrong
+    after the first gap; use a ManifestSource); strict=False only warns and pairs the shorter list.
+    """
+
+    def __init__(self, img_dir, pointcloud_dir, calib_file, img_ext='.jpg', pt_ext='.pcd', distortion='points',
+                 point_filter=None, store=None, extrinsic_convention=None, strict=True):
+        self.calib_file = calib_file
+        self.extrinsic_convention = extrinsic_convention
+        self.distortion = distortion
+        self.point_filter = point_filter
+        images = [os.path.splitext(os.path.basename(p))[0] for p in glob.glob(os.path.join(img_dir, f'*{img_ext}'))]
+        clouds = [os.path.splitext(os.path.basename(p))[0] for p in glob.glob(os.path.join(pointcloud_dir, f'*{pt_ext}'))]
+        images.sort(key=_sort_key)
+        clouds.sort(key=_sort_key)
+        if len(images) != len(clouds):
+            message = (f'{len(images)} images in {img_dir} but {len(clouds)} point clouds in {pointcloud_dir}: '
+                       f'pairing by sorted order is wrong after the first missing file, use a sync manifest')
+            if strict:
+                raise ValueError(message)
+            warnings.warn(message)
+        n = min(len(images), len(clouds))
+        self.image_files = [os.path.join(img_dir, f + img_ext) for f in images[:n]]
+        self.points_files = [os.path.join(pointcloud_dir, f + pt_ext) for f in clouds[:n]]
+        self.names = images[:n]
+        self.cloud_names = clouds[:n]
+        self.store = _resolve_store(store, pointcloud_dir, self.points_files, self.cloud_names)
+
+    def frame(self, i):
+        return Frame(self.names[i], self.points_files[i], self.image_files[i],
+                     functools.partial(load_camera_lidar_calib, self.calib_file, self.extrinsic_convention),
+                     distortion=self.distortion, point_filter=self.point_filter,
+                     points_loader=_store_loader(self.store, self.cloud_names[i]))
+
+
+class ManifestSource(FrameSource):
+    """Pairs from a sync_index manifest (columns 'reference' = point cloud, image_column = image).
+
+    Frames are named after the point cloud: with nearest matching several clouds can share one image.
+    """
+
+    def __init__(self, manifest_file, calib_file, image_column='image', distortion='points',
+                 point_filter=None, store=None, extrinsic_convention=None):
+        self.calib_file = calib_file
+        self.extrinsic_convention = extrinsic_convention
+        self.distortion = distortion
+        self.point_filter = point_filter
+        rows = sync_index.read_manifest(manifest_file)
+        self.points_files = [row['reference'] for row in rows]
+        self.image_files = [row[image_column] for row in rows]
+        # 清单中的点云可能来自不同目录, 只使用明确给出的存储文件
+        self.cloud_names = [os.path.splitext(os.path.basename(p))[0] for p in self.points_files]
+        # 按最近时间匹配时多帧点云可能对应同一张图像, 帧名 (输出文件名) 取自唯一的点云文件名
+        self.names = list(self.cloud_names)
+        self.store = _resolve_store(store, None, self.points_files, self.cloud_names)
+
+    def frame(self, i):
+        return Frame(self.names[i], self.points_files[i], self.image_files[i],
+                     functools.partial(load_camera_lidar_calib, self.calib_file, self.extrinsic_convention),
+                     distortion=self.distortion, point_filter=self.point_filter,
+                     points_loader=_store_loader(self.store, self.cloud_names[i]))
+
+
+class SubsetSource(FrameSource):
+    """The frames of source at the given indices, in that order (e.g. a --frames selection)."""
+
+    def __init__(self, source, indices):
+        self.source = source
+        self.indices = list(indices)
+        self.names = [source.names[i] for i in self.indices]
+
+    def frame(self, i):
+        return self.source.frame(self.indices[i])
@@ -0,0 +1,267 @@
+import os
+import sys
+import json
+import mmap
+import zlib
+import struct
+import functools
+import numpy as np
+from tqdm import tqdm
+import pcd_io
+import velo_scan
+
+# frame_store.py
+# 功能: 把一个序列的点云 (.pcd / KITTI .bin) 转换成一个列存储文件, 重复处理时不再解析PCD
+# 1.每帧每个字段一个连续的数据块 (64字节对齐): 'points' 为 (N, 4) float32 [x, y, z, intensity]
+#   (与 frame_source.load_points 的结果相同), 可选保存PCD的其他字段 (ring, time ...)
+# 2.文件末尾是JSON索引 (帧名、源文件大小和修改时间、每个数据块的偏移和长度), 写入时可以流式追加
+# 3.读取时整个文件 mmap, 按帧号/帧名取出的数组是文件的只读视图, 不拷贝
+# 4.可选 zlib 压缩 (每个数据块单独压缩), 压缩后读取需要解压, 不再是零拷贝
+#
+#   | MAGIC VERSION | 帧0 points | 帧0 ring | ... | 帧1 points | ... | JSON索引 | 索引偏移 索引长度 MAGIC |
+
+STORE_EXT = '.pcs'
+STORE_MAGIC = b'PCST'
+STORE_VERSION = 1
+STORE_HEADER = struct.Struct('<4sI')
+# 索引偏移, 索引长度, magic
+STORE_TRAILER = struct.Struct('<QQ4s')
+BLOCK_ALIGN = 64
+COMPRESSIONS = (None, 'zlib')
+POINTS_FIELD = 'points'
+
+
+def default_path(points_dir):
+    """Store file that sits next to a point cloud directory: <dir>.pcs."""
+    return os.path.normpath(points_dir) + STORE_EXT
+
+
+def _source_stat(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def read_cloud(path, fields=()):
+    """{field: array} of one source file: 'points' (N, 4) float32 plus the requested extra PCD fields."""
+    if not path.endswith('.pcd'):
+        return {POINTS_FIELD: np.asarray(velo_scan.open_scan(path))}
+    cloud = pcd_io.read_pcd(path)
+    points, valid = pcd_io.pcd_to_xyzi(cloud, return_valid=True)
+    res = {POINTS_FIELD: points}
+    for name in fields:
+        if name not in cloud.dtype.names:
+            raise KeyError(f'{path} has no field {name}')
+        res[name] = cloud[name] if valid is None else cloud[name][valid]
+    return res
+
+
+class StoreWriter:
+    """Append frames to a new store file; the index is written by close()."""
+
+    def __init__(self, path, compression=None, level=1):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f'unsupported compression: {compression}')
+        self.path = path
+        self.compression = compression
+        self.level = level
+        self.frames = []
+        self.fields = {}
+        self.blocks = {}
+        # 先写临时文件, 完成后再替换, 中断时不会留下损坏的存储文件
+        self._tmp_path = path + '.tmp'
+        self._f = open(self._tmp_path, 'wb')
+        self._f.write(STORE_HEADER.pack(STORE_MAGIC, STORE_VERSION))
+
+    def _write_block(self, data):
+        pos = self._f.tell()
+        pad = -pos % BLOCK_ALIGN
+        if pad:
+            self._f.write(b'\0' * pad)
+            pos += pad
+        self._f.write(data)
+        return [pos, len(data)]
+
+    def add(self, name, arrays, source=None):
+        """Add one frame: arrays is {field: array with one row per point}; every frame needs the same fields."""
+        n = len(arrays[POINTS_FIELD])
+        if self.frames and set(arrays) != set(self.fields):
+            raise ValueError(f'frame {name} has fields {sorted(arrays)}, expected {sorted(self.fields)}')
+        frame = {'name': name, 'points': n}
+        if source is not None:
+            frame['source'] = os.path.abspath(source)
+            frame['size'], frame['mtime_ns'] = _source_stat(source)
+        for field, arr in arrays.items():
+            arr = np.asarray(arr)
+            if len(arr) != n:
+                raise ValueError(f'field {field} of frame {name} has {len(arr)} rows, expected {n}')
+            arr = np.ascontiguousarray(arr, dtype=arr.dtype.newbyteorder('<'))
+            desc = {'dtype': arr.dtype.str, 'shape': list(arr.shape[1:])}
+            if self.fields.setdefault(field, desc) != desc:
+                raise ValueError(f'field {field} of frame {name} is {desc}, expected {self.fields[field]}')
+            data = arr.tobytes()
+            if self.compression == 'zlib':
+                data = zlib.compress(data, self.level)
+            self.blocks.setdefault(field, []).append(self._write_block(data))
+        self.frames.append(frame)
+
+    def close(self):
+        index = json.dumps({'version': STORE_VERSION, 'compression': self.compression, 'fields': self.fields,
+                            'frames': self.frames, 'blocks': self.blocks}).encode('utf-8')
+        pos = self._f.tell()
+        self._f.write(index)
+        self._f.write(STORE_TRAILER.pack(pos, len(index), STORE_MAGIC))
+        self._f.close()
+        os.replace(self._tmp_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self._f.close()
+            os.remove(self._tmp_path)
+
+
+def write_store(path, files, names=None, compression=None, fields=(), verbose=True):
+    """Convert source files (.pcd / .bin) into one store at path; names default to the file stems."""
+    if names is None:
+        names = [os.path.splitext(os.path.basename(f))[0] for f in files]
+    with StoreWriter(path, compression) as writer:
+        for name, file in tqdm(list(zip(names, files)), disable=not verbose):
+            writer.add(name, read_cloud(file, fields), source=file)
+    return path
+
+
+def convert_dir(points_dir, path=None, ext=None, compression=None, fields=(), verbose=True):
+    """Convert every .pcd (or .bin) file of a directory into <dir>.pcs (or path)."""
+    if ext is None:
+        ext = '.pcd' if any(f.endswith('.pcd') for f in os.listdir(points_dir)) else '.bin'
+    files = sorted(os.path.join(points_dir, f) for f in os.listdir(points_dir) if f.endswith(ext))
+    return write_store(path or default_path(points_dir), files, compression=compression, fields=fields,
+                       verbose=verbose)
+
+
+class FrameStore:
+    """Read-only view of a store file; points(i) / column(field, i) return arrays backed by the mmap."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            magic, version = STORE_HEADER.unpack(f.read(STORE_HEADER.size))
+            if magic != STORE_MAGIC:
+                raise ValueError(f'{path} is not a frame store')
+            if version != STORE_VERSION:
+                raise ValueError(f'unsupported frame store version {version}')
+            f.seek(-STORE_TRAILER.size, os.SEEK_END)
+            pos, length, magic = STORE_TRAILER.unpack(f.read(STORE_TRAILER.size))
+            if magic != STORE_MAGIC:
+                raise ValueError(f'{path} is truncated (no index)')
+            f.seek(pos)
+            index = json.loads(f.read(length).decode('utf-8'))
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.compression = index['compression']
+        self.fields = {name: (np.dtype(d['dtype']), tuple(d['shape'])) for name, d in index['fields'].items()}
+        self.frames = index['frames']
+        self.blocks = index['blocks']
+        self.names = [frame['name'] for frame in self.frames]
+        self.counts = np.array([frame['points'] for frame in self.frames], dtype=np.int64)
+        self._index = {name: i for i, name in enumerate(self.names)}
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def index_of(self, name):
+        return self._index[name]
+
+    def column(self, field, i):
+        """Array of one field of frame i (index or name), shape (N,) + field shape."""
+        if isinstance(i, str):
+            i = self._index[i]
+        dtype, shape = self.fields[field]
+        n = int(self.counts[i])
+        pos, nbytes = self.blocks[field][i]
+        if self.compression == 'zlib':
+            return np.frombuffer(zlib.decompress(self._mm[pos:pos + nbytes]), dtype=dtype).reshape((n,) + shape)
+        if n == 0:
+            return np.empty((0,) + shape, dtype=dtype)
+        return np.frombuffer(self._mm, dtype=dtype, count=nbytes // dtype.itemsize, offset=pos).reshape((n,) + shape)
+
+    def points(self, i):
+        """(N, 4) float32 [x, y, z, intensity] of frame i (index or name), without copying."""
+        return self.column(POINTS_FIELD, i)
+
+    def is_fresh(self, files, names=None):
+        """True when every file is in the store (by name) with the same size and mtime as when converted."""
+        if names is None:
+            names = [os.path.splitext(os.path.basename(f))[0] for f in files]
+        for name, file in zip(names, files):
+            i = self._index.get(name)
+            if i is None:
+                return False
+            frame = self.frames[i]
+            try:
+                if (frame.get('size'), frame.get('mtime_ns')) != _source_stat(file):
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def close(self):
+        # 仍有数组引用mmap时不能关闭, 交给垃圾回收
+        try:
+            self._mm.close()
+        except BufferError:
+            pass
+
+    def __getstate__(self):
+        # 多进程时只传路径, 子进程重新 mmap
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+@functools.lru_cache(maxsize=8)
+def _open_cached(path, size, mtime_ns):
+    return FrameStore(path)
+
+
+def open_store(path):
+    """FrameStore of path, shared while the file is unchanged."""
+    return _open_cached(os.path.abspath(path), *_source_stat(path))
+
+
+def find_store(points_dir, files, names=None):
+    """Open <points_dir>.pcs when it exists and is up to date with files, else None."""
+    path = default_path(points_dir)
+    if not os.path.exists(path):
+        return None
+    try:
+        store = open_store(path)
+    except (OSError, ValueError):
+        return None
+    return store if store.is_fresh(files, names) else None
+
+
+def main():
+    # convert / info 对应 python3 cli.py store-convert / store-info (见 cli.py)
+    import cli
+    argv = sys.argv[1:]
+    if argv[:1] in (['convert'], ['info']):
+        argv = ['store-' + argv[0]] + argv[1:]
+    cli.main(argv)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+import os
+import hashlib
+from collections import OrderedDict
+import numpy as np
+
+# kitti_calib.py
+# 功能: 解析KITTI标定文件 testing/calib/{number}.txt, 并缓存解析结果
+# 同一个drive的所有帧标定文件内容相同, 按内容哈希去重, 整个drive只解析一次
+# 另外读取连续序列的标定: odometry 的 sequences/NN/calib.txt, raw 数据日期目录下的 calib_*.txt
+
+# 标定文件中各个key对应的矩阵形状
+CALIB_SHAPES = {
+    'P0': (3, 4),
+    'P1': (3, 4),
+    'P2': (3, 4),
+    'P3': (3, 4),
+    'R0_rect': (3, 3),
+    'Tr_velo_to_cam': (3, 4),
+    'Tr_imu_to_velo': (3, 4),
+    # odometry calib.txt 中的雷达到相机0
+    'Tr': (3, 4),
+}
+
+
+def to_homogeneous(mat):
+    """Pad a 3x3 or 3x4 matrix to 4x4 with [0 0 0 1] as the last row."""
+    res = np.eye(4)
+    res[:mat.shape[0], :mat.shape[1]] = mat
+    return res
+
+
+class KittiCalib:
+    def __init__(self, mats):
+        self.mats = mats
+        # 相机内参 camera0~3
+        # | fx 0 u0 |
+        # | 0 fy v0 |
+        # | 0  0  1 |
+        # example: 000007.txt P2
+        # 7.215377000000e+02 0.000000000000e+00 6.095593000000e+02 4.485728000000e+01
+        # 0.000000000000e+00 7.215377000000e+02 1.728540000000e+02 2.163791000000e-01
+        # 0.000000000000e+00 0.000000000000e+00 1.000000000000e+00 2.745884000000e-03
+        self.P0 = mats.get('P0')
+        self.P1 = mats.get('P1')
+        self.P2 = mats.get('P2')
+        self.P3 = mats.get('P3')
+        # 相机旋转矩阵
+        # | r11  r12  r13 |
+        # | r21  r22  r23 |
+        # | r31  r32  r33 |
+        # 计算时补成 4x4 (最后一行/列为 [0 0 0 1]), 见 to_homogeneous
+        self.R0_rect = mats.get('R0_rect')
+        # 激光雷达到相机坐标变换矩阵
+        # | R  T |
+        # | 0  1 |
+        self.Tr_velo_to_cam = mats.get('Tr_velo_to_cam')
+        # IMU到激光雷达坐标变换矩阵 | R T |
+        self.Tr_imu_to_velo = mats.get('Tr_imu_to_velo')
+        self.digest = None
+        self._velo_to_img = {}
+
+    def velo_to_rect(self):
+        """4x4 transform from velodyne coordinates to the rectified camera frame."""
+        return to_homogeneous(self.R0_rect).dot(to_homogeneous(self.Tr_velo_to_cam))
+
+    def velo_to_img(self, cam=2):
+        """Precomposed 3x4 projection P_cam * R0_rect * Tr_velo_to_cam.
+
+        Projecting homogeneous velodyne points (4, n) then needs a single matrix product.
+        """
+        if cam not in self._velo_to_img:
+            P = self.mats[f'P{cam}']
+            mat = P.dot(self.velo_to_rect())
+            mat.flags.writeable = False
+            self._velo_to_img[cam] = mat
+        return self._velo_to_img[cam]
+
+
+def parse_calib(text):
+    """Parse the 'key: values' lines of a KITTI calib file into a dict of matrices."""
+    mats = {}
+    for line in text.splitlines():
+        key, sep, values = line.partition(':')
+        if not sep:
+            continue
+        key = key.strip()
+        try:
+            values = np.array(values.split(), dtype=np.float64)
+        except ValueError:
+            # raw 数据标定文件中的 calib_time 等非数值行
+            continue
+        shape = CALIB_SHAPES.get(key)
+        if shape is not None and values.size == shape[0] * shape[1]:
+            values = values.reshape(shape)
+        values.flags.writeable = False
+        mats[key] = values
+    return mats
+
+
+def _lru_get(cache, key):
+    value = cache.get(key)
+    if value is not None:
+        cache.move_to_end(key)
+    return value
+
+
+def _lru_put(cache, key, value, maxsize):
+    cache[key] = value
+    if len(cache) > maxsize:
+        cache.popitem(last=False)
+
+
+# content digest -> KittiCalib, 内容相同的标定文件共用一个对象
+_digest_cache = OrderedDict()
+_DIGEST_CACHE_SIZE = 32
+# (path, mtime, size) -> KittiCalib, 避免每帧都重新读取标定文件
+_path_cache = OrderedDict()
+_PATH_CACHE_SIZE = 8192
+
+
+def calib_from_bytes(content):
+    digest = hashlib.sha1(content).hexdigest()
+    calib = _lru_get(_digest_cache, digest)
+    if calib is None:
+        calib = KittiCalib(parse_calib(content.decode('ascii')))
+        calib.digest = digest
+        _lru_put(_digest_cache, digest, calib, _DIGEST_CACHE_SIZE)
+    return calib
+
+
+def load_calib(calib_file):
+    """Load a KITTI calib file, shared across frames whose files have the same content."""
+    st = os.stat(calib_file)
+    key = (os.path.abspath(calib_file), st.st_mtime_ns, st.st_size)
+    calib = _lru_get(_path_cache, key)
+    if calib is None:
+        with open(calib_file, 'rb') as f:
+            calib = calib_from_bytes(f.read())
+        _lru_put(_path_cache, key, calib, _PATH_CACHE_SIZE)
+    return calib
+
+
+def _read_mats(path):
+    with open(path) as f:
+        return parse_calib(f.read())
+
+
+def _rigid(mats):
+    # raw 数据标定中的 R (9个数) 和 T (3个数) -> 3x4 [R | T]
+    return np.hstack([mats['R'].reshape(3, 3), mats['T'].reshape(3, 1)])
+
+
+def load_odometry_calib(calib_file):
+    """KittiCalib of an odometry sequences/NN/calib.txt (images already rectified: R0_rect is identity)."""
+    mats = dict(_read_mats(calib_file))
+    mats['Tr_velo_to_cam'] = mats.pop('Tr')
+    mats['R0_rect'] = np.eye(3)
+    return KittiCalib(mats)
+
+
+def load_raw_calib(calib_dir):
+    """KittiCalib of a raw-data date directory (calib_cam_to_cam.txt, calib_velo_to_cam.txt, calib_imu_to_velo.txt)."""
+    cam = _read_mats(os.path.join(calib_dir, 'calib_cam_to_cam.txt'))
+    mats = {f'P{i}': cam[f'P_rect_0{i}'].reshape(3, 4) for i in range(4) if f'P_rect_0{i}' in cam}
+    mats['R0_rect'] = cam['R_rect_00'].reshape(3, 3)
+    mats['Tr_velo_to_cam'] = _rigid(_read_mats(os.path.join(calib_dir, 'calib_velo_to_cam.txt')))
+    imu_file = os.path.join(calib_dir, 'calib_imu_to_velo.txt')
+    if os.path.exists(imu_file):
+        mats['Tr_imu_to_velo'] = _rigid(_read_mats(imu_file))
+    return KittiCalib(mats)
+
+
+def clear_cache():
+    _path_cache.clear()
+    _digest_cache.clear()
@@ -0,0 +1,419 @@
+import os
+import json
+import time
+import heapq
+import bisect
+import marshal
+import threading
+import itertools
+import contextlib
+
+# metrics.py
+# 功能: 可选的逐帧性能统计 (默认关闭, 关闭时每个计时点只多一次函数调用)
+# 1.with metrics.stage('project'): ... 或 @metrics.timed('render') 记录各阶段耗时
+#   metrics.count('points_visible', n) 记录点数
+# 2.with metrics.frame(name): ... 划定一帧, 同一线程内的阶段耗时和点数归到这一帧
+# 3.汇总为直方图 (固定分桶, 与Prometheus相同的累计计数), 输出 JSON 或 Prometheus 文本格式
+# 4.profile_top=N 时每帧用 cProfile 记录, 只保留最慢的N帧, 保存为 .prof (pstats / snakeviz 可读)
+#   py-spy 等外部采样器不需要这里的任何设置; keep_frames=True 记录每帧的开始时间, 用来对照采样结果
+# 5.多进程时每个worker把 snapshot() 传回主进程, 主进程 merge() 合并
+
+# 阶段耗时的分桶上界 (s)
+TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 点数的分桶上界
+COUNT_BUCKETS = (1e3, 3e3, 1e4, 3e4, 1e5, 3e5, 1e6, 3e6)
+PROMETHEUS_PREFIX = 'lidar_projection'
+# 环境变量: 输出文件 (.json / .prom), 保留最慢的帧数, .prof 输出目录
+ENV_METRICS = 'PROJ_METRICS'
+ENV_PROFILE_TOP = 'PROJ_PROFILE_TOP'
+ENV_PROFILE_DIR = 'PROJ_PROFILE_DIR'
+
+
+class Histogram:
+    """Count, sum, min, max and bucketed distribution of observed values."""
+
+    def __init__(self, buckets=TIME_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = float('inf')
+        self.max = float('-inf')
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        if other.buckets != self.buckets:
+            raise ValueError('cannot merge histograms with different buckets')
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q):
+        """Approximate quantile: interpolated inside the bucket that holds it, clamped to [min, max]."""
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lo = self.buckets[i - 1] if i > 0 else self.min
+                hi = self.buckets[i] if i < len(self.buckets) else self.max
+                value = lo + (hi - lo) * (rank - seen) / n
+                return min(max(value, self.min), self.max)
+            seen += n
+        return self.max
+
+    def to_dict(self):
+        if self.count == 0:
+            return {'count': 0}
+        cumulative = list(itertools.accumulate(self.counts))
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+            'buckets': {**{str(b): c for b, c in zip(self.buckets, cumulative)}, '+Inf': cumulative[-1]},
+        }
+
+
+class _Null:
+    # 关闭统计时 stage() / frame() 返回的空上下文
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL = _Null()
+
+
+class _Stage:
+    __slots__ = ('recorder', 'name', 't0')
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.recorder.observe(self.name, time.perf_counter() - self.t0)
+        return False
+
+
+class _Frame:
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.record = {'name': name, 'stages': {}, 'counts': {}}
+        self.profiler = None
+
+    def __enter__(self):
+        local = self.recorder._local
+        self.outer = getattr(local, 'frame', None)
+        local.frame = self.record
+        if self.recorder.profile_top > 0:
+            import cProfile
+            self.profiler = cProfile.Profile()
+            try:
+                self.profiler.enable()
+            except ValueError:
+                # 已经有其他 profiler 在运行 (例如 python -m cProfile)
+                self.profiler = None
+        self.record['start'] = time.time()
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        total = time.perf_counter() - self.t0
+        if self.profiler is not None:
+            self.profiler.disable()
+        self.recorder._local.frame = self.outer
+        self.record['total_s'] = total
+        self.record['failed'] = exc[0] is not None
+        self.recorder._end_frame(self.record, total, self.profiler)
+        return False
+
+
+class Recorder:
+    """Thread-safe collector of stage timings and counts, optionally grouped into frames.
+
+    keep_frames: keep every frame's record (name, start time, per-stage seconds, counts).
+    profile_top: cProfile every frame and keep the stats of this many slowest frames.
+    """
+
+    def __init__(self, enabled=True, keep_frames=False, profile_top=0):
+        self.enabled = enabled
+        self.keep_frames = keep_frames
+        self.profile_top = profile_top
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._seq = itertools.count()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.timings = {}
+            self.counts = {}
+            self.frames = []
+            # 最慢帧的小顶堆 [(total_s, seq, record, pstats数据)]
+            self.slowest = []
+
+    def stage(self, name):
+        """Context manager timing one stage."""
+        if not self.enabled:
+            return _NULL
+        return _Stage(self, name)
+
+    def frame(self, name):
+        """Context manager for one frame; stages and counts in this thread are attributed to it."""
+        if not self.enabled:
+            return _NULL
+        return _Frame(self, name)
+
+    def observe(self, name, seconds):
+        with self._lock:
+            hist = self.timings.get(name)
+            if hist is None:
+                hist = self.timings[name] = Histogram(TIME_BUCKETS)
+            hist.observe(seconds)
+        record = getattr(self._local, 'frame', None)
+        if record is not None:
+            record['stages'][name] = record['stages'].get(name, 0.0) + seconds
+
+    def count(self, name, value):
+        if not self.enabled:
+            return
+        with self._lock:
+            hist = self.counts.get(name)
+            if hist is None:
+                hist = self.counts[name] = Histogram(COUNT_BUCKETS)
+            hist.observe(value)
+        record = getattr(self._local, 'frame', None)
+        if record is not None:
+            record['counts'][name] = record['counts'].get(name, 0) + value
+
+    def _keep_slowest(self, total, record, stats):
+        # 调用时已持有锁
+        item = (total, next(self._seq), record, stats)
+        if len(self.slowest) < self.profile_top:
+            heapq.heappush(self.slowest, item)
+        elif self.slowest and total > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, item)
+
+    def _end_frame(self, record, total, profiler):
+        stats = None
+        if profiler is not None:
+            profiler.create_stats()
+            stats = profiler.stats
+        self.observe('frame', total)
+        with self._lock:
+            if self.keep_frames:
+                self.frames.append(record)
+            if stats is not None:
+                self._keep_slowest(total, record, stats)
+
+    def snapshot(self, reset=False):
+        """Picklable copy of everything collected (for sending from a worker process).
+
+        reset=True hands over the collected data and starts empty, so repeated snapshots are deltas.
+        """
+        with self._lock:
+            if reset:
+                snap = {'timings': self.timings, 'counts': self.counts, 'frames': self.frames,
+                        'slowest': [(t, r, s) for t, _, r, s in self.slowest]}
+                self.timings, self.counts, self.frames, self.slowest = {}, {}, [], []
+            else:
+                snap = {'timings': {k: _copy_hist(h) for k, h in self.timings.items()},
+                        'counts': {k: _copy_hist(h) for k, h in self.counts.items()},
+                        'frames': list(self.frames),
+                        'slowest': [(t, r, s) for t, _, r, s in self.slowest]}
+        return snap
+
+    def merge(self, snap):
+        with self._lock:
+            for target, source in ((self.timings, snap['timings']), (self.counts, snap['counts'])):
+                for name, hist in source.items():
+                    if name in target:
+                        target[name].merge(hist)
+                    else:
+                        target[name] = _copy_hist(hist)
+            if self.keep_frames:
+                self.frames.extend(snap['frames'])
+            for total, record, stats in snap['slowest']:
+                self._keep_slowest(total, record, stats)
+
+    def slowest_frames(self):
+        """Records of the profiled slowest frames, slowest first."""
+        return [record for _, _, record, _ in sorted(self.slowest, key=lambda item: -item[0])]
+
+    def to_dict(self):
+        res = {
+            'timings_s': {name: hist.to_dict() for name, hist in sorted(self.timings.items())},
+            'counts': {name: hist.to_dict() for name, hist in sorted(self.counts.items())},
+        }
+        if self.slowest:
+            res['slowest_frames'] = self.slowest_frames()
+        if self.keep_frames:
+            res['frames'] = self.frames
+        return res
+
+    def to_prometheus(self, prefix=PROMETHEUS_PREFIX):
+        """Prometheus text exposition format: one histogram family for stages, one for point counts."""
+        lines = []
+        families = ((f'{prefix}_stage_seconds', 'stage', self.timings, 'Time spent per stage'),
+                    (f'{prefix}_points', 'kind', self.counts, 'Points per frame'))
+        for family, label, hists, help_text in families:
+            if not hists:
+                continue
+            lines.append(f'# HELP {family} {help_text}')
+            lines.append(f'# TYPE {family} histogram')
+            for name, hist in sorted(hists.items()):
+                cumulative = list(itertools.accumulate(hist.counts))
+                for bound, n in zip(hist.buckets, cumulative):
+                    lines.append(f'{family}_bucket{{{label}="{name}",le="{bound:g}"}} {n}')
+                lines.append(f'{family}_bucket{{{label}="{name}",le="+Inf"}} {hist.count}')
+                lines.append(f'{family}_sum{{{label}="{name}"}} {hist.sum:.9g}')
+                lines.append(f'{family}_count{{{label}="{name}"}} {hist.count}')
+        return '\n'.join(lines) + '\n'
+
+    def save(self, path):
+        """Write metrics to path: Prometheus text for .prom/.txt, JSON otherwise."""
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            if path.endswith(('.prom', '.txt')):
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.to_dict(), f, indent=2)
+
+    def save_profiles(self, out_dir):
+        """Write the cProfile stats of the slowest frames as <rank>_<frame>.prof; returns the paths."""
+        os.makedirs(out_dir, exist_ok=True)
+        paths = []
+        for rank, (total, _, record, stats) in enumerate(sorted(self.slowest, key=lambda item: -item[0])):
+            path = os.path.join(out_dir, f'{rank:02d}_{record["name"]}.prof')
+            with open(path, 'wb') as f:
+                # 与 cProfile.Profile.dump_stats 相同的格式
+                marshal.dump(stats, f)
+            paths.append(path)
+        return paths
+
+    def summary(self):
+        lines = [f'{"stage":<14}{"count":>8}{"mean ms":>10}{"p50 ms":>10}{"p90 ms":>10}{"max ms":>10}']
+        for name, hist in sorted(self.timings.items()):
+            lines.append(f'{name:<14}{hist.count:>8}{hist.sum / hist.count * 1000:>10.2f}'
+                         f'{hist.quantile(0.5) * 1000:>10.2f}{hist.quantile(0.9) * 1000:>10.2f}{hist.max * 1000:>10.2f}')
+        for name, hist in sorted(self.counts.items()):
+            lines.append(f'{name:<14}{hist.count:>8}{hist.sum / hist.count:>10.0f}')
+        return '\n'.join(lines)
+
+
+def _copy_hist(hist):
+    res = Histogram(hist.buckets)
+    res.merge(hist)
+    return res
+
+
+# 全局的 Recorder, 默认关闭
+_recorder = Recorder(enabled=False)
+
+
+def get_recorder():
+    return _recorder
+
+
+def enable(keep_frames=False, profile_top=0):
+    """Turn on the global recorder (clearing earlier data) and return it."""
+    _recorder.keep_frames = keep_frames
+    _recorder.profile_top = profile_top
+    _recorder.reset()
+    _recorder.enabled = True
+    return _recorder
+
+
+def disable():
+    _recorder.enabled = False
+
+
+def enabled():
+    return _recorder.enabled
+
+
+def stage(name):
+    return _recorder.stage(name)
+
+
+def frame(name):
+    return _recorder.frame(name)
+
+
+def count(name, value):
+    _recorder.count(name, value)
+
+
+def timed(name=None):
+    """Decorator timing every call of the function as a stage (named after it by default)."""
+    def decorator(fn):
+        stage_name = name or fn.__name__
+
+        def wrapper(*args, **kwargs):
+            if not _recorder.enabled:
+                return fn(*args, **kwargs)
+            with _Stage(_recorder, stage_name):
+                return fn(*args, **kwargs)
+        wrapper.__name__ = fn.__name__
+        wrapper.__doc__ = fn.__doc__
+        wrapper.__wrapped__ = fn
+        return wrapper
+    return decorator
+
+
+def env_config():
+    """(metrics file, profile_top, profile dir) from the PROJ_METRICS / PROJ_PROFILE_* environment variables."""
+    return (os.environ.get(ENV_METRICS) or None, int(os.environ.get(ENV_PROFILE_TOP, '0') or 0),
+            os.environ.get(ENV_PROFILE_DIR) or None)
+
+
+def dump(metrics_file=None, profile_dir=None, verbose=True):
+    """Write the global recorder's metrics and slowest-frame profiles, print a summary."""
+    if not _recorder.enabled:
+        return
+    if verbose:
+        print(_recorder.summary())
+    if metrics_file:
+        _recorder.save(metrics_file)
+    if _recorder.slowest:
+        paths = _recorder.save_profiles(profile_dir or 'profiles')
+        if verbose:
+            print(f'profiles of the {len(paths)} slowest frames: {", ".join(paths)}')
+
+
+@contextlib.contextmanager
+def session(metrics_file=None, profile_top=0, profile_dir=None, keep_frames=False):
+    """Enable the global recorder for a block when metrics_file or profile_top is set, dump it afterwards."""
+    if not metrics_file and not profile_top:
+        yield None
+        return
+    recorder = enable(keep_frames=keep_frames, profile_top=profile_top)
+    try:
+        yield recorder
+    finally:
+        dump(metrics_file, profile_dir)
+        disable()
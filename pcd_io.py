@@ -0,0 +1,226 @@
+import mmap
+import struct
+import numpy as np
+
+# pcd_io.py
+# 功能: 读取PCL的 .pcd 点云文件
+# 支持 DATA ascii / binary / binary_compressed, 按header解析字段后整体读取, 不逐行解析
+
+# PCD header中 (TYPE, SIZE) 到numpy类型的映射
+PCD_NUMPY_TYPES = {
+    ('I', 1): np.int8,
+    ('I', 2): np.int16,
+    ('I', 4): np.int32,
+    ('I', 8): np.int64,
+    ('U', 1): np.uint8,
+    ('U', 2): np.uint16,
+    ('U', 4): np.uint32,
+    ('U', 8): np.uint64,
+    ('F', 4): np.float32,
+    ('F', 8): np.float64,
+}
+
+HEADER_KEYS = ('VERSION', 'FIELDS', 'SIZE', 'TYPE', 'COUNT', 'WIDTH', 'HEIGHT', 'VIEWPOINT', 'POINTS', 'DATA')
+
+
+def parse_pcd_header(f):
+    """Read header lines from an open binary file, return (header dict, data offset)."""
+    header = {}
+    while True:
+        line = f.readline()
+        if not line:
+            raise ValueError('unexpected end of file in PCD header')
+        line = line.decode('ascii', errors='replace').strip()
+        if not line or line.startswith('#'):
+            continue
+        key, _, value = line.partition(' ')
+        key = key.upper()
+        if key in HEADER_KEYS:
+            header[key] = value.split()
+        if key == 'DATA':
+            break
+
+    fields = header['FIELDS']
+    sizes = [int(x) for x in header['SIZE']]
+    types = header['TYPE']
+    counts = [int(x) for x in header.get('COUNT', ['1'] * len(fields))]
+    if not (len(fields) == len(sizes) == len(types) == len(counts)):
+        raise ValueError('FIELDS/SIZE/TYPE/COUNT length mismatch in PCD header')
+    width = int(header.get('WIDTH', ['0'])[0])
+    height = int(header.get('HEIGHT', ['1'])[0])
+    points = int(header['POINTS'][0]) if 'POINTS' in header else width * height
+
+    res = {
+        'fields': fields,
+        'sizes': sizes,
+        'types': types,
+        'counts': counts,
+        'width': width,
+        'height': height,
+        'points': points,
+        'data': header['DATA'][0].lower(),
+    }
+    return res, f.tell()
+
+
+def pcd_dtype(header):
+    """Structured dtype of one point record. Fields with COUNT>1 become sub-arrays."""
+    descr = []
+    for i, (name, size, typ, count) in enumerate(zip(header['fields'], header['sizes'], header['types'], header['counts'])):
+        base = np.dtype(PCD_NUMPY_TYPES[(typ, size)]).newbyteorder('<')
+        # PCL padding fields are all named '_'
+        if name == '_' or any(name == d[0] for d in descr):
+            name = f'_{name}_{i}'
+        descr.append((name, base) if count == 1 else (name, base, (count,)))
+    return np.dtype(descr)
+
+
+def lzf_decompress(data, out_len):
+    """LZF decompression (liblzf format), used by DATA binary_compressed."""
+    try:
+        import lzf
+        return lzf.decompress(bytes(data), out_len)
+    except ImportError:
+        pass
+
+    out = bytearray(out_len)
+    ip = 0
+    op = 0
+    n = len(data)
+    while ip < n:
+        ctrl = data[ip]
+        ip += 1
+        if ctrl < 32:
+            # literal run of ctrl+1 bytes
+            ctrl += 1
+            out[op:op + ctrl] = data[ip:ip + ctrl]
+            ip += ctrl
+            op += ctrl
+        else:
+            # back reference
+            length = ctrl >> 5
+            ref = op - ((ctrl & 0x1f) << 8) - 1
+            if length == 7:
+                length += data[ip]
+                ip += 1
+            ref -= data[ip]
+            ip += 1
+            length += 2
+            if ref < 0:
+                raise ValueError('invalid LZF back reference')
+            if ref + length <= op:
+                out[op:op + length] = out[ref:ref + length]
+            else:
+                # 重叠拷贝需逐字节进行
+                for k in range(length):
+                    out[op + k] = out[ref + k]
+            op += length
+    if op != out_len:
+        raise ValueError(f'LZF size mismatch: got {op}, expected {out_len}')
+    return bytes(out)
+
+
+def _read_ascii(f, header, dtype):
+    body = f.read()
+    columns = sum(header['counts'])
+    values = np.fromstring(body, dtype=np.float64, sep=' ') if body.strip() else np.empty(0)
+    values = values[:header['points'] * columns].reshape(-1, columns)
+    res = np.empty(len(values), dtype=dtype)
+    col = 0
+    for name, count in zip(dtype.names, header['counts']):
+        res[name] = values[:, col] if count == 1 else values[:, col:col + count]
+        col += count
+    return res
+
+
+def _read_binary_compressed(f, header, dtype):
+    compressed_size, uncompressed_size = struct.unpack('<II', f.read(8))
+    raw = lzf_decompress(f.read(compressed_size), uncompressed_size)
+    n = header['points']
+    res = np.empty(n, dtype=dtype)
+    # binary_compressed 按字段列存储: 先存全部点的x, 再存全部点的y ...
+    offset = 0
+    for name in dtype.names:
+        field_dtype = dtype.fields[name][0]
+        nbytes = field_dtype.itemsize * n
+        column = np.frombuffer(raw, dtype=field_dtype.base, count=n * max(1, int(np.prod(field_dtype.shape))), offset=offset)
+        res[name] = column.reshape((n,) + field_dtype.shape)
+        offset += nbytes
+    return res
+
+
+def read_pcd(file_path, use_mmap=True):
+    """Read a PCD file into a structured numpy array (one record per point).
+
+    DATA binary is returned as a read-only view over a memory map when use_mmap is true.
+    """
+    with open(file_path, 'rb') as f:
+        header, data_offset = parse_pcd_header(f)
+        dtype = pcd_dtype(header)
+        n = header['points']
+        if header['data'] == 'ascii':
+            return _read_ascii(f, header, dtype)
+        if header['data'] == 'binary_compressed':
+            return _read_binary_compressed(f, header, dtype)
+        if header['data'] != 'binary':
+            raise ValueError(f"unsupported PCD DATA type: {header['data']}")
+        if n == 0:
+            return np.empty(0, dtype=dtype)
+        if use_mmap:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return np.frombuffer(buf, dtype=dtype, count=n, offset=data_offset)
+        return np.fromfile(f, dtype=dtype, count=n)
+
+
+def pcd_to_xyzi(cloud, intensity_field='intensity', intensity_scale=1.0 / 255.0, return_valid=False):
+    """Convert a structured PCD array to an (N, 4) float32 [x, y, z, intensity] array.
+
+    Points with NaN in any of the four columns are dropped. return_valid also returns the
+    boolean mask of kept records (None when all are kept), to select other fields alike.
+    """
+    names = cloud.dtype.names
+    res = np.empty((len(cloud), 4), dtype=np.float32)
+    res[:, 0] = cloud['x']
+    res[:, 1] = cloud['y']
+    res[:, 2] = cloud['z']
+    if intensity_field not in names:
+        # 没有intensity字段时退回第4个字段, 与旧版按列读取保持一致
+        candidates = [n for n in names if n not in ('x', 'y', 'z') and not n.startswith('_')]
+        intensity_field = candidates[0] if candidates else None
+    if intensity_field is None:
+        res[:, 3] = 0
+    else:
+        res[:, 3] = cloud[intensity_field].astype(np.float64) * intensity_scale
+    valid = ~np.isnan(res).any(axis=1)
+    if not valid.all():
+        res = res[valid]
+    else:
+        valid = None
+    if return_valid:
+        return res, valid
+    return res
+
+
+def write_pcd(file_path, points, data='binary', fields=('x', 'y', 'z', 'intensity')):
+    """Write an (N, len(fields)) float array as a PCD v0.7 file with F4 fields (DATA ascii or binary)."""
+    points = np.ascontiguousarray(points, dtype=np.float32).reshape(len(points), len(fields))
+    if data not in ('ascii', 'binary'):
+        raise ValueError(f'unsupported PCD DATA type for writing: {data}')
+    n = len(points)
+    header = ('# .PCD v0.7 - Point Cloud Data file format\n'
+              'VERSION 0.7\n'
+              f'FIELDS {" ".join(fields)}\n'
+              f'SIZE {" ".join(["4"] * len(fields))}\n'
+              f'TYPE {" ".join(["F"] * len(fields))}\n'
+              f'COUNT {" ".join(["1"] * len(fields))}\n'
+              f'WIDTH {n}\n'
+              'HEIGHT 1\n'
+              'VIEWPOINT 0 0 0 1 0 0 0\n'
+              f'POINTS {n}\n'
+              f'DATA {data}\n')
+    with open(file_path, 'wb') as f:
+        f.write(header.encode('ascii'))
+        if data == 'binary':
+            f.write(points.astype('<f4').tobytes())
+        else:
+            np.savetxt(f, points, fmt='%.7g', delimiter=' ')
@@ -0,0 +1,297 @@
+import os
+import time
+import queue
+import functools
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+import render
+import metrics
+
+# pipeline.py
+# 功能: 流水线处理数据帧: 读取解码 -> 投影 -> 绘制 -> 编码写文件
+# 1.相邻阶段之间用有界队列连接, 下游处理不过来时上游阻塞 (背压), 同时在内存中的帧数有上限
+# 2.每个阶段有各自的线程数 (cv2 / numpy / zlib 计算时释放GIL); 也可以交给进程池执行
+# 3.统计每个阶段处理的帧数、计算时间、因下游阻塞等待的时间和吞吐量
+#   (各阶段内部的细分耗时和点数见 metrics.py, 启用时同样会记录)
+# 4.run_ordered: 按输入顺序输出结果 (例如写视频), 同时在处理中的帧数不超过 window
+
+# 结束标记, 沿着流水线逐级传递
+_DONE = object()
+# 阻塞的 put/get 定期检查是否已停止 (s)
+_POLL_S = 0.1
+
+# 各阶段默认线程数
+DEFAULT_WORKERS = {'decode': 2, 'project': 1, 'render': 2, 'encode': 2}
+
+
+def _item_key(item):
+    # 出错时记录的帧名: Frame.name, 或 (name / Frame, ...) 元组的第一项
+    if isinstance(item, tuple):
+        item = item[0]
+    if isinstance(item, str):
+        return item
+    return getattr(item, 'name', repr(item))
+
+
+class _Seq:
+    # run_ordered 中带序号的数据; 某个阶段失败或丢弃时 dropped=True, 仍然传到最后, 使重排不会一直等待
+    __slots__ = ('seq', 'item', 'dropped')
+
+    def __init__(self, seq, item, dropped=False):
+        self.seq = seq
+        self.item = item
+        self.dropped = dropped
+
+    @property
+    def name(self):
+        return _item_key(self.item)
+
+
+def _call_seq(fn, tagged):
+    if tagged.dropped:
+        return tagged
+    result = fn(tagged.item)
+    return _Seq(tagged.seq, result, result is None)
+
+
+class Stage:
+    """One pipeline step: fn(item) returns the item passed to the next stage (None drops it)."""
+
+    def __init__(self, name, fn, workers=1, queue_size=4, processes=False):
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        # 本阶段输入队列的容量
+        self.queue_size = queue_size
+        # True 时 fn 在进程池中执行, fn 和数据都需要能被 pickle
+        self.processes = processes
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.busy = 0.0
+        self.blocked = 0.0
+        self.max_queue = 0
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def stats(self, elapsed):
+        return {
+            'frames': self.count,
+            'workers': self.workers,
+            'busy_s': round(self.busy, 3),
+            'blocked_s': round(self.blocked, 3),
+            'fps': round(self.count / elapsed, 2) if elapsed > 0 else 0.0,
+            # 线程忙碌时间占比, 接近1的阶段是瓶颈
+            'utilization': round(self.busy / (elapsed * self.workers), 3) if elapsed > 0 else 0.0,
+            'max_queue': self.max_queue,
+            'errors': len(self.errors),
+        }
+
+
+class Pipeline:
+    """Run items through a list of Stages connected by bounded queues."""
+
+    def __init__(self, stages):
+        self.stages = stages
+        self.elapsed = 0.0
+        self._stop = threading.Event()
+
+    def _put(self, q, item):
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=_POLL_S)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self, q):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=_POLL_S)
+            except queue.Empty:
+                pass
+        return _DONE
+
+    def _feed(self, items, q):
+        try:
+            for item in items:
+                if not self._put(q, item):
+                    return
+        finally:
+            self._put(q, _DONE)
+
+    def _work(self, stage, q_in, q_out, remaining, pool):
+        while True:
+            item = self._get(q_in)
+            if item is _DONE:
+                # 结束标记放回队列给同阶段的其他线程, 最后一个退出的线程通知下一阶段
+                self._put(q_in, _DONE)
+                with stage._lock:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                if last:
+                    self._put(q_out, _DONE)
+                return
+            call = (_call_seq, stage.fn, item) if isinstance(item, _Seq) else (stage.fn, item)
+            t0 = time.perf_counter()
+            try:
+                result = pool.submit(*call).result() if pool is not None else call[0](*call[1:])
+            except Exception:
+                result = _Seq(item.seq, None, True) if isinstance(item, _Seq) else None
+                with stage._lock:
+                    stage.errors[_item_key(item)] = traceback.format_exc()
+            t1 = time.perf_counter()
+            if result is not None:
+                self._put(q_out, result)
+            t2 = time.perf_counter()
+            with stage._lock:
+                stage.count += 1
+                stage.busy += t1 - t0
+                stage.blocked += t2 - t1
+                stage.max_queue = max(stage.max_queue, q_in.qsize())
+
+    def run(self, items):
+        """Generator of the last stage's outputs (in completion order)."""
+        self._stop.clear()
+        for stage in self.stages:
+            stage.reset()
+        queues = [queue.Queue(maxsize=stage.queue_size) for stage in self.stages]
+        queues.append(queue.Queue(maxsize=self.stages[-1].queue_size))
+        pools = [ProcessPoolExecutor(max_workers=stage.workers) if stage.processes else None
+                 for stage in self.stages]
+        threads = [threading.Thread(target=self._feed, args=(items, queues[0]), daemon=True)]
+        for i, stage in enumerate(self.stages):
+            remaining = [stage.workers]
+            for _ in range(stage.workers):
+                threads.append(threading.Thread(target=self._work, daemon=True,
+                                                args=(stage, queues[i], queues[i + 1], remaining, pools[i])))
+
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                item = self._get(queues[-1])
+                if item is _DONE:
+                    break
+                yield item
+        finally:
+            # 提前退出 (异常或生成器被关闭) 时让所有线程停止
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+            for pool in pools:
+                if pool is not None:
+                    pool.shutdown(cancel_futures=True)
+            self.elapsed = time.perf_counter() - start
+
+    def run_ordered(self, items, window=16):
+        """Generator of the last stage's outputs in input order; None stands for a failed or dropped item.
+
+        At most window items are between the feeder and the consumer (in the stages,
+        queues or waiting for an earlier item), so memory does not grow with the input.
+        """
+        cond = threading.Condition()
+        # 下一个要输出的序号
+        state = {'next': 0}
+
+        def tagged():
+            for seq, item in enumerate(items):
+                with cond:
+                    while seq >= state['next'] + window and not self._stop.is_set():
+                        cond.wait(_POLL_S)
+                if self._stop.is_set():
+                    return
+                yield _Seq(seq, item)
+
+        pending = {}
+        for out in self.run(tagged()):
+            pending[out.seq] = out
+            while state['next'] in pending:
+                out = pending.pop(state['next'])
+                with cond:
+                    state['next'] += 1
+                    cond.notify_all()
+                yield None if out.dropped else out.item
+
+    def errors(self):
+        """{stage name: {frame name: traceback}} of the failed items."""
+        return {stage.name: dict(stage.errors) for stage in self.stages if stage.errors}
+
+    def stats(self):
+        return {'elapsed_s': round(self.elapsed, 3),
+                'stages': {stage.name: stage.stats(self.elapsed) for stage in self.stages}}
+
+    def format_stats(self):
+        lines = [f'{"stage":<10}{"frames":>8}{"workers":>8}{"fps":>9}{"busy s":>9}{"blocked s":>11}{"util":>7}{"maxq":>6}']
+        for name, s in self.stats()['stages'].items():
+            lines.append(f'{name:<10}{s["frames"]:>8}{s["workers"]:>8}{s["fps"]:>9.2f}{s["busy_s"]:>9.2f}'
+                         f'{s["blocked_s"]:>11.2f}{s["utilization"]:>7.2f}{s["max_queue"]:>6}')
+        lines.append(f'elapsed: {self.elapsed:.2f} s')
+        return '\n'.join(lines)
+
+
+def decode_frame(frame):
+    # 读取点云、图像和标定
+    return frame.load()
+
+
+def project_frame(frame):
+    # 每个线程各自分配输出数组, 不共用 ProjectionBuffer
+    return frame, frame.project()
+
+
+def render_frame(item, vertical=True, radius=1):
+    frame, proj = item
+    with metrics.stage('render'):
+        panels = render.render_projection(frame.image, proj.u, proj.v, proj.z, proj.intensity,
+                                          vertical=vertical, radius=radius)
+    # 只把帧名传给下一阶段, 点云和原图可以尽早释放
+    return frame.name, panels
+
+
+def encode_frame(item, save_dir, fmt='png'):
+    name, panels = item
+    path = os.path.join(save_dir, f'{name}.{fmt}')
+    with metrics.stage('save'):
+        render.save_image(path, panels)
+    return path
+
+
+def projection_pipeline(save_dir, vertical=True, radius=1, workers=None, queue_size=4, processes=(), fmt='png'):
+    """Pipeline for Frames: decode -> project -> render -> encode to save_dir/<name>.<fmt> (png or jpg).
+
+    workers overrides DEFAULT_WORKERS per stage; stages named in processes run in a
+    process pool instead of threads.
+    """
+    workers = dict(DEFAULT_WORKERS, **(workers or {}))
+    fns = {
+        'decode': decode_frame,
+        'project': project_frame,
+        'render': functools.partial(render_frame, vertical=vertical, radius=radius),
+        'encode': functools.partial(encode_frame, save_dir=save_dir, fmt=fmt),
+    }
+    return Pipeline([Stage(name, fn, workers[name], queue_size, name in processes) for name, fn in fns.items()])
+
+
+def run_projection(frames, save_dir, vertical=True, radius=1, workers=None, queue_size=4, processes=(), verbose=True,
+                   fmt='png'):
+    """Project and save every frame of a frame source (or any iterable of Frames) through the pipeline.
+
+    Returns the Pipeline, whose stats() and errors() describe the run.
+    """
+    os.makedirs(save_dir, exist_ok=True)
+    pipe = projection_pipeline(save_dir, vertical, radius, workers, queue_size, processes, fmt)
+    total = len(frames) if hasattr(frames, '__len__') else None
+    for _ in tqdm(pipe.run(iter(frames)), total=total, disable=not verbose):
+        pass
+    if verbose:
+        print(pipe.format_stats())
+        errors = pipe.errors()
+        if errors:
+            print(f'failed: { {name: sorted(e)[:10] for name, e in errors.items()} }')
+    return pipe
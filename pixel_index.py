@@ -0,0 +1,138 @@
+import numpy as np
+
+# pixel_index.py
+# 功能: 投影点 (u, v) 上的二维网格索引, 查询某个像素 / 矩形框 / 圆内的点以及离某位置最近的点, 不再扫描整个 u/v 数组
+# 1.构建: 每个点算出所在格子的编号, 按编号做计数排序 (格子数不超过 65536 时编号为16位, numpy 的稳定排序即基数排序),
+#   排序后同一格子的点连续存放, starts[c]:starts[c+1] 为格子 c 的点; 构建为 O(N), 外参变化后重新投影直接 rebuild()
+# 2.查询只访问覆盖查询区域的格子: 同一行相邻格子的点也是连续的, 每行只取一个切片
+# 3.查询结果为构建时 u/v 数组中的下标 (投影结果再用 proj.index 得到原始点云中的下标)
+
+# 格子边长 (像素)
+DEFAULT_CELL = 8
+
+
+def _concat_ranges(starts, stops):
+    # 多个 [start, stop) 区间拼成一个下标数组, 不在Python中逐个 arange
+    lengths = stops - starts
+    offsets = np.cumsum(lengths) - lengths
+    return np.repeat(starts - offsets, lengths) + np.arange(int(lengths.sum()))
+
+
+class PixelGrid:
+    """Bucket grid over projected points of an img_w x img_h image.
+
+    Queries return indices into the u/v arrays the grid was built from; points outside
+    [0, img_w) x [0, img_h) are not indexed.
+    """
+
+    def __init__(self, u, v, img_w, img_h, cell=DEFAULT_CELL):
+        self.img_w = int(img_w)
+        self.img_h = int(img_h)
+        self.cell = int(cell)
+        self.nx = -(-self.img_w // self.cell)
+        self.ny = -(-self.img_h // self.cell)
+        self.rebuild(u, v)
+
+    def rebuild(self, u, v):
+        """Re-index new (u, v) of the same image, e.g. after the extrinsic changed."""
+        u = np.asarray(u, dtype=np.float32)
+        v = np.asarray(v, dtype=np.float32)
+        self.size = len(u)
+        inside = np.flatnonzero((u >= 0) & (u < self.img_w) & (v >= 0) & (v < self.img_h))
+        cells = (v[inside] // self.cell).astype(np.int32) * self.nx + (u[inside] // self.cell).astype(np.int32)
+        num_cells = self.nx * self.ny
+        keys = cells.astype(np.uint16) if num_cells <= 1 << 16 else cells
+        order = np.argsort(keys, kind='stable')
+        self.starts = np.zeros(num_cells + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cells, minlength=num_cells), out=self.starts[1:])
+        # 排序后的下标和坐标, 查询时按格子连续读取
+        self.order = inside[order]
+        self.u = u[self.order]
+        self.v = v[self.order]
+        return self
+
+    def __len__(self):
+        return len(self.order)
+
+    def _cell_slices(self, x0, y0, x1, y1):
+        # 覆盖 [x0, x1] x [y0, y1] 的格子, 每行一个 [start, stop)
+        cx0, cx1 = max(int(x0 // self.cell), 0), min(int(x1 // self.cell), self.nx - 1)
+        cy0, cy1 = max(int(y0 // self.cell), 0), min(int(y1 // self.cell), self.ny - 1)
+        if cx0 > cx1 or cy0 > cy1:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        rows = np.arange(cy0, cy1 + 1) * self.nx
+        return self.starts[rows + cx0], self.starts[rows + cx1 + 1]
+
+    def _candidates(self, x0, y0, x1, y1):
+        return _concat_ranges(*self._cell_slices(x0, y0, x1, y1))
+
+    def pixel(self, x, y):
+        """Indices of the points that fall in pixel (x, y), i.e. floor(u) == x and floor(v) == y."""
+        x, y = int(x), int(y)
+        if not (0 <= x < self.img_w and 0 <= y < self.img_h):
+            return np.zeros(0, dtype=np.int64)
+        c = (y // self.cell) * self.nx + x // self.cell
+        sel = np.arange(self.starts[c], self.starts[c + 1])
+        sel = sel[(np.floor(self.u[sel]) == x) & (np.floor(self.v[sel]) == y)]
+        return self.order[sel]
+
+    def box(self, x0, y0, x1, y1):
+        """Sorted indices of the points with x0 <= u <= x1 and y0 <= v <= y1."""
+        sel = self._candidates(x0, y0, x1, y1)
+        u, v = self.u[sel], self.v[sel]
+        sel = sel[(u >= x0) & (u <= x1) & (v >= y0) & (v <= y1)]
+        return np.sort(self.order[sel])
+
+    def radius(self, x, y, r):
+        """Sorted indices of the points within r pixels of (x, y)."""
+        sel = self._candidates(x - r, y - r, x + r, y + r)
+        du, dv = self.u[sel] - x, self.v[sel] - y
+        sel = sel[du * du + dv * dv <= r * r]
+        return np.sort(self.order[sel])
+
+    def nearest(self, x, y, max_dist=None):
+        """(index, distance) of the point nearest to (x, y), or None when none is within max_dist."""
+        limit = np.hypot(self.img_w, self.img_h) if max_dist is None else max_dist
+        r = min(float(self.cell), limit)
+        while True:
+            # 半边长为 r 的方框内距离不超过 r 的最近点即为全局最近点, 否则扩大方框
+            sel = self._candidates(x - r, y - r, x + r, y + r)
+            if len(sel):
+                du, dv = self.u[sel] - x, self.v[sel] - y
+                d2 = du * du + dv * dv
+                k = int(np.argmin(d2))
+                dist = float(np.sqrt(d2[k]))
+                if dist <= r:
+                    return (int(self.order[sel[k]]), dist) if dist <= limit else None
+            if r >= limit:
+                return None
+            r = min(2 * r, limit)
+
+    def box_stats(self, boxes, z, intensity=None):
+        """Per-box point statistics; boxes is (K, 4) [x0, y0, x1, y1], z / intensity are per point.
+
+        Returns {name: (K,) array}: points, depth_min, depth_median, depth_mean, depth_max and
+        intensity_mean (NaN for empty boxes).
+        """
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        names = ['depth_min', 'depth_median', 'depth_mean', 'depth_max', 'intensity_mean']
+        stats = {'points': np.zeros(len(boxes), dtype=np.int64)}
+        stats.update({name: np.full(len(boxes), np.nan) for name in names})
+        for k, box in enumerate(boxes):
+            sel = self.box(*box)
+            stats['points'][k] = len(sel)
+            if len(sel) == 0:
+                continue
+            depth = z[sel]
+            stats['depth_min'][k] = depth.min()
+            stats['depth_median'][k] = np.median(depth)
+            stats['depth_mean'][k] = depth.mean()
+            stats['depth_max'][k] = depth.max()
+            if intensity is not None:
+                stats['intensity_mean'][k] = intensity[sel].mean()
+        return stats
+
+
+def from_projection(proj, img_w, img_h, cell=DEFAULT_CELL):
+    """PixelGrid over a projection.ProjectedPoints; query results index proj.u / proj.z / proj.index."""
+    return PixelGrid(proj.u, proj.v, img_w, img_h, cell)
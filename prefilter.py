@@ -0,0 +1,127 @@
+import numpy as np
+import velo_scan
+
+# prefilter.py
+# 功能: 投影前的点云过滤, 减少投影和绘制的点数
+# 1.视锥剔除: 由 3x4 投影矩阵和图像尺寸得到视锥的5个平面 (每个标定只算一次), 一次矩阵乘法判断所有点
+# 2.距离范围 / ROI 长方体裁剪
+# 3.可选的降采样: 体素网格 (每个体素保留一个点) 或随机采样到给定点数
+# 全部在原始 (N, 4) float32 数组上做向量化的mask, 最后只拷贝一次保留的点
+
+# {(矩阵字节, W, H, margin): (5, 4) 平面}
+_plane_cache = {}
+_PLANE_CACHE_SIZE = 64
+
+
+def frustum_planes(proj_mat, img_w, img_h, margin=0.0):
+    """(5, 4) planes [a, b, c, d]; a lidar point X is in the camera frustum iff planes . [X, 1] >= 0.
+
+    With M the 3x4 projection: z = M3.X > 0, u = M1.X / z in [0, W], v = M2.X / z in [0, H].
+    margin widens the image by that fraction on every side.
+    """
+    mat = np.asarray(proj_mat, dtype=np.float64)
+    key = (mat.tobytes(), img_w, img_h, margin)
+    planes = _plane_cache.get(key)
+    if planes is None:
+        m1, m2, m3 = mat
+        u0, u1 = -margin * img_w, (1 + margin) * img_w
+        v0, v1 = -margin * img_h, (1 + margin) * img_h
+        planes = np.stack([m3, m1 - u0 * m3, u1 * m3 - m1, m2 - v0 * m3, v1 * m3 - m2])
+        # 每个平面归一化, 使 planes . [X, 1] 为点到平面的距离 (float32 计算时数值范围相近)
+        planes = (planes / np.linalg.norm(planes[:, :3], axis=1, keepdims=True)).astype(np.float32)
+        if len(_plane_cache) >= _PLANE_CACHE_SIZE:
+            _plane_cache.clear()
+        _plane_cache[key] = planes
+    return planes
+
+
+def frustum_mask(points, proj_mat, img_w=None, img_h=None, margin=0.0, near=0.0):
+    """Boolean mask of points in front of the camera (and inside the image when its size is given)."""
+    if img_w is None or img_h is None:
+        # 只有相机前方的平面
+        plane = np.asarray(proj_mat, dtype=np.float64)[2]
+        planes = (plane / np.linalg.norm(plane[:3]))[None].astype(np.float32)
+    else:
+        planes = frustum_planes(proj_mat, img_w, img_h, margin)
+    # 直接与原始 (N, 4) 数组相乘 (第4列系数为0): 转置后是连续内存, 比先取出 xyz 快得多
+    coef = np.zeros((len(planes), points.shape[1]), dtype=np.float32)
+    coef[:, :3] = planes[:, :3]
+    dist = np.dot(coef, points.T)
+    mask = dist[0] > near - planes[0, 3]
+    tmp = np.empty(len(points), dtype=bool)
+    for k in range(1, len(planes)):
+        np.greater_equal(dist[k], -planes[k, 3], out=tmp)
+        mask &= tmp
+    return mask
+
+
+def range_mask(points, min_range=None, max_range=None):
+    """Boolean mask of points whose distance to the sensor is within [min_range, max_range]."""
+    xyz = points[:, :3]
+    r2 = np.einsum('ij,ij->i', xyz, xyz)
+    mask = np.ones(len(points), dtype=bool)
+    if min_range is not None:
+        mask &= r2 >= np.float32(min_range * min_range)
+    if max_range is not None:
+        mask &= r2 <= np.float32(max_range * max_range)
+    return mask
+
+
+def voxel_select(points, voxel_size):
+    """Indices (sorted) of one point per occupied voxel."""
+    idx = np.floor(points[:, :3] / np.float32(voxel_size)).astype(np.int64)
+    idx -= idx.min(axis=0)
+    dims = idx.max(axis=0) + 1
+    keys = (idx[:, 0] * dims[1] + idx[:, 1]) * dims[2] + idx[:, 2]
+    _, first = np.unique(keys, return_index=True)
+    first.sort()
+    return first
+
+
+def random_select(n, budget, seed=0):
+    """Sorted random indices of min(n, budget) out of n points."""
+    if n <= budget:
+        return np.arange(n)
+    rng = np.random.default_rng(seed)
+    return np.sort(rng.choice(n, budget, replace=False))
+
+
+class PointFilter:
+    """Configurable pre-projection filter; call it as filter(points, proj_mat, img_w, img_h).
+
+    frustum: cull points outside the camera frustum (needs proj_mat; margin widens the image).
+    min_range/max_range: keep points within that distance (m). roi: ((xmin, ymin, zmin), (xmax, ymax, zmax)).
+    voxel_size: keep one point per voxel. max_points: random subsample to at most this many points.
+    """
+
+    def __init__(self, frustum=True, margin=0.0, min_range=None, max_range=None, roi=None,
+                 voxel_size=None, max_points=None, seed=0):
+        self.frustum = frustum
+        self.margin = margin
+        self.min_range = min_range
+        self.max_range = max_range
+        self.roi = roi
+        self.voxel_size = voxel_size
+        self.max_points = max_points
+        self.seed = seed
+
+    def select(self, points, proj_mat=None, img_w=None, img_h=None):
+        """Indices of the points that pass the filter."""
+        mask = None
+        if self.frustum and proj_mat is not None:
+            mask = frustum_mask(points, proj_mat, img_w, img_h, self.margin)
+        if self.min_range is not None or self.max_range is not None:
+            m = range_mask(points, self.min_range, self.max_range)
+            mask = m if mask is None else mask & m
+        if self.roi is not None:
+            m = velo_scan.roi_mask(points, self.roi)
+            mask = m if mask is None else mask & m
+        index = np.arange(len(points)) if mask is None else np.flatnonzero(mask)
+        if self.voxel_size is not None and len(index):
+            index = index[voxel_select(points[index], self.voxel_size)]
+        if self.max_points is not None:
+            index = index[random_select(len(index), self.max_points, self.seed)]
+        return index
+
+    def __call__(self, points, proj_mat=None, img_w=None, img_h=None):
+        return points[self.select(points, proj_mat, img_w, img_h)]
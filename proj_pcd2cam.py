@@ -1,40 +1,51 @@
 import sys
-import matplotlib.pyplot as plt
-import matplotlib.image as mpimg
 import numpy as np
 import os
-import glob
-from tqdm import tqdm
+import functools
 import yaml
-
-def load_pcd_data(file_path):
-    pts = []
-    with open(file_path,'r') as f:
-        data = f.readlines()
-    line = data[9]
-    line = line.strip('\n')
-    i = line.split(' ')
-    pts_num = eval(i[-1])
-    for line in data[11:]:
-        line = line.strip('\n')
-        xyzi = line.split(' ')
-        # print(line)
-        if xyzi[0] != 'nan' and xyzi[1] != 'nan' and xyzi[2] != 'nan' and xyzi[3] != 'nan':
-            x, y, z = [eval(i) for i in xyzi[0:3]]
-            intensity = str(int(xyzi[-1])/255.0)
-            pts.append([x, y, z, intensity])
-
-    print(f"origin points: {pts_num}")
-    print(f"valid points: {len(pts)}")
-    print(f"invalid points: {pts_num - len(pts)}")
-    res = np.zeros((len(pts), len(pts[0])), dtype=np.float32)
-    for i in range(len(pts)):
-        res[i] = pts[i]
+import pcd_io
+import projection
+import render
+import depth_export
+import frame_source
+import distortion
+import prefilter
+import metrics
+import frame_store
+
+# 外参矩阵的约定: 'autoware' 为Autoware标定工具输出的矩阵 (需要先转换), 'standard' 为普通的 lidar->camera 变换矩阵
+# 未指定 convention 时使用 EXTRINSIC_CONVENTION (命令行 --extrinsic-convention, 见 cli.py)
+EXTRINSIC_CONVENTIONS = ('autoware', 'standard')
+EXTRINSIC_CONVENTION = 'autoware'
+
+def load_pcd_data(file_path, index=None):
+    # file_path 为转换后的存储文件 (.pcs, 见 frame_store.py) 时, 按 index (帧号或帧名) 零拷贝读取
+    if file_path.endswith(frame_store.STORE_EXT):
+        with metrics.stage('load_points'):
+            res = frame_store.open_store(file_path).points(index)
+        metrics.count('points_valid', len(res))
+        return res
+
+    # 按header解析字段后整体读取, 支持 ascii / binary / binary_compressed
+    with metrics.stage('load_points'):
+        cloud = pcd_io.read_pcd(file_path)
+        res = pcd_io.pcd_to_xyzi(cloud)
+
+    # 原始点数和有效点数 (不含NaN) 记录到 metrics, 启用统计时输出 (见 metrics.py)
+    metrics.count('points_origin', len(cloud))
+    metrics.count('points_valid', len(res))
     return res
 
-def get_calib_param(cam_lidar_calib_file):
+def load_calib_yaml(cam_lidar_calib_file):
+    # Autoware标定工具用OpenCV FileStorage写文件, 去掉 PyYAML 不认识的 %YAML:1.0 头和 !!opencv-matrix 标签
     with open(cam_lidar_calib_file, 'r') as file:
-        cam_lidar_calib_data = yaml.safe_load(file)
+        text = file.read()
+    if text.startswith('%YAML:1.0'):
+        text = text.split('\n', 1)[1]
+    return yaml.safe_load(text.replace('!!opencv-matrix', ''))
+
+def get_calib_param(cam_lidar_calib_file):
+    cam_lidar_calib_data = load_calib_yaml(cam_lidar_calib_file)
     camera_mat = cam_lidar_calib_data.get('CameraMat')
     intrinsic = np.array(camera_mat.get('data')).reshape(3,3)
     intrinsic = np.insert(intrinsic,3,values=[0,0,0],axis=1)
@@ -43,41 +54,96 @@ def get_calib_param(cam_lidar_calib_file):
     extrinsic = np.array(extrinsic.get('data')).reshape(4,4)
     return intrinsic, extrinsic
 
-def get_pointcloud_on_image(intrinsic, extrinsic, pointcloud):
-    # Autoware标定矩阵变换，跟普通变换矩阵不同, 若为普通变换矩阵，请注释下面这段代码
-    extrinsic[:3,:3] = extrinsic[:3,:3].T
-    x = extrinsic[0, 3]
-    y = extrinsic[1, 3]
-    z = extrinsic[2, 3]
-    extrinsic[0, 3] = y
-    extrinsic[1, 3] = z
-    extrinsic[2, 3] = -x
-
-    # lidar xyz (front, left, up)
-    points = pointcloud[:, 0:3]
-
-    # reflectance
-    reflectance = pointcloud[:, 3].T
-
-    # 补充一个维度，便于矩阵计算
-    lidar = np.insert(points,3,1,axis=1).T
-
-    # 删除距离为负的点云
-    # reflectance = np.delete(reflectance, np.where(velo[0,:]<0))
-    # velo = np.delete(velo,np.where(velo[0,:]<0),axis=1)
-
-    cam = intrinsic.dot(extrinsic.dot(lidar))
-
-    # 删除像方坐标z为负值的点
-    reflectance = np.delete(reflectance, np.where(cam[2,:]<0))
-    cam = np.delete(cam,np.where(cam[2,:]<0),axis=1)
-
-    # get u,v,z
-    cam[:2] /= cam[2,:]
-
-    return cam, reflectance
+def get_distortion_param(cam_lidar_calib_file):
+    # DistCoeff (k1, k2, p1, p2, k3), 仅支持 plumb_bob 模型; 没有畸变参数时返回 None
+    cam_lidar_calib_data = load_calib_yaml(cam_lidar_calib_file)
+    dist_coeff = cam_lidar_calib_data.get('DistCoeff')
+    if dist_coeff is None:
+        return None
+    dist_model = cam_lidar_calib_data.get('DistModel', 'plumb_bob')
+    if dist_model not in distortion.DIST_MODELS:
+        raise ValueError(f'unsupported distortion model: {dist_model}')
+    return distortion.as_coeffs(dist_coeff.get('data'))
+
+def _matrix_yaml(name, mat):
+    mat = np.atleast_2d(mat)
+    rows, cols = mat.shape
+    data = ', '.join(repr(float(x)) for x in mat.ravel())
+    return f'{name}: \n   rows: {rows}\n   cols: {cols}\n   dt: d\n   data: [ {data} ]\n'
+
+def save_calib_param(save_file, extrinsic, template_file=None, intrinsic=None, dist_coeffs=None, image_size=None):
+    # 按Autoware标定文件格式保存: CameraExtrinsicMat 为新的外参, 其余字段默认取自 template_file
+    calib = load_calib_yaml(template_file) if template_file is not None else {}
+    camera_mat = intrinsic[:3, :3] if intrinsic is not None else np.array(calib['CameraMat']['data']).reshape(3, 3)
+    if dist_coeffs is None and 'DistCoeff' in calib:
+        dist_coeffs = calib['DistCoeff']['data']
+    if image_size is None:
+        image_size = calib.get('ImageSize')
+
+    text = _matrix_yaml('CameraExtrinsicMat', np.asarray(extrinsic).reshape(4, 4))
+    text += _matrix_yaml('CameraMat', camera_mat)
+    if dist_coeffs is not None:
+        text += _matrix_yaml('DistCoeff', np.asarray(dist_coeffs, dtype=np.float64).reshape(1, -1))
+    if image_size is not None:
+        text += f'ImageSize: [ {int(image_size[0])}, {int(image_size[1])} ]\n'
+    text += f"ReprojectionError: {calib.get('ReprojectionError', 0)}\n"
+    if dist_coeffs is not None:
+        text += f"DistModel: {calib.get('DistModel', 'plumb_bob')}\n"
+    with open(save_file, 'w') as file:
+        file.write(text)
+
+def convert_autoware_extrinsic(extrinsic):
+    # Autoware标定矩阵变换，跟普通变换矩阵不同 (也可以是 (K, 4, 4) 的一组外参)
+    extrinsic = extrinsic.copy()
+    extrinsic[..., :3,:3] = np.swapaxes(extrinsic[..., :3,:3], -1, -2)
+    x = extrinsic[..., 0, 3].copy()
+    y = extrinsic[..., 1, 3].copy()
+    z = extrinsic[..., 2, 3].copy()
+    extrinsic[..., 0, 3] = y
+    extrinsic[..., 1, 3] = z
+    extrinsic[..., 2, 3] = -x
+    return extrinsic
+
+def set_extrinsic_convention(convention):
+    global EXTRINSIC_CONVENTION
+    if convention not in EXTRINSIC_CONVENTIONS:
+        raise ValueError(f'unknown extrinsic convention: {convention}')
+    EXTRINSIC_CONVENTION = convention
+
+def get_projection_matrix(intrinsic, extrinsic, convention=None):
+    # Autoware外参先转换为普通变换矩阵, convention='standard' 时直接使用
+    convention = convention or EXTRINSIC_CONVENTION
+    if convention == 'autoware':
+        extrinsic = convert_autoware_extrinsic(extrinsic)
+    elif convention != 'standard':
+        raise ValueError(f'unknown extrinsic convention: {convention}')
+
+    # 内外参预先相乘为 3x4 投影矩阵, 一次矩阵乘法得到 [u v z]
+    # extrinsic 为 (K, 4, 4) 时得到 (K, 3, 4)
+    return np.matmul(intrinsic, extrinsic)
+
+def get_pointcloud_on_image(intrinsic, extrinsic, pointcloud, img_size=None, out=None, convention=None):
+    # 像方坐标z为负的点, 以及给定img_size (W, H) 时取景框以外的点, 用一个mask一次性删除
+    img_w, img_h = img_size if img_size is not None else (None, None)
+    proj = projection.project_points(get_projection_matrix(intrinsic, extrinsic, convention), pointcloud,
+                                     img_w, img_h, out=out)
+
+    cam = np.stack([proj.u, proj.v, proj.z])
+    return cam, proj.intensity
+
+def get_pointcloud_on_images(intrinsic, extrinsics, pointclouds, img_size=None, convention=None):
+    # 多帧点云 x 多组外参一次投影 (标定搜索、多帧叠加), 不再在Python循环中逐个调用 get_pointcloud_on_image
+    # extrinsics: (K, 4, 4); pointclouds: 点云列表; img_size: (W, H) 或每帧一个 (W, H)
+    # 返回 projection.BatchProjection, result.get(k, f) 为第k组外参下第f帧的投影结果
+    points, offsets = projection.stack_clouds(pointclouds)
+    img_w, img_h = np.asarray(img_size).T if img_size is not None else (None, None)
+    proj_mats = get_projection_matrix(intrinsic, np.asarray(extrinsics).reshape(-1, 4, 4), convention)
+    return projection.project_batch(proj_mats, points, offsets, img_w, img_h)
 
 def plt_init(img_file):
+    # matplotlib 只在 backend='matplotlib' 时导入, 无界面的批处理启动更快
+    import matplotlib.pyplot as plt
+    import matplotlib.image as mpimg
     fig, axes = plt.subplots(1, 3)
     plt.subplots_adjust(wspace=0.1, hspace=0.1)
     img = mpimg.imread(img_file)
@@ -98,46 +164,91 @@ def plt_init(img_file):
     axes[2].axis('off')
     return IMG_H, IMG_W, axes
 
-def process_one_frame(number):
-    # 读取标定得到的内外参
-    cam_lidar_calib_file='ros_data/20231218_132035_autoware_lidar_camera_calibration.yaml'
-    intrinsic, extrinsic = get_calib_param(cam_lidar_calib_file)
-
-    # 读取激光点云数据
-    point_cloud_file2 = 'ros_data/pointcloud/1702895061247132.pcd'
-    scan = load_pcd_data(point_cloud_file2)
-
-    cam, reflectance = get_pointcloud_on_image(intrinsic, extrinsic, scan)
-
-    # plt init
-    img_file = 'ros_data/image/1702895061262535.jpg'
-    img_name = os.path.splitext(os.path.basename(img_file))[0]
-    IMG_H, IMG_W, axes = plt_init(img_file)
-
-    # filter point out of canvas 删除相机取景框以外的点云
-    u,v,z = cam
-    u_out = np.logical_or(u<0, u>IMG_W)
-    v_out = np.logical_or(v<0, v>IMG_H)
-    outlier = np.logical_or(u_out, v_out)
-
-    reflectance = np.delete(reflectance,np.where(outlier))
-    cam = np.delete(cam,np.where(outlier),axis=1)
-
-    # 根据 u, v 将点云画到图像上 (s可调整点云像素大小)
-    u,v,z = cam
-    axes[1].scatter([u],[v],c=[z],cmap='rainbow_r',alpha=0.5,s=5)
-    axes[2].scatter([u],[v],c=[reflectance],cmap='rainbow_r',alpha=0.5,s=5)
-
-    projection_save_dir = 'ros_data/projection/'
+# 默认的ROS数据目录和标定文件
+IMG_DIR = 'ros_data/image'
+POINTCLOUD_DIR = 'ros_data/pointcloud'
+CALIB_FILE = 'ros_data/20231218_132035_autoware_lidar_camera_calibration.yaml'
+PROJECTION_DIR = 'ros_data/projection/'
+DEPTH_DIR = 'ros_data/depth_export'
+
+def default_source():
+    # 图像和点云按时间戳排序后一一对应 (见 frame_source.py), 投影前先剔除相机视野外的点 (见 prefilter.py)
+    return frame_source.PcdSource(IMG_DIR, POINTCLOUD_DIR, CALIB_FILE, point_filter=prefilter.PointFilter())
+
+def process_frame(frame, backend='numpy', radius=2, projection_save_dir=PROJECTION_DIR, fmt='png'):
+    # 投影图写到 projection_save_dir/<帧名>.<fmt> (png / jpg)
+    # 启用统计时 (见 metrics.py), 这一帧各步骤的耗时和点数归到 frame.name 下
+    with metrics.frame(frame.name):
+        _process_frame(frame, backend, radius, projection_save_dir, fmt)
+
+def _process_frame(frame, backend, radius, projection_save_dir, fmt):
+    # 标定得到的内外参、激光点云数据、图像都由 frame 在第一次访问时读取
+    img_file = frame.image_file
+    save_path = os.path.join(projection_save_dir, f'{frame.name}.{fmt}')
     os.makedirs(projection_save_dir, exist_ok=True)
-    # plt.savefig(f'./data_object_image_2/testing/projection/{number}.png',dpi=300,bbox_inches='tight')
-    plt.savefig(os.path.join(projection_save_dir, img_name),dpi=300,bbox_inches='tight')
+
+    if backend == 'matplotlib':
+        # plt init
+        IMG_H, IMG_W, axes = plt_init(img_file)
+    else:
+        img = frame.image
+
+    # 投影并删除相机取景框以外的点云
+    proj = frame.project()
+    u, v, z = proj.u, proj.v, proj.z
+    reflectance = proj.intensity
+
+    if backend == 'matplotlib':
+        # 根据 u, v 将点云画到图像上 (s可调整点云像素大小)
+        with metrics.stage('render'):
+            axes[1].scatter([u],[v],c=[z],cmap='rainbow_r',alpha=0.5,s=5)
+            axes[2].scatter([u],[v],c=[reflectance],cmap='rainbow_r',alpha=0.5,s=5)
+
+        # plt.savefig(f'./data_object_image_2/testing/projection/{number}.png',dpi=300,bbox_inches='tight')
+        import matplotlib.pyplot as plt
+        with metrics.stage('save'):
+            plt.savefig(save_path,dpi=300,bbox_inches='tight')
+            # 关闭figure, 否则批量处理时内存持续增长
+            plt.close()
+    else:
+        # 直接写入图像数组: Image / Depth Mix / Reflectance Mix 水平排列 (radius可调整点云像素大小)
+        with metrics.stage('render'):
+            panels = render.render_projection(img, u, v, z, reflectance, vertical=False, radius=radius)
+        with metrics.stage('save'):
+            render.save_image(save_path, panels)
 
     # plt.show()
 
+def process_one_frame(number, backend='numpy', radius=2):
+    # number 为帧序号或图像文件名 (不含扩展名)
+    process_frame(default_source()[number], backend, radius)
+
+def export_depth_frame(frame, out_dir=DEPTH_DIR, fmt='png', writer=None):
+    # 导出稠密深度图/反射率图 (KITTI depth completion格式, 见 depth_export.py)
+    # 只需要图像尺寸, 不解码图像
+    with metrics.frame(frame.name):
+        IMG_H, IMG_W = frame.image_size
+        proj = frame.project()
+        with metrics.stage('rasterize'):
+            depth, intensity = depth_export.rasterize(proj.u, proj.v, proj.z, proj.intensity, IMG_H, IMG_W)
+        with metrics.stage('save'):
+            if writer is not None:
+                writer.add(frame.name, depth, intensity)
+            else:
+                depth_export.save_maps(out_dir, frame.name, depth, intensity, fmt)
+
+def export_depth_one_frame(point_cloud_file, img_file, cam_lidar_calib_file, out_dir=DEPTH_DIR, fmt='png', writer=None):
+    name = os.path.splitext(os.path.basename(img_file))[0]
+    frame = frame_source.Frame(name, point_cloud_file, img_file,
+                               functools.partial(frame_source.load_camera_lidar_calib, cam_lidar_calib_file))
+    export_depth_frame(frame, out_dir, fmt, writer)
+
 def main():
-    process_one_frame('000003')
+    # 路径、帧范围、外参约定等由命令行给出: python3 cli.py project-ros ... (见 cli.py)
+    # 设置环境变量 PROJ_METRICS=metrics.json (或 .prom) / PROJ_PROFILE_TOP=N 时统计各步骤耗时 (见 metrics.py)
+    import cli
+    cli.main(['project-ros'] + sys.argv[1:])
     print("finished!")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
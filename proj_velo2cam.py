@@ -1,99 +1,28 @@
 import sys
-import matplotlib.pyplot as plt
-import matplotlib.image as mpimg
+import json
 import numpy as np
 import os
-import glob
-from tqdm import tqdm
-
-def process_one_frame(number):
-    with open(f'./testing/calib/{number}.txt','r') as f:
-        calib = f.readlines()
-    # 相机内参 camera2 
-    # | fx 0 u0 |
-    # | 0 fy v0 |
-    # | 0  0  1 |
-    # example: 000007.txt
-    # 7.215377000000e+02 0.000000000000e+00 6.095593000000e+02 4.485728000000e+01 
-    # 0.000000000000e+00 7.215377000000e+02 1.728540000000e+02 2.163791000000e-01 
-    # 0.000000000000e+00 0.000000000000e+00 1.000000000000e+00 2.745884000000e-03
-    P2 = np.array([float(x) for x in calib[2].strip('\n').split(' ')[1:]]).reshape(3,4)
-
-    # 相机旋转矩阵
-    # | r11  r12  r13 |
-    # | r21  r22  r23 |
-    # | r31  r32  r33 |
-    # example: 000007.txt
-    # ——————————————————————————————————————————————————————————————————
-    # 9.999239000000e-01 9.837760000000e-03 -7.445048000000e-03 
-    # -9.869795000000e-03 9.999421000000e-01 -4.278459000000e-03 
-    # 7.402527000000e-03 4.351614000000e-03 9.999631000000e-01
-    # ——————————————————————————————————————————————————————————————————
-    R0_rect = np.array([float(x) for x in calib[4].strip('\n').split(' ')[1:]]).reshape(3,3)
-
-    # 矩阵转为如下形式, 增加维度方便计算
-    # ——————————————————————————————————————————————————————————————————
-    #  9.999239000000e-01  9.837760000000e-03 -7.445048000000e-03 0
-    # -9.869795000000e-03  9.999421000000e-01 -4.278459000000e-03 0
-    #  7.402527000000e-03  4.351614000000e-03  9.999631000000e-01 0
-    #                   0                   0                   0 1
-    # ——————————————————————————————————————————————————————————————————
-    R0_rect = np.insert(R0_rect,3,values=[0,0,0],axis=0)
-    R0_rect = np.insert(R0_rect,3,values=[0,0,0,1],axis=1)
-
-    # 激光雷达到相机坐标变换矩阵
-    # | R  T |
-    # | 0  1 |
-    # example: 000007.txt
-    # 7.533745000000e-03 -9.999714000000e-01 -6.166020000000e-04 -4.069766000000e-03 
-    # 1.480249000000e-02 7.280733000000e-04 -9.998902000000e-01 -7.631618000000e-02 
-    # 9.998621000000e-01 7.523790000000e-03 1.480755000000e-02 -2.717806000000e-01
-    Tr_velo_to_cam = np.array([float(x) for x in calib[5].strip('\n').split(' ')[1:]]).reshape(3,4)
-
-    # 7.533745000000e-03 -9.999714000000e-01 -6.166020000000e-04 -4.069766000000e-03 
-    # 1.480249000000e-02  7.280733000000e-04 -9.998902000000e-01 -7.631618000000e-02 
-    # 9.998621000000e-01  7.523790000000e-03  1.480755000000e-02 -2.717806000000e-01
-    #                  0                   0                   0                   1
-    Tr_velo_to_cam = np.insert(Tr_velo_to_cam,3,values=[0,0,0,1],axis=0)
-
-    # read point cloud file
-    point_cloud_file = f'./data_object_velodyne/testing/velodyne/{number}.bin'
-    scan = np.fromfile(point_cloud_file, dtype=np.float32).reshape((-1,4))
-
-    # lidar xyz (front, left, up)
-    points = scan[:, 0:3]
-
-    # reflectance
-    reflectance = scan[:, 3].T
-
-    # 补充一个维度，便于矩阵计算
-    velo = np.insert(points,3,1,axis=1).T
-
-    # 删除距离为负的点云
-    reflectance = np.delete(reflectance, np.where(velo[0,:]<0))
-    velo = np.delete(velo,np.where(velo[0,:]<0),axis=1)
-
-    # 点云 [x y z] 转 [u v]
-    #
-    #           [fx   0   u0   ?]     [r11  r12  r13  0]     [          ]
-    #  cam =    [0    fy  v0   ?]  *  [r21  r22  r23  0]  *  [  R     t ]  *  velo(4, n)
-    #           [0    0    1   ?]     [r31  r32  r33  0]     [          ]
-    #                                 [0    0    0    1]     [  0     1 ]
-    cam = P2.dot(R0_rect.dot(Tr_velo_to_cam.dot(velo)))
-
-    # 删除像方坐标z为负值的点
-    reflectance = np.delete(reflectance, np.where(cam[2,:]<0))
-    cam = np.delete(cam,np.where(cam[2,:]<0),axis=1)
-
-    # get u,v,z
-    cam[:2] /= cam[2,:]
-
-    # plt init
-    img_file = f'./data_object_image_2/testing/image_2/{number}.png'
+import projection
+import render
+import depth_export
+import frame_source
+import metrics
+import pixel_index
+
+# 投影用的预分配缓冲区, 逐帧复用
+_proj_buffer = projection.ProjectionBuffer()
+
+# 稠密深度图导出目录
+DEPTH_DIR = './data_object_image_2/testing/depth_export'
+# KITTI标注 (label_2) 目录, 标注框点云统计的输出目录 (只有 training split 有标注)
+LABEL_DIR = './data_object_label_2/testing/label_2'
+BOX_STATS_DIR = './data_object_image_2/testing/box_stats'
+
+def plot_projection(img, u, v, z, reflectance, save_path):
+    # matplotlib 绘图 (较慢, 保留用于对比); 只在使用时导入
+    import matplotlib.pyplot as plt
     fig, axes = plt.subplots(3, 1)
     plt.subplots_adjust(wspace=0.1, hspace=0.1)
-    img = mpimg.imread(img_file)
-    IMG_H,IMG_W,_ = img.shape
 
     axes[0].imshow(img)
     axes[0].set_title('Image', fontsize=6)
@@ -109,33 +38,150 @@ def process_one_frame(number):
     axes[1].axis('off')
     axes[2].axis('off')
 
-    # filter point out of canvas 删除相机取景框以外的点云
-    u,v,z = cam
-    u_out = np.logical_or(u<0, u>IMG_W)
-    v_out = np.logical_or(v<0, v>IMG_H)
-    outlier = np.logical_or(u_out, v_out)
-
-    reflectance = np.delete(reflectance,np.where(outlier))
-    cam = np.delete(cam,np.where(outlier),axis=1)
-
     # 根据 u, v 将点云画到图像上 (s可调整点云像素大小)
-    u,v,z = cam
     axes[1].scatter([u],[v],c=[z],cmap='rainbow_r',alpha=0.5,s=1)
     axes[2].scatter([u],[v],c=[reflectance],cmap='rainbow_r',alpha=0.5,s=1)
 
-    os.makedirs('./data_object_image_2/testing/projection', exist_ok=True)
-    plt.savefig(f'./data_object_image_2/testing/projection/{number}.png',dpi=300,bbox_inches='tight')
+    plt.savefig(save_path,dpi=300,bbox_inches='tight')
+    # 关闭figure, 否则批量处理时内存持续增长
+    plt.close(fig)
+
+# 以下路径都相对于KITTI根目录 root, split 为 'training' / 'testing'
+def calib_path(number, root='.', split='testing'):
+    return os.path.join(root, split, 'calib', f'{number}.txt')
+
+def projection_path(number, root='.', split='testing', fmt='png'):
+    return os.path.join(root, 'data_object_image_2', split, 'projection', f'{number}.{fmt}')
+
+def default_depth_dir(root='.', split='testing'):
+    return os.path.join(root, 'data_object_image_2', split, 'depth_export')
+
+def default_label_dir(root='.', split='testing'):
+    return os.path.join(root, 'data_object_label_2', split, 'label_2')
+
+def default_box_stats_dir(root='.', split='testing'):
+    return os.path.join(root, 'data_object_image_2', split, 'box_stats')
+
+def label_path(number, label_dir=LABEL_DIR):
+    return os.path.join(label_dir, f'{number}.txt')
+
+def box_stats_path(number, out_dir=BOX_STATS_DIR):
+    return os.path.join(out_dir, f'{number}.json')
+
+def read_labels(label_file):
+    # KITTI标注每行: 类别 截断 遮挡 alpha 2D框(left top right bottom) 3D尺寸 位置 rotation_y, 只取类别和2D框
+    labels = []
+    with open(label_file) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) >= 8:
+                labels.append((fields[0], [float(x) for x in fields[4:8]]))
+    return labels
+
+def process_frame(frame, backend='numpy', radius=1, root='.', split='testing', out_dir=None, fmt='png'):
+    # 投影图写到 out_dir/<帧名>.<fmt> (png / jpg), 默认为 root 下 split 的 projection 目录
+    # 启用统计时 (见 metrics.py), 这一帧各步骤的耗时和点数归到 frame.name 下
+    if out_dir is not None:
+        save_path = os.path.join(out_dir, f'{frame.name}.{fmt}')
+    else:
+        save_path = projection_path(frame.name, root, split, fmt)
+    with metrics.frame(frame.name):
+        _process_frame(frame, backend, radius, save_path)
+
+def _process_frame(frame, backend, radius, save_path):
+    # 点云 (内存映射读取, 见 velo_scan.py)、图像、标定 (相同内容只解析一次, 见 kitti_calib.py)
+    # 都由 frame 在第一次访问时读取 (见 frame_source.py)
+    img = frame.image
+
+    # 点云 [x y z] 转 [u v]
+    #
+    #           [fx   0   u0   ?]     [r11  r12  r13  0]     [          ]
+    #  cam =    [0    fy  v0   ?]  *  [r21  r22  r23  0]  *  [  R     t ]  *  velo(4, n)
+    #           [0    0    1   ?]     [r31  r32  r33  0]     [          ]
+    #                                 [0    0    0    1]     [  0     1 ]
+    # 三个矩阵预先相乘为一个 3x4 矩阵, 每帧只需一次矩阵乘法
+    # 一次性删除距离为负 (x<0)、像方坐标z为负以及相机取景框以外的点云
+    proj = frame.project(out=_proj_buffer)
+    u, v, z = proj.u, proj.v, proj.z
+    reflectance = proj.intensity
+
+    os.makedirs(os.path.dirname(save_path), exist_ok=True)
+    if backend == 'matplotlib':
+        # 绘制和 savefig 无法分开计时
+        with metrics.stage('render_matplotlib'):
+            plot_projection(img, u, v, z, reflectance, save_path)
+    else:
+        # 直接写入图像数组: Image / Depth Mix / Reflectance Mix 竖直排列
+        with metrics.stage('render'):
+            panels = render.render_projection(img, u, v, z, reflectance, vertical=True, radius=radius)
+        with metrics.stage('save'):
+            render.save_image(save_path, panels)
 
     # plt.show()
 
+def process_one_frame(number, backend='numpy', radius=1, calib=None, point_filter=None, root='.', scan_cache=None,
+                      split='testing', fmt='png'):
+    frame = frame_source.kitti_frame(number, root, split, calib=calib, point_filter=point_filter,
+                                     scan_cache=scan_cache)
+    process_frame(frame, backend, radius, root, split, fmt=fmt)
+
+def export_depth_frame(frame, out_dir=DEPTH_DIR, fmt='png', writer=None):
+    # 导出稠密深度图/反射率图 (KITTI depth completion格式, 见 depth_export.py)
+    # 只需要图像尺寸, 不解码图像
+    with metrics.frame(frame.name):
+        IMG_H, IMG_W = frame.image_size
+        proj = frame.project(out=_proj_buffer)
+        with metrics.stage('rasterize'):
+            depth, intensity = depth_export.rasterize(proj.u, proj.v, proj.z, proj.intensity, IMG_H, IMG_W)
+        with metrics.stage('save'):
+            if writer is not None:
+                writer.add(frame.name, depth, intensity)
+            else:
+                depth_export.save_maps(out_dir, frame.name, depth, intensity, fmt)
+
+def export_depth_one_frame(number, out_dir=DEPTH_DIR, fmt='png', calib=None, writer=None, point_filter=None, root='.',
+                           scan_cache=None, split='testing'):
+    frame = frame_source.kitti_frame(number, root, split, calib=calib, point_filter=point_filter,
+                                     scan_cache=scan_cache)
+    export_depth_frame(frame, out_dir, fmt, writer)
+
+def box_stats_frame(frame, labels):
+    # 每个标注框内投影点的个数和深度/反射率统计, 在投影点的网格索引上按框查询 (见 pixel_index.py)
+    # 返回每个框一个dict, 没有点的框统计值为 None
+    with metrics.frame(frame.name):
+        IMG_H, IMG_W = frame.image_size
+        proj = frame.project(out=_proj_buffer)
+        with metrics.stage('box_stats'):
+            grid = pixel_index.from_projection(proj, IMG_W, IMG_H)
+            stats = grid.box_stats([box for _, box in labels], proj.z, proj.intensity)
+    boxes = []
+    for k, (label_type, box) in enumerate(labels):
+        entry = {'type': label_type, 'bbox': box, 'points': int(stats['points'][k])}
+        for name, values in stats.items():
+            if name != 'points':
+                entry[name] = None if np.isnan(values[k]) else float(values[k])
+        boxes.append(entry)
+    return boxes
+
+def export_box_stats_one_frame(number, out_dir=BOX_STATS_DIR, calib=None, point_filter=None, label_dir=LABEL_DIR,
+                               root='.', scan_cache=None, split='testing'):
+    # 标注、点云、图像、标定必须来自同一个 split (帧号在各 split 中重复)
+    frame = frame_source.kitti_frame(number, root, split, calib=calib, point_filter=point_filter,
+                                     scan_cache=scan_cache)
+    boxes = box_stats_frame(frame, read_labels(label_path(number, label_dir)))
+    os.makedirs(out_dir, exist_ok=True)
+    # 先写临时文件再替换: 批处理按输出文件是否存在跳过, 中断时不能留下不完整的JSON
+    path = box_stats_path(number, out_dir)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'frame': number, 'boxes': boxes}, f, indent=2)
+    os.replace(path + '.tmp', path)
+
 def main():
-    img_dir = "data_object_image_2/testing/image_2"
-    img_nums = []
-    for file_path in glob.glob(os.path.join(img_dir, '*.png')):  # 替换 '*.png' 为你想要匹配的图片格式，比如 '*.jpg'
-        img_nums.append(os.path.splitext(os.path.basename(file_path))[0])
-    
-    for num in tqdm(img_nums):
-        process_one_frame(num)
+    # 图像与点云都存在的帧, 多进程批量处理, 已存在的输出会跳过 (见 batch_project.py)
+    # 帧范围、进程数等由命令行给出: python3 cli.py project-kitti ... (见 cli.py)
+    # 设置环境变量 PROJ_METRICS=metrics.json (或 .prom) / PROJ_PROFILE_TOP=N 时统计各步骤耗时 (见 metrics.py)
+    import cli
+    cli.main(['project-kitti'] + sys.argv[1:])
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,223 @@
+from collections import namedtuple
+import numpy as np
+
+# projection.py
+# 功能: 点云投影到图像 (u, v, depth), 一次矩阵乘法 + 一个可见性mask, 不再多次 np.delete
+#
+#   [u*z]              [x]
+#   [v*z] = M(3x4)  *  [y]      M = P * R0_rect * Tr_velo_to_cam (KITTI)
+#   [ z ]              [z]      M = intrinsic * extrinsic        (ROS)
+#                      [1]
+# project_batch: 多帧点云 (拼接 + 偏移) x 多组投影矩阵, 一次批量矩阵乘法
+
+ProjectedPoints = namedtuple('ProjectedPoints', ['u', 'v', 'z', 'intensity', 'index'])
+
+
+class ProjectionBuffer:
+    """Preallocated work/output arrays for project_points.
+
+    Arrays grow when a larger scan arrives, so steady-state projection does not allocate.
+    Results returned with a buffer are views into it and are overwritten by the next call.
+    """
+
+    def __init__(self, capacity=0):
+        self.capacity = 0
+        self._reserve(capacity)
+
+    def _reserve(self, n):
+        # 容量为0时也要分配 (空数组), 例如ROI外没有点的帧
+        if n <= self.capacity and hasattr(self, 'cam'):
+            return
+        n = max(n, int(self.capacity * 1.5))
+        self.cam = np.empty((n, 3), dtype=np.float32)
+        self.mask = np.empty(n, dtype=bool)
+        self.tmp = np.empty(n, dtype=bool)
+        self.bound = np.empty(n, dtype=np.float32)
+        self.arange = np.arange(n, dtype=np.int64)
+        self.u = np.empty(n, dtype=np.float32)
+        self.v = np.empty(n, dtype=np.float32)
+        self.z = np.empty(n, dtype=np.float32)
+        self.intensity = np.empty(n, dtype=np.float32)
+        self.index = np.empty(n, dtype=np.int64)
+        self.capacity = n
+
+
+def project_points(proj_mat, points, img_w=None, img_h=None, front_only=False, out=None):
+    """Project lidar points to the image plane.
+
+    proj_mat: 3x4 lidar->image matrix. points: (N, 3) or (N, 4) [x, y, z, intensity].
+    Keeps points with depth > 0 and, when img_w/img_h are given, 0 <= u <= img_w and
+    0 <= v <= img_h. front_only also drops points with lidar x < 0.
+    Returns ProjectedPoints(u, v, z, intensity, index) with index into the input points.
+    """
+    points = np.asarray(points)
+    n = len(points)
+    if out is None:
+        out = ProjectionBuffer()
+    out._reserve(n)
+
+    mat = np.asarray(proj_mat, dtype=np.float32)
+    xyz = points[:, :3]
+    if xyz.dtype != np.float32:
+        xyz = xyz.astype(np.float32)
+
+    # 单次矩阵乘法得到 [u*z, v*z, z]
+    cam = out.cam[:n]
+    np.matmul(xyz, mat[:, :3].T, out=cam)
+    cam += mat[:, 3]
+
+    # 合并所有过滤条件为一个mask
+    mask = out.mask[:n]
+    tmp = out.tmp[:n]
+    np.greater(cam[:, 2], 0, out=mask)
+    if front_only:
+        np.greater_equal(xyz[:, 0], 0, out=tmp)
+        mask &= tmp
+    if img_w is not None and img_h is not None:
+        # u = cam_x / z 在 [0, W] 内等价于 0 <= cam_x <= W * z (z > 0)
+        bound = out.bound[:n]
+        for col, size in ((0, img_w), (1, img_h)):
+            np.greater_equal(cam[:, col], 0, out=tmp)
+            mask &= tmp
+            np.multiply(cam[:, 2], np.float32(size), out=bound)
+            np.less_equal(cam[:, col], bound, out=tmp)
+            mask &= tmp
+
+    k = int(np.count_nonzero(mask))
+    u, v, z = out.u[:k], out.v[:k], out.z[:k]
+    index = out.index[:k]
+    np.compress(mask, out.arange[:n], out=index)
+    np.compress(mask, cam[:, 2], out=z)
+    np.compress(mask, cam[:, 0], out=u)
+    np.compress(mask, cam[:, 1], out=v)
+    u /= z
+    v /= z
+
+    intensity = out.intensity[:k]
+    if points.shape[1] > 3:
+        np.compress(mask, points[:, 3], out=intensity)
+    else:
+        intensity[:] = 0
+    return ProjectedPoints(u, v, z, intensity, index)
+
+
+def stack_clouds(clouds):
+    """Concatenate point clouds into one array plus offsets (len(clouds) + 1,) into it."""
+    lengths = [len(c) for c in clouds]
+    offsets = np.zeros(len(clouds) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    if not clouds:
+        return np.empty((0, 4), dtype=np.float32), offsets
+    return np.concatenate([np.asarray(c, dtype=np.float32) for c in clouds]), offsets
+
+
+class BatchProjection:
+    """Visible points of every (candidate matrix, frame) pair of project_batch.
+
+    Arrays are flat, ordered by candidate, then frame, then point; counts[k, f] is the
+    number of visible points of frame f under candidate k. index is relative to the frame.
+    """
+
+    def __init__(self, u, v, z, intensity, index, counts):
+        self.u = u
+        self.v = v
+        self.z = z
+        self.intensity = intensity
+        self.index = index
+        self.counts = counts
+        self.starts = np.zeros(counts.size + 1, dtype=np.int64)
+        np.cumsum(counts.ravel(), out=self.starts[1:])
+
+    @property
+    def num_candidates(self):
+        return self.counts.shape[0]
+
+    @property
+    def num_frames(self):
+        return self.counts.shape[1]
+
+    def get(self, k, f):
+        """ProjectedPoints of frame f under candidate k (views into the flat arrays)."""
+        i = k * self.num_frames + f
+        s = slice(self.starts[i], self.starts[i + 1])
+        return ProjectedPoints(self.u[s], self.v[s], self.z[s], self.intensity[s], self.index[s])
+
+    def candidate_ids(self):
+        return np.repeat(np.arange(self.num_candidates), self.counts.sum(axis=1))
+
+    def frame_ids(self):
+        return np.repeat(np.tile(np.arange(self.num_frames), self.num_candidates), self.counts.ravel())
+
+
+def project_batch(proj_mats, points, offsets, img_w=None, img_h=None, front_only=False, max_elements=1 << 23):
+    """Project a ragged batch of frames with a stack of K projection matrices in one call.
+
+    proj_mats: (K, 3, 4) shared by all frames, or (K, F, 3, 4) per frame.
+    points/offsets: concatenated clouds (see stack_clouds); frame f is points[offsets[f]:offsets[f+1]].
+    img_w/img_h: scalars or one value per frame. Visibility rules are those of project_points.
+    Candidates are processed in chunks of at most max_elements projected points.
+    Returns a BatchProjection.
+    """
+    mats = np.asarray(proj_mats, dtype=np.float32)
+    if mats.ndim == 2:
+        mats = mats[None]
+    points = np.asarray(points)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    num_frames = len(offsets) - 1
+    n = len(points)
+    lengths = np.diff(offsets)
+    frame_of_point = np.repeat(np.arange(num_frames), lengths)
+    xyz = np.ascontiguousarray(points[:, :3], dtype=np.float32)
+    intensity = points[:, 3] if points.shape[1] > 3 else np.zeros(n, dtype=np.float32)
+
+    # 每个点所在帧的图像尺寸
+    bounds = None
+    if img_w is not None and img_h is not None:
+        bounds = (np.repeat(np.broadcast_to(np.asarray(img_w, dtype=np.float32), (num_frames,)), lengths),
+                  np.repeat(np.broadcast_to(np.asarray(img_h, dtype=np.float32), (num_frames,)), lengths))
+    base = xyz[:, 0] >= 0 if front_only else None
+
+    xyz_t = np.ascontiguousarray(xyz.T)
+    results = {name: [] for name in ProjectedPoints._fields}
+    counts = np.zeros((len(mats), num_frames), dtype=np.int64)
+    step = max(1, max_elements // max(n, 1))
+    for k0 in range(0, len(mats), step):
+        chunk = mats[k0:k0 + step]
+        kc = len(chunk)
+        # 每个坐标一个 (Kc, N) 数组: 一次批量矩阵乘法得到所有候选矩阵下的 u*z, v*z, z
+        if chunk.ndim == 3:
+            cam = [chunk[:, row, :3].dot(xyz_t) + chunk[:, row, 3:] for row in range(3)]
+        else:
+            cam = [np.empty((kc, n), dtype=np.float32) for _ in range(3)]
+            for f in range(num_frames):
+                s = slice(offsets[f], offsets[f + 1])
+                for row in range(3):
+                    cam[row][:, s] = chunk[:, f, row, :3].dot(xyz_t[:, s]) + chunk[:, f, row, 3:]
+        cu, cv, z = cam
+        mask = z > 0
+        if base is not None:
+            mask &= base
+        if bounds is not None:
+            tmp = np.empty_like(z)
+            for c, size in zip((cu, cv), bounds):
+                mask &= c >= 0
+                np.multiply(z, size, out=tmp)
+                mask &= c <= tmp
+
+        flat_mask = mask.ravel()
+        pos = np.flatnonzero(flat_mask)
+        cand = pos // n
+        idx = pos - cand * n
+        zs = z.ravel()[pos]
+        results['u'].append(cu.ravel()[pos] / zs)
+        results['v'].append(cv.ravel()[pos] / zs)
+        results['z'].append(zs)
+        results['intensity'].append(intensity[idx])
+        frame = frame_of_point[idx]
+        results['index'].append(idx - offsets[frame])
+        counts[k0:k0 + kc] = np.bincount(cand * num_frames + frame, minlength=kc * num_frames).reshape(kc, num_frames)
+
+    flat = {name: np.concatenate(arrays) if arrays else np.empty(0, dtype=np.float32)
+            for name, arrays in results.items()}
+    return BatchProjection(flat['u'], flat['v'], flat['z'], flat['intensity'].astype(np.float32, copy=False),
+                           flat['index'], counts)
@@ -0,0 +1,177 @@
+import os
+import numpy as np
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+# render.py
+# 功能: 不经过matplotlib, 直接把点云按深度/反射率着色写入图像数组
+# 同一像素有多个点时, 用z-buffer保留深度最近的点
+
+PANEL_GAP = 4
+
+
+def rainbow_lut(n=256, reverse=True):
+    """(n, 3) uint8 lookup table matching matplotlib's 'rainbow' ('rainbow_r' when reverse)."""
+    x = np.linspace(0, 1, n)
+    if reverse:
+        x = x[::-1]
+    lut = np.empty((n, 3))
+    lut[:, 0] = np.abs(2 * x - 0.5)
+    lut[:, 1] = np.sin(np.pi * x)
+    lut[:, 2] = np.cos(np.pi * x / 2)
+    return (np.clip(lut, 0, 1) * 255 + 0.5).astype(np.uint8)
+
+
+RAINBOW_R = rainbow_lut()
+
+
+def colorize(values, lut=RAINBOW_R, vmin=None, vmax=None):
+    """Map values to uint8 RGB colors, normalised to [vmin, vmax] (data range by default)."""
+    values = np.asarray(values, dtype=np.float32)
+    if len(values) == 0:
+        return np.empty((0, 3), dtype=np.uint8)
+    vmin = values.min() if vmin is None else vmin
+    vmax = values.max() if vmax is None else vmax
+    scale = (len(lut) - 1) / (vmax - vmin) if vmax > vmin else 0.0
+    idx = (values - np.float32(vmin)) * np.float32(scale)
+    np.clip(idx, 0, len(lut) - 1, out=idx)
+    return lut[idx.astype(np.intp)]
+
+
+def _disc_offsets(radius):
+    r = int(radius)
+    dv, du = np.mgrid[-r:r + 1, -r:r + 1]
+    inside = du * du + dv * dv <= r * r + r
+    return du[inside], dv[inside]
+
+
+def zbuffer(shape, u, v, depth, radius=1):
+    """Resolve which point is visible in each covered pixel.
+
+    Each point covers a disc of the given pixel radius; where discs overlap, the point
+    with the smallest depth wins. Returns (flat pixel index, point index) pairs.
+    """
+    h, w = shape[:2]
+    n = len(u)
+    if n == 0:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+    # 按深度从近到远编号, 每个像素保留编号最小 (最近) 的点
+    order = np.argsort(depth)
+    rank = np.empty(n, dtype=np.int32)
+    rank[order] = np.arange(n, dtype=np.int32)
+    du, dv = _disc_offsets(radius)
+    pu = (np.asarray(u).astype(np.intp)[:, None] + du).ravel()
+    pv = (np.asarray(v).astype(np.intp)[:, None] + dv).ravel()
+    inside = (pu >= 0) & (pu < w) & (pv >= 0) & (pv < h)
+    pix = (pv * w + pu)[inside]
+    rank = np.repeat(rank, len(du))[inside]
+    buf = np.full(h * w, n, dtype=np.int32)
+    np.minimum.at(buf, pix, rank)
+    pix = np.flatnonzero(buf < n)
+    return pix, order[buf[pix]]
+
+
+def paint(canvas, pix, colors, alpha=0.5):
+    """Blend colors (one per pixel) into canvas (H, W, 3) uint8 at flat pixel indices, in place."""
+    flat = canvas.reshape(-1, canvas.shape[2])
+    if alpha >= 1:
+        flat[pix] = colors
+        return canvas
+    a = int(round(alpha * 256))
+    blended = flat[pix].astype(np.uint16) * (256 - a) + colors.astype(np.uint16) * a
+    flat[pix] = (blended >> 8).astype(np.uint8)
+    return canvas
+
+
+def splat(canvas, u, v, depth, colors, radius=1, alpha=0.5):
+    """Draw colored points (one color per point) into canvas in place, nearest point wins."""
+    pix, point = zbuffer(canvas.shape, u, v, depth, radius)
+    return paint(canvas, pix, colors[point], alpha)
+
+
+def stack_panels(panels, vertical=True, gap=PANEL_GAP):
+    """Concatenate equally sized panels with a white gap, like the subplot layout."""
+    h, w, c = panels[0].shape
+    n = len(panels)
+    if vertical:
+        out = np.full((n * h + (n - 1) * gap, w, c), 255, dtype=np.uint8)
+        for i, p in enumerate(panels):
+            out[i * (h + gap):i * (h + gap) + h] = p
+    else:
+        out = np.full((h, n * w + (n - 1) * gap, c), 255, dtype=np.uint8)
+        for i, p in enumerate(panels):
+            out[:, i * (w + gap):i * (w + gap) + w] = p
+    return out
+
+
+def render_projection(img, u, v, z, reflectance, vertical=True, radius=1, alpha=0.5, lut=RAINBOW_R):
+    """Image / Depth Mix / Reflectance Mix panels as one RGB uint8 array."""
+    img = to_uint8(img)
+    # 两个面板的点位置和遮挡关系相同, z-buffer只算一次
+    pix, point = zbuffer(img.shape, u, v, z, radius)
+    depth_mix = paint(img.copy(), pix, colorize(z, lut)[point], alpha)
+    reflectance_mix = paint(img.copy(), pix, colorize(reflectance, lut)[point], alpha)
+    return stack_panels([img, depth_mix, reflectance_mix], vertical)
+
+
+def to_uint8(img):
+    img = np.asarray(img)
+    if img.dtype != np.uint8:
+        # mpimg.imread 读取png得到 [0, 1] 的浮点数
+        img = (np.clip(img, 0, 1) * 255 + 0.5).astype(np.uint8)
+    if img.ndim == 2:
+        img = np.repeat(img[:, :, None], 3, axis=2)
+    return img[:, :, :3]
+
+
+def load_image(img_file):
+    """Read an image file as RGB uint8."""
+    if cv2 is not None:
+        img = cv2.imread(img_file, cv2.IMREAD_COLOR)
+        if img is None:
+            raise FileNotFoundError(img_file)
+        return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    import matplotlib.image as mpimg
+    return to_uint8(mpimg.imread(img_file))
+
+
+def save_image(path, img, png_compression=1, jpeg_quality=90):
+    """Write an RGB uint8 image, via OpenCV when available (fast PNG/JPEG encoders).
+
+    The image is written to <path>.tmp and renamed, so an interrupted write never leaves a
+    truncated file at path (batch runs skip frames whose output exists).
+    """
+    ext = path.rsplit('.', 1)[-1].lower()
+    tmp_path = path + '.tmp'
+    if cv2 is not None:
+        params = []
+        if ext == 'png':
+            # RLE策略的zlib编码比默认策略快得多, 体积相近
+            params = [cv2.IMWRITE_PNG_COMPRESSION, png_compression, cv2.IMWRITE_PNG_STRATEGY, cv2.IMWRITE_PNG_STRATEGY_RLE]
+        elif ext in ('jpg', 'jpeg'):
+            params = [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality]
+        ok, data = cv2.imencode('.' + ext, cv2.cvtColor(img, cv2.COLOR_RGB2BGR), params)
+        if not ok:
+            raise IOError(f'failed to write {path}')
+        with open(tmp_path, 'wb') as f:
+            f.write(data.tobytes())
+    else:
+        from PIL import Image
+        # 临时文件的扩展名不能决定格式, 显式给出
+        fmt = 'JPEG' if ext in ('jpg', 'jpeg') else ext.upper()
+        Image.fromarray(img).save(tmp_path, format=fmt, compress_level=png_compression, quality=jpeg_quality)
+    os.replace(tmp_path, path)
+
+
+def image_size(img_file):
+    """(height, width) of an image file, reading only the header when PIL is available."""
+    try:
+        from PIL import Image
+    except ImportError:
+        return load_image(img_file).shape[:2]
+    with Image.open(img_file) as img:
+        w, h = img.size
+    return h, w
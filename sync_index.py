@@ -0,0 +1,169 @@
+import os
+import csv
+import json
+import glob
+import numpy as np
+
+# sync_index.py
+# 功能: 按时间戳将多个传感器的数据帧一一对应
+# 1.文件名中的时间戳只解析一次, 统一转为 int64 纳秒并排序
+# 2.用 np.searchsorted 查找最近帧, O((N+M) log M)
+# 3.支持最大时间差容限、一对一匹配 (参考帧不重复使用) 以及多个传感器
+# 4.输出清单 (csv / jsonl / parquet), 或用硬链接/软链接代替拷贝
+
+# 纯数字时间戳按位数判断单位: 秒 / 毫秒 / 微秒 / 纳秒
+_DIGITS_TO_NS = {10: 10 ** 9, 13: 10 ** 6, 16: 10 ** 3, 19: 1}
+
+
+def parse_timestamp(name):
+    """Parse a file stem like '1702895061262535' (us) or '1702895061.262535' (s) to int64 ns."""
+    if '.' in name:
+        sec, frac = name.split('.', 1)
+        return int(sec) * 10 ** 9 + int((frac + '000000000')[:9])
+    digits = len(name)
+    if digits not in _DIGITS_TO_NS:
+        # 其他位数按秒和纳秒之间最接近的单位处理
+        digits = min(_DIGITS_TO_NS, key=lambda d: abs(d - digits))
+    return int(name) * _DIGITS_TO_NS[digits]
+
+
+class SensorIndex:
+    """Files of one sensor sorted by timestamp (stamps are int64 nanoseconds)."""
+
+    def __init__(self, data_dir, ext):
+        paths = glob.glob(os.path.join(data_dir, f'*{ext}'))
+        names = [os.path.splitext(os.path.basename(p))[0] for p in paths]
+        stamps = np.array([parse_timestamp(n) for n in names], dtype=np.int64)
+        order = np.argsort(stamps, kind='stable')
+        self.data_dir = data_dir
+        self.ext = ext
+        self.stamps = stamps[order]
+        self.names = [names[i] for i in order]
+        self.paths = [paths[i] for i in order]
+
+    def __len__(self):
+        return len(self.stamps)
+
+
+def match_nearest(query, ref, max_skew=None):
+    """Index of the nearest ref stamp for every query stamp (both int64, ref sorted).
+
+    Returns (index, skew) where skew = ref - query in ns; index is -1 when ref is empty
+    or the nearest frame is further than max_skew.
+    """
+    query = np.asarray(query, dtype=np.int64)
+    ref = np.asarray(ref, dtype=np.int64)
+    if len(ref) == 0:
+        return np.full(len(query), -1, dtype=np.int64), np.zeros(len(query), dtype=np.int64)
+    right = np.clip(np.searchsorted(ref, query), 0, len(ref) - 1)
+    left = np.clip(right - 1, 0, len(ref) - 1)
+    use_left = np.abs(query - ref[left]) <= np.abs(ref[right] - query)
+    index = np.where(use_left, left, right)
+    skew = ref[index] - query
+    if max_skew is not None:
+        index[np.abs(skew) > max_skew] = -1
+    return index, skew
+
+
+def match_one_to_one(query, ref, max_skew=None):
+    """Like match_nearest, but every ref frame is used at most once.
+
+    Candidate pairs (each query with its two neighbouring ref frames) are accepted greedily
+    in order of increasing time difference.
+    """
+    query = np.asarray(query, dtype=np.int64)
+    ref = np.asarray(ref, dtype=np.int64)
+    n = len(query)
+    index = np.full(n, -1, dtype=np.int64)
+    skew = np.zeros(n, dtype=np.int64)
+    if len(ref) == 0 or n == 0:
+        return index, skew
+    right = np.clip(np.searchsorted(ref, query), 0, len(ref) - 1)
+    left = np.clip(right - 1, 0, len(ref) - 1)
+    cand_q = np.concatenate([np.arange(n), np.arange(n)])
+    cand_r = np.concatenate([left, right])
+    cand_dt = np.abs(ref[cand_r] - query[cand_q])
+    if max_skew is not None:
+        keep = cand_dt <= max_skew
+        cand_q, cand_r, cand_dt = cand_q[keep], cand_r[keep], cand_dt[keep]
+    order = np.argsort(cand_dt, kind='stable')
+    used = np.zeros(len(ref), dtype=bool)
+    for q, r in zip(cand_q[order].tolist(), cand_r[order].tolist()):
+        if index[q] < 0 and not used[r]:
+            index[q] = r
+            used[r] = True
+    matched = index >= 0
+    skew[matched] = ref[index[matched]] - query[matched]
+    return index, skew
+
+
+def synchronize(reference, others, max_skew=None, one_to_one=False):
+    """Match every frame of the reference sensor to the other sensors.
+
+    reference: SensorIndex. others: {sensor name: SensorIndex}. max_skew in ns.
+    Returns a list of manifest rows (dicts); frames without a match within max_skew
+    in any sensor are dropped.
+    """
+    match = match_one_to_one if one_to_one else match_nearest
+    matches = {name: match(reference.stamps, idx.stamps, max_skew) for name, idx in others.items()}
+    valid = np.ones(len(reference), dtype=bool)
+    for index, _ in matches.values():
+        valid &= index >= 0
+
+    rows = []
+    for i in np.flatnonzero(valid).tolist():
+        row = {'stamp_ns': int(reference.stamps[i]), 'reference': reference.paths[i]}
+        for name, (index, skew) in matches.items():
+            row[name] = others[name].paths[index[i]]
+            row[f'{name}_skew_ns'] = int(skew[i])
+        rows.append(row)
+    return rows
+
+
+def write_manifest(rows, path):
+    """Write manifest rows as .csv, .jsonl or .parquet (needs pandas) by file extension."""
+    ext = os.path.splitext(path)[1].lower()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if ext == '.jsonl':
+        with open(path, 'w') as f:
+            for row in rows:
+                f.write(json.dumps(row) + '\n')
+    elif ext == '.parquet':
+        import pandas as pd
+        pd.DataFrame(rows).to_parquet(path)
+    else:
+        fields = list(rows[0]) if rows else ['stamp_ns', 'reference']
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+def read_manifest(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.jsonl':
+        with open(path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+    if ext == '.parquet':
+        import pandas as pd
+        return pd.read_parquet(path).to_dict('records')
+    with open(path, newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def link_file(src, dst, mode='hardlink'):
+    """Place src at dst without copying data when possible ('hardlink', 'symlink' or 'copy')."""
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if mode == 'symlink':
+        os.symlink(os.path.abspath(src), dst)
+        return
+    if mode == 'hardlink':
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            # 跨文件系统无法硬链接时退回拷贝
+            pass
+    import shutil
+    shutil.copy(src, dst)
@@ -0,0 +1,171 @@
+import os
+import glob
+import struct
+import numpy as np
+
+# velo_scan.py
+# 功能: KITTI velodyne .bin 点云的内存映射读取
+# 1.np.memmap 映射文件, 只有真正访问的部分才会被读入内存
+# 2.按固定点数分块迭代, 拼接的大地图也不需要一次性载入
+# 3.可选的紧凑缓存: xyz 存 float16, 反射率存 uint8 (7字节/点, 原始为16字节/点),
+#   文件头带整帧的包围盒, ROI与包围盒不相交时不读取点数据
+#   (KITTI 数据源的 scan_cache, 命令行 --scan-cache, 见 frame_source.py / cli.py)
+
+POINT_DIM = 4
+COMPACT_MAGIC = b'VELC'
+COMPACT_VERSION = 1
+# magic, version, 点数, 包围盒 (xmin, ymin, zmin, xmax, ymax, zmax)
+COMPACT_HEADER = struct.Struct('<4sII6f')
+
+
+def open_scan(path):
+    """Memory-map a KITTI .bin scan as a read-only (N, 4) float32 array."""
+    if os.path.getsize(path) == 0:
+        return np.empty((0, POINT_DIM), dtype=np.float32)
+    return np.memmap(path, dtype=np.float32, mode='r').reshape((-1, POINT_DIM))
+
+
+def roi_mask(points, roi):
+    """Boolean mask of points inside roi = ((xmin, ymin, zmin), (xmax, ymax, zmax))."""
+    lo, hi = roi
+    mask = np.ones(len(points), dtype=bool)
+    for axis in range(3):
+        if lo[axis] is not None and np.isfinite(lo[axis]):
+            mask &= points[:, axis] >= lo[axis]
+        if hi[axis] is not None and np.isfinite(hi[axis]):
+            mask &= points[:, axis] <= hi[axis]
+    return mask
+
+
+def iter_chunks(scans, chunk_size=1 << 16, roi=None):
+    """Yield (n, 4) float32 chunks of at most chunk_size points from one or more scans.
+
+    Without roi the chunks are views into the memory map; with roi each chunk is filtered.
+    """
+    if isinstance(scans, np.ndarray):
+        scans = [scans]
+    for scan in scans:
+        if isinstance(scan, str):
+            scan = open_scan(scan)
+        for start in range(0, len(scan), chunk_size):
+            chunk = scan[start:start + chunk_size]
+            if roi is not None:
+                chunk = chunk[roi_mask(chunk, roi)]
+            yield chunk
+
+
+def write_compact(scan, path):
+    """Write a scan in the compact cache format (float16 xyz + uint8 intensity)."""
+    scan = np.asarray(scan, dtype=np.float32)
+    n = len(scan)
+    if n:
+        bbox = np.concatenate([scan[:, :3].min(axis=0), scan[:, :3].max(axis=0)])
+    else:
+        bbox = np.zeros(6, dtype=np.float32)
+    intensity = np.clip(np.round(scan[:, 3] * 255), 0, 255).astype(np.uint8)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(COMPACT_HEADER.pack(COMPACT_MAGIC, COMPACT_VERSION, n, *bbox))
+        f.write(scan[:, :3].astype('<f2').tobytes())
+        f.write(intensity.tobytes())
+    os.replace(tmp_path, path)
+
+
+def read_compact_header(path):
+    with open(path, 'rb') as f:
+        magic, version, n, *bbox = COMPACT_HEADER.unpack(f.read(COMPACT_HEADER.size))
+    if magic != COMPACT_MAGIC or version != COMPACT_VERSION:
+        raise ValueError(f'{path} is not a compact velodyne cache file')
+    return n, (tuple(bbox[:3]), tuple(bbox[3:]))
+
+
+def bbox_intersects(bbox, roi):
+    (blo, bhi), (rlo, rhi) = bbox, roi
+    for axis in range(3):
+        if rlo[axis] is not None and bhi[axis] < rlo[axis]:
+            return False
+        if rhi[axis] is not None and blo[axis] > rhi[axis]:
+            return False
+    return True
+
+
+def read_compact(path, roi=None):
+    """Read a compact cache file back to an (N, 4) float32 array, optionally cropped to roi."""
+    n, bbox = read_compact_header(path)
+    if n == 0 or (roi is not None and not bbox_intersects(bbox, roi)):
+        return np.empty((0, POINT_DIM), dtype=np.float32)
+    data = np.memmap(path, dtype=np.uint8, mode='r', offset=COMPACT_HEADER.size)
+    xyz = data[:n * 6].view('<f2').reshape(n, 3)
+    intensity = data[n * 6:n * 7]
+    if roi is not None:
+        mask = roi_mask(xyz, roi)
+        xyz = xyz[mask]
+        intensity = intensity[mask]
+    res = np.empty((len(xyz), POINT_DIM), dtype=np.float32)
+    res[:, :3] = xyz
+    res[:, 3] = intensity * np.float32(1 / 255.0)
+    return res
+
+
+def cache_file(path, cache_dir):
+    """Compact cache file of scan path in cache_dir, written on first use and rewritten when path is newer."""
+    cache_path = os.path.join(cache_dir, os.path.splitext(os.path.basename(path))[0] + '.velc')
+    if not os.path.exists(cache_path) or os.path.getmtime(cache_path) < os.path.getmtime(path):
+        os.makedirs(cache_dir, exist_ok=True)
+        write_compact(open_scan(path), cache_path)
+    return cache_path
+
+
+def load_scan(path, cache_dir=None, roi=None):
+    """Scan path as (N, 4) float32, through the compact cache in cache_dir when given, cropped to roi."""
+    if cache_dir is not None:
+        return read_compact(cache_file(path, cache_dir), roi)
+    scan = open_scan(path)
+    if roi is not None:
+        scan = scan[roi_mask(scan, roi)]
+    return scan
+
+
+class ScanSource:
+    """Indexed access to the .bin scans of a velodyne directory.
+
+    With cache_dir set, scans are read through the compact cache, which is built on first use
+    and rebuilt when the .bin file is newer.
+    """
+
+    def __init__(self, velo_dir='data_object_velodyne/testing/velodyne', cache_dir=None):
+        self.velo_dir = velo_dir
+        self.cache_dir = cache_dir
+        self.paths = sorted(glob.glob(os.path.join(velo_dir, '*.bin')))
+        self.names = [os.path.splitext(os.path.basename(p))[0] for p in self.paths]
+        self._index = {name: i for i, name in enumerate(self.names)}
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def index_of(self, name):
+        return self._index[name]
+
+    def cache_path(self, i):
+        return os.path.join(self.cache_dir, self.names[i] + '.velc')
+
+    def load(self, i, roi=None):
+        """Scan i as (N, 4) float32; a memory map when neither cache nor roi is used."""
+        if isinstance(i, str):
+            i = self._index[i]
+        return load_scan(self.paths[i], self.cache_dir, roi)
+
+    def __getitem__(self, i):
+        return self.load(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.load(i)
+
+    def chunks(self, chunk_size=1 << 16, roi=None):
+        """Stream all scans as fixed-size chunks, e.g. to build an aggregated map."""
+        if self.cache_dir is None:
+            return iter_chunks(self.paths, chunk_size, roi)
+        return (chunk for i in range(len(self)) for chunk in iter_chunks(self.load(i, roi), chunk_size))
@@ -0,0 +1,185 @@
+import os
+import sys
+import shlex
+import functools
+import subprocess
+import numpy as np
+from tqdm import tqdm
+import pipeline
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+# video_export.py
+# 功能: 把整个序列的投影结果直接编码成一个视频 (或写入图像管道), 不再逐帧保存PNG
+# 1.读取 / 投影 / 绘制在 pipeline.py 的多线程流水线中并行, 按输入顺序重排后由主线程写入编码器
+# 2.同时在处理中的帧数不超过 window, 内存占用与序列长度无关
+# 3.输出: OpenCV VideoWriter (.mp4 / .avi), 或把原始RGB帧写到外部程序 (例如 ffmpeg) 的stdin
+# 4.失败的帧跳过, 记录在 pipeline.errors() 中
+
+DEFAULT_FPS = 10
+DEFAULT_WINDOW = 16
+# 各阶段默认线程数 (编码在主线程中)
+DEFAULT_WORKERS = {'decode': 2, 'project': 1, 'render': 2}
+# 扩展名对应的 VideoWriter 编码
+FOURCC = {'.mp4': 'mp4v', '.avi': 'MJPG', '.mkv': 'mp4v'}
+# --pipe 的示例命令, {width} {height} {fps} {out} 在第一帧时替换
+FFMPEG_CMD = ('ffmpeg -y -loglevel error -f rawvideo -pix_fmt rgb24 -s {width}x{height} -r {fps} -i - '
+              '-c:v libx264 -preset veryfast -crf 23 -pix_fmt yuv420p {out}')
+
+
+def frame_size(shape, scale=1.0):
+    """(width, height) of an output frame: scaled, rounded down to even numbers (needed by yuv420p)."""
+    h, w = shape[:2]
+    return max(2, int(w * scale) // 2 * 2), max(2, int(h * scale) // 2 * 2)
+
+
+def fit_frame(img, size):
+    """RGB uint8 image resized to size (width, height) when it differs."""
+    if (img.shape[1], img.shape[0]) == size:
+        return img
+    if cv2 is not None:
+        return cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+    # 最近邻缩放
+    h, w = img.shape[:2]
+    rows = np.arange(size[1]) * h // size[1]
+    cols = np.arange(size[0]) * w // size[0]
+    return img[rows[:, None], cols]
+
+
+class CvVideoWriter:
+    """cv2.VideoWriter opened with the size of the first frame; frames are RGB uint8."""
+
+    def __init__(self, path, fps=DEFAULT_FPS, fourcc=None, scale=1.0):
+        if cv2 is None:
+            raise ImportError('OpenCV is required for video output (or use a pipe writer)')
+        self.path = path
+        self.fps = fps
+        self.fourcc = fourcc or FOURCC.get(os.path.splitext(path)[1].lower(), 'mp4v')
+        self.scale = scale
+        self.size = None
+        self.count = 0
+        self._writer = None
+
+    def write(self, img):
+        if self._writer is None:
+            self.size = frame_size(img.shape, self.scale)
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*self.fourcc), self.fps, self.size)
+            if not self._writer.isOpened():
+                raise IOError(f'cannot open video writer for {self.path} ({self.fourcc})')
+        self._writer.write(cv2.cvtColor(fit_frame(img, self.size), cv2.COLOR_RGB2BGR))
+        self.count += 1
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.release()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PipeWriter:
+    """Write raw rgb24 frames to the stdin of a command, e.g. FFMPEG_CMD.
+
+    cmd may contain {width} {height} {fps} {out}; it is started with the first frame.
+    """
+
+    def __init__(self, cmd, out, fps=DEFAULT_FPS, scale=1.0):
+        self.cmd = cmd
+        self.out = out
+        self.fps = fps
+        self.scale = scale
+        self.size = None
+        self.count = 0
+        self._proc = None
+
+    def write(self, img):
+        if self._proc is None:
+            self.size = frame_size(img.shape, self.scale)
+            args = [a.format(width=self.size[0], height=self.size[1], fps=self.fps, out=self.out)
+                    for a in shlex.split(self.cmd)]
+            self._proc = subprocess.Popen(args, stdin=subprocess.PIPE)
+        try:
+            self._proc.stdin.write(np.ascontiguousarray(fit_frame(img, self.size)).tobytes())
+        except BrokenPipeError:
+            raise IOError(f'{self.cmd.split()[0]} exited with code {self._proc.wait()}')
+        self.count += 1
+
+    def close(self):
+        if self._proc is not None:
+            self._proc.stdin.close()
+            code = self._proc.wait()
+            self._proc = None
+            if code != 0:
+                raise IOError(f'{self.cmd.split()[0]} exited with code {code}')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def render_panels(item, vertical=True, radius=1):
+    # 与 pipeline.render_frame 相同, 只把绘制好的图像传给写入线程
+    return pipeline.render_frame(item, vertical, radius)[1]
+
+
+def video_pipeline(vertical=True, radius=1, workers=None, queue_size=4):
+    """Pipeline for Frames: decode -> project -> render, outputs the RGB overlay panels."""
+    workers = dict(DEFAULT_WORKERS, **(workers or {}))
+    fns = {
+        'decode': pipeline.decode_frame,
+        'project': pipeline.project_frame,
+        'render': functools.partial(render_panels, vertical=vertical, radius=radius),
+    }
+    return pipeline.Pipeline([pipeline.Stage(name, fn, workers[name], queue_size) for name, fn in fns.items()])
+
+
+def export_video(frames, writer, vertical=True, radius=1, workers=None, window=DEFAULT_WINDOW, total=None,
+                 verbose=True):
+    """Render every frame (a frame source or iterable of Frames) and write them in order to writer.
+
+    writer is a CvVideoWriter / PipeWriter (anything with write(rgb) and close()).
+    Returns the Pipeline, whose stats() and errors() describe the run.
+    """
+    pipe = video_pipeline(vertical, radius, workers, queue_size=max(1, window // 4))
+    if total is None and hasattr(frames, '__len__'):
+        total = len(frames)
+    with writer:
+        for panels in tqdm(pipe.run_ordered(iter(frames), window), total=total, disable=not verbose):
+            if panels is not None:
+                writer.write(panels)
+    if verbose:
+        print(pipe.format_stats())
+        errors = pipe.errors()
+        if errors:
+            print(f'skipped: { {name: sorted(e)[:10] for name, e in errors.items()} }')
+    return pipe
+
+
+def make_writer(out, fps=DEFAULT_FPS, scale=1.0, pipe_cmd=None, fourcc=None):
+    if pipe_cmd:
+        return PipeWriter(pipe_cmd, out, fps, scale)
+    return CvVideoWriter(out, fps, fourcc, scale)
+
+
+def main():
+    # python3 cli.py video --dataset kitti|ros ... (见 cli.py); 第一个参数仍可直接写数据集
+    import cli
+    argv = sys.argv[1:]
+    if argv[:1] in (['kitti'], ['ros']):
+        argv = ['--dataset'] + argv
+    cli.main(['video'] + argv)
+
+
+if __name__ == '__main__':
+    main()